@@ -5,12 +5,44 @@ from telegram.ext import Application
 from config import config
 from handlers import register_handlers
 from database.db_manager import DatabaseManager
+from services.ai_budget import ai_budget
+from services.ai_telemetry import ai_telemetry
+from services.ai_registry import ai_registry
+from services.image_processor import image_processor
+from services.queue_manager import message_queue
+from services.update_journal import update_journal
+from services.lifecycle import lifecycle
+from services.verification import restore_pending_verifications
+from services.update_scheduler import update_scheduler
+from services.send_scheduler import outbound_scheduler
+from database import models as db
+from handlers.user_handler import handle_message, reject_message
 
 async def post_init(app: Application):
     config.BOT_ID = app.bot.id
     config.BOT_USERNAME = app.bot.username
     print(f"Bot ID: {config.BOT_ID} 已设置")
     print(f"Bot Username: {config.BOT_USERNAME} 已设置")
+    ai_telemetry.start()
+    await ai_budget.start(app.bot)
+    queue_max_size = int(await db.get_setting('queue_max_size', '1000'))
+    await restore_pending_verifications()
+    await message_queue.start(update_journal.wrap(handle_message), queue_max_size, on_timeout=reject_message)
+    # 重放上次退出时尚未处理完的消息，需在开始轮询之前完成
+    await update_journal.start(app, message_queue.submit)
+    if config.AI_WARMUP_DELAY >= 0:
+        # 轮询开始后再在后台线程中加载 AI SDK 与 Pillow，不阻塞启动
+        app.bot_data['warmup_tasks'] = [
+            asyncio.create_task(ai_registry.warm_up(delay=config.AI_WARMUP_DELAY)),
+            asyncio.create_task(image_processor.warm_up()),
+        ]
+
+async def post_stop(app: Application):
+    # 在关闭 Bot 连接之前排空队列，已入队的消息仍能发送出去
+    await lifecycle.drain()
+
+async def post_shutdown(app: Application):
+    await lifecycle.close()
 
 def main():
 
@@ -24,7 +56,16 @@ def main():
     asyncio.run(db_manager.initialize())
     
     
-    app = Application.builder().token(config.BOT_TOKEN).post_init(post_init).build()
+    app = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(update_scheduler)
+        .rate_limiter(outbound_scheduler)
+        .build()
+    )
     
     
     register_handlers(app)
@@ -34,6 +75,7 @@ def main():
     
     
     logging.info("Bot启动中...")
+    # 默认的 stop_signals 已包含 SIGTERM，docker stop / watchtower 更新时与 Ctrl+C 一样走优雅关闭流程
     app.run_polling()
 
 if __name__ == '__main__':
@@ -15,14 +15,56 @@ class Config:
     AI_PROVIDER = os.getenv("AI_PROVIDER", "gemini").lower()
 
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    GEMINI_FILTER_MODEL = os.getenv("GEMINI_FILTER_MODEL", "gemini-2.5-flash")
+    GEMINI_CASCADE_MODEL = os.getenv("GEMINI_CASCADE_MODEL", "gemini-2.5-flash-lite")
 
     CUSTOM_AI_API_URL = os.getenv("CUSTOM_AI_API_URL")
     CUSTOM_AI_API_KEY = os.getenv("CUSTOM_AI_API_KEY")
     CUSTOM_AI_MODEL = os.getenv("CUSTOM_AI_MODEL", "gpt-4")
     CUSTOM_AI_VERIFICATION_MODEL = os.getenv("CUSTOM_AI_VERIFICATION_MODEL")
+    CUSTOM_AI_CASCADE_MODEL = os.getenv("CUSTOM_AI_CASCADE_MODEL")
 
     ENABLE_AI_FILTER = os.getenv("ENABLE_AI_FILTER", "true").lower() == "true"
     AI_CONFIDENCE_THRESHOLD = int(os.getenv("AI_CONFIDENCE_THRESHOLD", "70"))
+    AI_CASCADE_ENABLED = os.getenv("AI_CASCADE_ENABLED", "true").lower() == "true"
+    AI_CASCADE_ESCALATE_IMAGES = os.getenv("AI_CASCADE_ESCALATE_IMAGES", "true").lower() == "true"
+
+    AI_DAILY_TOKEN_SOFT_LIMIT = int(os.getenv("AI_DAILY_TOKEN_SOFT_LIMIT", "0"))
+    AI_DAILY_TOKEN_HARD_LIMIT = int(os.getenv("AI_DAILY_TOKEN_HARD_LIMIT", "0"))
+    AI_DAILY_REQUEST_SOFT_LIMIT = int(os.getenv("AI_DAILY_REQUEST_SOFT_LIMIT", "0"))
+    AI_DAILY_REQUEST_HARD_LIMIT = int(os.getenv("AI_DAILY_REQUEST_HARD_LIMIT", "0"))
+    LOCAL_FILTER_KEYWORDS = [
+        k.strip() for k in os.getenv(
+            "LOCAL_FILTER_KEYWORDS", "加群,兼职,刷单,博彩,USDT,返利,免费领取,代理"
+        ).split(",") if k.strip()
+    ]
+    LOCAL_FILTER_BLOCK_LINKS = os.getenv("LOCAL_FILTER_BLOCK_LINKS", "true").lower() == "true"
+    AI_STRUCTURED_OUTPUT = os.getenv("AI_STRUCTURED_OUTPUT", "true").lower() == "true"
+    AI_STREAMING = os.getenv("AI_STREAMING", "true").lower() == "true"
+    AI_WARMUP_DELAY = float(os.getenv("AI_WARMUP_DELAY", "2"))
+    AI_STATUS_DELAY = float(os.getenv("AI_STATUS_DELAY", "1.5"))
+    AI_PROMPT_CACHE = os.getenv("AI_PROMPT_CACHE", "true").lower() == "true"
+    AI_PROMPT_CACHE_TTL = int(os.getenv("AI_PROMPT_CACHE_TTL", "3600"))
+
+    TRUST_ENABLED = os.getenv("TRUST_ENABLED", "true").lower() == "true"
+    TRUST_HIGH_THRESHOLD = float(os.getenv("TRUST_HIGH_THRESHOLD", "80"))
+    TRUST_MEDIUM_THRESHOLD = float(os.getenv("TRUST_MEDIUM_THRESHOLD", "50"))
+    TRUST_HIGH_SAMPLE_RATE = float(os.getenv("TRUST_HIGH_SAMPLE_RATE", "0.1"))
+    TRUST_MEDIUM_SAMPLE_RATE = float(os.getenv("TRUST_MEDIUM_SAMPLE_RATE", "0.5"))
+    TRUST_FULL_AGE_DAYS = int(os.getenv("TRUST_FULL_AGE_DAYS", "30"))
+    TRUST_FULL_MESSAGE_COUNT = int(os.getenv("TRUST_FULL_MESSAGE_COUNT", "50"))
+
+    AI_IMAGE_MAX_EDGE = int(os.getenv("AI_IMAGE_MAX_EDGE", "1024"))
+    AI_IMAGE_FORMAT = os.getenv("AI_IMAGE_FORMAT", "JPEG").upper()
+    AI_IMAGE_QUALITY = int(os.getenv("AI_IMAGE_QUALITY", "80"))
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+    AI_IMAGE_TARGET_EDGE = int(os.getenv("AI_IMAGE_TARGET_EDGE", "512"))
+    MEDIA_DOWNLOAD_MAX_BYTES = int(os.getenv("MEDIA_DOWNLOAD_MAX_BYTES", str(5 * 1024 * 1024)))
+
+    AI_MODEL_PRICES = os.getenv("AI_MODEL_PRICES")
+    AI_TELEMETRY_WINDOW_MINUTES = int(os.getenv("AI_TELEMETRY_WINDOW_MINUTES", "60"))
+    AI_TELEMETRY_BUCKET_MINUTES = int(os.getenv("AI_TELEMETRY_BUCKET_MINUTES", "60"))
+    AI_TELEMETRY_FLUSH_INTERVAL = int(os.getenv("AI_TELEMETRY_FLUSH_INTERVAL", "60"))
 
     VERIFICATION_ENABLED = os.getenv("VERIFICATION_ENABLED", "true").lower() == "true"
     AUTO_UNBLOCK_ENABLED = os.getenv("AUTO_UNBLOCK_ENABLED", "true").lower() == "true"
@@ -31,11 +73,34 @@ class Config:
 
     MAX_WORKERS = int(os.getenv("MAX_WORKERS", "5"))
     QUEUE_TIMEOUT = int(os.getenv("QUEUE_TIMEOUT", "30"))
+    MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+    MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "10000"))
+    SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+    SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", "20"))
+    SEND_GROUP_BURST = int(os.getenv("SEND_GROUP_BURST", "10"))
+    SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+    SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+    SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+    ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "1.0"))
+    BURST_WINDOW = float(os.getenv("BURST_WINDOW", "0"))
+    BURST_MAX_BATCH = int(os.getenv("BURST_MAX_BATCH", "10"))
+    SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+    UPDATE_JOURNAL_ENABLED = os.getenv("UPDATE_JOURNAL_ENABLED", "true").lower() == "true"
+    UPDATE_JOURNAL_MAX_REPLAYS = int(os.getenv("UPDATE_JOURNAL_MAX_REPLAYS", "3"))
+    UPDATE_JOURNAL_RETENTION = int(os.getenv("UPDATE_JOURNAL_RETENTION", "3600"))
+    UPDATE_JOURNAL_COMPACT_INTERVAL = int(os.getenv("UPDATE_JOURNAL_COMPACT_INTERVAL", "300"))
 
     VERIFICATION_TIMEOUT = int(os.getenv("VERIFICATION_TIMEOUT", "300"))
     MAX_VERIFICATION_ATTEMPTS = int(os.getenv("MAX_VERIFICATION_ATTEMPTS", "3"))
 
     MAX_MESSAGES_PER_MINUTE = int(os.getenv("MAX_MESSAGES_PER_MINUTE", "30"))
+    # 速率限制与验证会话的状态存储：memory（进程内）或 sqlite（多个进程共享）
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+    STATE_DATABASE_PATH = os.getenv("STATE_DATABASE_PATH", "./data/state.db")
+    # 默认只有每分钟 MAX_MESSAGES_PER_MINUTE 条一个层级、每条消息计 1，更严格的分层与计费需显式配置
+    RATE_LIMITS_VERIFIED = os.getenv("RATE_LIMITS_VERIFIED", "")
+    RATE_LIMITS_UNVERIFIED = os.getenv("RATE_LIMITS_UNVERIFIED", "")
+    RATE_LIMIT_COSTS = os.getenv("RATE_LIMIT_COSTS", "")
 
     @classmethod
     def validate(cls):
@@ -35,6 +35,8 @@ class DatabaseManager:
             await self.create_settings_table(db)
             await self.create_statistics_table(db)
             await self.create_filtered_messages_table(db)
+            await self.create_ai_call_stats_table(db)
+            await self.create_update_journal_table(db)
 
             await self.migrate_database(db)
 
@@ -57,7 +59,8 @@ class DatabaseManager:
                 verification_attempts INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                message_count INTEGER DEFAULT 0
+                message_count INTEGER DEFAULT 0,
+                trust_score REAL DEFAULT 0
             )
         ''')
         
@@ -129,6 +132,7 @@ class DatabaseManager:
                 user_id INTEGER PRIMARY KEY,
                 question TEXT NOT NULL,
                 answer TEXT NOT NULL,
+                options TEXT,
                 attempts INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 expires_at TIMESTAMP NOT NULL,
@@ -198,6 +202,39 @@ class DatabaseManager:
         ''')
         await db.execute('CREATE INDEX IF NOT EXISTS idx_filtered_messages_user_id ON filtered_messages(user_id)')
 
+    async def create_ai_call_stats_table(self, db):
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS ai_call_stats (
+                bucket_start INTEGER NOT NULL,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                calls INTEGER DEFAULT 0,
+                parse_failures INTEGER DEFAULT 0,
+                cache_hits INTEGER DEFAULT 0,
+                input_tokens INTEGER DEFAULT 0,
+                cached_tokens INTEGER DEFAULT 0,
+                output_tokens INTEGER DEFAULT 0,
+                cost REAL DEFAULT 0,
+                latency_sum REAL DEFAULT 0,
+                latency_max REAL DEFAULT 0,
+                PRIMARY KEY (bucket_start, provider, model, kind)
+            )
+        ''')
+
+    async def create_update_journal_table(self, db):
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS update_journal (
+                update_id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                payload TEXT NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                received_at INTEGER NOT NULL,
+                completed_at INTEGER
+            )
+        ''')
+        await db.execute('CREATE INDEX IF NOT EXISTS idx_update_journal_completed ON update_journal(completed_at)')
+
     async def get_filtered_messages_by_user(self, user_id, limit=5):
         async with self.get_connection() as db:
             cursor = await db.execute(
@@ -226,6 +263,27 @@ class DatabaseManager:
             if "duplicate column name" not in str(e):
                 raise e
 
+        try:
+            await db.execute('ALTER TABLE users ADD COLUMN trust_score REAL DEFAULT 0')
+            logging.info("数据库迁移：成功为 'users' 表添加 'trust_score' 列。")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" not in str(e):
+                raise e
+
+        try:
+            await db.execute('ALTER TABLE verification_sessions ADD COLUMN options TEXT')
+            logging.info("数据库迁移：成功为 'verification_sessions' 表添加 'options' 列。")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" not in str(e):
+                raise e
+
+        try:
+            await db.execute('ALTER TABLE ai_call_stats ADD COLUMN cached_tokens INTEGER DEFAULT 0')
+            logging.info("数据库迁移：成功为 'ai_call_stats' 表添加 'cached_tokens' 列。")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" not in str(e):
+                raise e
+
 
 
 db_manager = DatabaseManager()
@@ -107,7 +107,7 @@ async def is_blacklisted(user_id: int):
 async def add_to_blacklist(user_id: int, reason: str, blocked_by: int, permanent: bool = False):
     async with db_manager.get_connection() as db:
         await db.execute(
-            'UPDATE users SET is_blacklisted = 1, blacklist_strikes = blacklist_strikes + 1 WHERE user_id = ?',
+            'UPDATE users SET is_blacklisted = 1, blacklist_strikes = blacklist_strikes + 1, trust_score = 0 WHERE user_id = ?',
             (user_id,)
         )
         await db.execute('''
@@ -178,6 +178,171 @@ async def set_user_blacklist_strikes(user_id: int, strikes: int):
         await db.commit()
 
 
+async def get_verified_user_ids() -> list:
+    async with db_manager.get_connection() as db:
+        async with db.execute('SELECT user_id FROM users WHERE is_verified = 1') as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+async def get_setting(key: str, default: str = None):
+    async with db_manager.get_connection() as db:
+        async with db.execute('SELECT value FROM settings WHERE key = ?', (key,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else default
+
+async def increment_user_message_count(user_id: int):
+    async with db_manager.get_connection() as db:
+        await db.execute(
+            'UPDATE users SET message_count = message_count + 1, last_active = ? WHERE user_id = ?',
+            (datetime.now(), user_id)
+        )
+        await db.commit()
+
+async def get_user_trust_inputs(user_id: int):
+    async with db_manager.get_connection() as db:
+        async with db.execute('''
+            SELECT
+                u.created_at,
+                u.message_count,
+                u.blacklist_strikes,
+                u.is_verified,
+                (SELECT COUNT(*) FROM filtered_messages f WHERE f.user_id = u.user_id) as spam_count
+            FROM users u
+            WHERE u.user_id = ?
+        ''', (user_id,)) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return dict(zip([col[0] for col in cursor.description], row))
+            return None
+
+async def update_user_trust_score(user_id: int, trust_score: float):
+    async with db_manager.get_connection() as db:
+        await db.execute(
+            'UPDATE users SET trust_score = ? WHERE user_id = ?',
+            (trust_score, user_id)
+        )
+        await db.commit()
+
+
+async def upsert_ai_call_stats(buckets: dict):
+    async with db_manager.get_connection() as db:
+        await db.executemany('''
+            INSERT INTO ai_call_stats
+            (bucket_start, provider, model, kind, calls, parse_failures, cache_hits,
+             input_tokens, cached_tokens, output_tokens, cost, latency_sum, latency_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bucket_start, provider, model, kind) DO UPDATE SET
+                calls = calls + excluded.calls,
+                parse_failures = parse_failures + excluded.parse_failures,
+                cache_hits = cache_hits + excluded.cache_hits,
+                input_tokens = input_tokens + excluded.input_tokens,
+                cached_tokens = cached_tokens + excluded.cached_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cost = cost + excluded.cost,
+                latency_sum = latency_sum + excluded.latency_sum,
+                latency_max = MAX(latency_max, excluded.latency_max)
+        ''', [
+            (bucket_start, provider, model, kind, v["calls"], v["parse_failures"], v["cache_hits"],
+             v["input_tokens"], v["cached_tokens"], v["output_tokens"], v["cost"], v["latency_sum"],
+             v["latency_max"])
+            for (bucket_start, provider, model, kind), v in buckets.items()
+        ])
+        await db.commit()
+
+async def get_ai_call_stats_totals(since: int):
+    async with db_manager.get_connection() as db:
+        async with db.execute('''
+            SELECT provider, model, kind,
+                   SUM(calls) AS calls,
+                   SUM(parse_failures) AS parse_failures,
+                   SUM(cache_hits) AS cache_hits,
+                   SUM(input_tokens) AS input_tokens,
+                   SUM(cached_tokens) AS cached_tokens,
+                   SUM(output_tokens) AS output_tokens,
+                   SUM(cost) AS cost,
+                   SUM(latency_sum) AS latency_sum,
+                   MAX(latency_max) AS latency_max
+            FROM ai_call_stats
+            WHERE bucket_start >= ?
+            GROUP BY provider, model, kind
+            ORDER BY cost DESC
+        ''', (since,)) as cursor:
+            rows = await cursor.fetchall()
+            if not rows:
+                return []
+            cols = [description[0] for description in cursor.description]
+            return [dict(zip(cols, row)) for row in rows]
+
+
+async def save_verification_sessions(sessions: list):
+    """关闭前保存进行中的人机验证；sessions 为 (user_id, question, answer, options_json, attempts, created_at, expires_at)。"""
+    async with db_manager.get_connection() as db:
+        await db.execute('DELETE FROM verification_sessions')
+        await db.executemany('''
+            INSERT INTO verification_sessions (user_id, question, answer, options, attempts, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', sessions)
+        await db.commit()
+
+async def take_verification_sessions(now: float) -> list:
+    """读出并清空已保存的人机验证，只返回尚未过期的。"""
+    async with db_manager.get_connection() as db:
+        async with db.execute(
+            'SELECT user_id, question, answer, options, attempts, created_at FROM verification_sessions WHERE expires_at > ?',
+            (now,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+            cols = [description[0] for description in cursor.description]
+        await db.execute('DELETE FROM verification_sessions')
+        await db.commit()
+        return [dict(zip(cols, row)) for row in rows]
+
+async def append_update_journal(update_id: int, user_id: int, payload: str, received_at: int) -> bool:
+    """写入一条更新；已存在（重复投递或已重放）时返回 False。"""
+    async with db_manager.get_connection() as db:
+        cursor = await db.execute(
+            'INSERT OR IGNORE INTO update_journal (update_id, user_id, payload, received_at) VALUES (?, ?, ?, ?)',
+            (update_id, user_id, payload, received_at)
+        )
+        await db.commit()
+        return cursor.rowcount > 0
+
+async def complete_update_journal(update_ids: list, completed_at: int):
+    async with db_manager.get_connection() as db:
+        await db.executemany(
+            'UPDATE update_journal SET completed_at = ? WHERE update_id = ? AND completed_at IS NULL',
+            [(completed_at, update_id) for update_id in update_ids]
+        )
+        await db.commit()
+
+async def claim_incomplete_update_journal() -> list:
+    """取出所有未完成的更新（按接收顺序），并把它们的重放次数加一。"""
+    async with db_manager.get_connection() as db:
+        async with db.execute(
+            'SELECT update_id, payload, attempts FROM update_journal WHERE completed_at IS NULL ORDER BY update_id'
+        ) as cursor:
+            rows = await cursor.fetchall()
+        await db.execute('UPDATE update_journal SET attempts = attempts + 1 WHERE completed_at IS NULL')
+        await db.commit()
+        return [{"update_id": row[0], "payload": row[1], "attempts": row[2]} for row in rows]
+
+async def compact_update_journal(before: int) -> int:
+    async with db_manager.get_connection() as db:
+        cursor = await db.execute(
+            'DELETE FROM update_journal WHERE completed_at IS NOT NULL AND completed_at < ?',
+            (before,)
+        )
+        await db.commit()
+        return cursor.rowcount
+
+async def get_update_journal_counts() -> dict:
+    async with db_manager.get_connection() as db:
+        async with db.execute(
+            'SELECT COUNT(*), SUM(completed_at IS NULL) FROM update_journal'
+        ) as cursor:
+            row = await cursor.fetchone()
+            return {"total": row[0] or 0, "incomplete": row[1] or 0}
+
+
 
 from config import config
 
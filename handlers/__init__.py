@@ -1,6 +1,6 @@
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from .command_handler import start, help_command, block, unblock, blacklist, stats, getid
-from .user_handler import handle_message
+from .command_handler import start, help_command, block, unblock, blacklist, stats, getid, ai_stats, ai_budget_status, queue_stats
+from .user_handler import enqueue_message
 from .callback_handler import handle_callback
 from .admin_handler import handle_admin_reply, view_filtered
 from config import config
@@ -17,6 +17,9 @@ def register_handlers(app: Application):
         app.add_handler(CommandHandler("blacklist", blacklist))
         app.add_handler(CommandHandler("stats", stats))
         app.add_handler(CommandHandler("view_filtered", view_filtered))
+        app.add_handler(CommandHandler("ai_stats", ai_stats))
+        app.add_handler(CommandHandler("ai_budget", ai_budget_status))
+        app.add_handler(CommandHandler("queue_stats", queue_stats))
         
         
         app.add_handler(MessageHandler(
@@ -26,10 +29,9 @@ def register_handlers(app: Application):
         
         
         app.add_handler(MessageHandler(
-            (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.AUDIO | filters.VOICE |
-             filters.Document.ALL | filters.Sticker.ALL | filters.ANIMATION) &
+            filters.UpdateType.MESSAGE & ~filters.StatusUpdate.ALL &
             ~filters.COMMAND & filters.ChatType.PRIVATE,
-            handle_message
+            enqueue_message
         ))
         
         
@@ -1,75 +1,13 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import models as db
+from services.album import album_aggregator
+from services.relay import relay_messages
 
 async def _send_reply_to_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    message = update.message
-    
-    
-    if message.text:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=message.text,
-            entities=message.entities,
-            disable_web_page_preview=True
-        )
-    elif message.photo:
-        await context.bot.send_photo(
-            chat_id=user_id,
-            photo=message.photo[-1].file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities
-        )
-    elif message.animation:
-        await context.bot.send_animation(
-            chat_id=user_id,
-            animation=message.animation.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities
-        )
-    elif message.video:
-        await context.bot.send_video(
-            chat_id=user_id,
-            video=message.video.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities
-        )
-    elif message.document:
-        await context.bot.send_document(
-            chat_id=user_id,
-            document=message.document.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities
-        )
-    elif message.audio:
-        await context.bot.send_audio(
-            chat_id=user_id,
-            audio=message.audio.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities
-        )
-    elif message.voice:
-        await context.bot.send_voice(
-            chat_id=user_id,
-            voice=message.voice.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities
-        )
-    elif message.video_note:
-        await context.bot.send_video_note(
-            chat_id=user_id,
-            video_note=message.video_note.file_id
-        )
-    elif message.sticker:
-        await context.bot.send_sticker(
-            chat_id=user_id,
-            sticker=message.sticker.file_id
-        )
+    await relay_messages(context.bot, album_aggregator.messages(update), user_id)
 
-async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message or not update.message.is_topic_message:
-        return
-    
+async def _forward_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     thread_id = update.message.message_thread_id
     
     
@@ -81,6 +19,14 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     await _send_reply_to_user(update, context, user_id)
 
+async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message or not update.message.is_topic_message:
+        return
+    # 管理员发送的相册收齐后整体转发给用户
+    if album_aggregator.add(update, context, _forward_admin_reply):
+        return
+    await _forward_admin_reply(update, context)
+
 async def _format_filtered_messages(messages, page: int, total_pages: int):
     response = f"被过滤的消息 (第 {page}/{total_pages} 页):\n\n"
     
@@ -1,12 +1,14 @@
 import re
 from telegram import Update
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 from services.verification import verify_answer, create_verification
-from services.gemini_service import gemini_service
 from database import models as db
-from utils.media_converter import sticker_to_image
-from services.thread_manager import get_or_create_thread
+from services.album import AlbumView, album_aggregator
+from services.moderation import ModerationStatus, handle_blocked, moderate_message
+from services.thread_manager import speculate_thread
+from services.trust import trust_manager
+from services.update_scheduler import mark_verified
 from .user_handler import _resend_message
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -38,52 +40,28 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if 'pending_update' in context.user_data:
                 pending_update = context.user_data.pop('pending_update')
                 message = pending_update.message
-                image_bytes = None
-
-                if message.photo:
-                    photo_file = await message.photo[-1].get_file()
-                    image_bytes = await photo_file.download_as_bytearray()
-                elif message.sticker and not message.sticker.is_animated and not message.sticker.is_video:
-                    sticker_file = await message.sticker.get_file()
-                    sticker_bytes = await sticker_file.download_as_bytearray()
-                    image_bytes = await sticker_to_image(sticker_bytes)
+                group = album_aggregator.messages(pending_update)
+                # 相册会整体转发，需要审核其中每一项
+                subject = AlbumView(group) if len(group) > 1 else message
+                speculation = speculate_thread(pending_update, context)
 
                 should_forward = True
-                if message.video or message.animation:
-                    pass
+                status = ModerationStatus(context.bot, message).start()
+                try:
+                    analysis_result = await moderate_message(subject)
+                except BaseException:
+                    speculation.abandon()
+                    status.close()
+                    raise
+                if analysis_result.get("is_spam"):
+                    should_forward = False
+                    speculation.abandon()
+                    handle_blocked(user_id, subject, analysis_result, status)
                 else:
-                    analyzing_message = await context.bot.send_message(
-                        chat_id=message.chat_id,
-                        text="正在通过AI分析内容是否包含垃圾信息...",
-                        reply_to_message_id=message.message_id
-                    )
-                    analysis_result = await gemini_service.analyze_message(message, image_bytes)
-                    if analysis_result.get("is_spam"):
-                        should_forward = False
-                        media_type = None
-                        media_file_id = None
-                        if message.photo:
-                            media_type = "photo"
-                            media_file_id = message.photo[-1].file_id
-                        elif message.sticker:
-                            media_type = "sticker"
-                            media_file_id = message.sticker.file_id
-
-                        await db.save_filtered_message(
-                            user_id=user_id,
-                            message_id=message.message_id,
-                            content=message.text or message.caption,
-                            reason=analysis_result.get("reason"),
-                            media_type=media_type,
-                            media_file_id=media_file_id,
-                        )
-                        reason = analysis_result.get("reason", "未提供原因")
-                        await analyzing_message.edit_text(f"您的消息已被系统拦截，因此未被转发\n\n原因：{reason}")
-                    else:
-                        await analyzing_message.delete()
+                    status.close()
 
                 if should_forward:
-                    thread_id, is_new = await get_or_create_thread(pending_update, context)
+                    thread_id, is_new = await speculation.commit(pending_update)
                     if not thread_id:
                         await pending_update.message.reply_text("无法创建或找到您的话题，请联系管理员。")
                         return
@@ -91,10 +69,12 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     try:
                         if not is_new:
                             await _resend_message(pending_update, context, thread_id)
+                        context.application.create_task(trust_manager.record_forwarded(user_id), update=pending_update)
                     except BadRequest as e:
                         if "Message thread not found" in e.message:
                             await db.update_user_thread_id(user_id, None)
                             await db.update_user_verification(user_id, False)
+                            mark_verified(user_id, False)
                             
                             context.user_data['pending_update'] = pending_update
                             question, keyboard = await create_verification(user_id)
@@ -111,6 +91,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         else:
                             print(f"发送消息时发生未知错误: {e}")
                             await pending_update.message.reply_text("发送消息时发生未知错误，请稍后再试。")
+                    except RetryAfter:
+                        await pending_update.message.reply_text("当前消息较多，转发失败，请稍后再试。")
             else:
                 await query.message.reply_text("现在您可以发送消息了！")
     
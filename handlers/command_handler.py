@@ -1,8 +1,20 @@
+import time
 from telegram import Update
 from telegram.ext import ContextTypes
 from database import models as db
 from services.blacklist import block_user, unblock_user, get_blacklist_keyboard 
 from utils.decorators import admin_only
+from services.ai_telemetry import ai_telemetry, LATENCY_BUCKETS_MS
+from services.trust import trust_manager
+from services.ai_budget import ai_budget, LEVEL_NAMES
+from services.queue_manager import message_queue
+from services.update_scheduler import update_scheduler, CLASS_NAMES
+from services.send_scheduler import outbound_scheduler
+from services.update_journal import update_journal
+from services.relay import stats as relay_stats
+from services.rate_limiter import TIER_NAMES, rate_limiter
+from services.state_store import state_store
+from config import config
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -38,6 +50,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "- `/blacklist` - 查看黑名单\n"
         "- `/stats` - 查看统计信息\n"
         "- `/view_filtered` - 查看被拦截信息及发送者\n"
+        "- `/ai_stats` - 查看AI调用延迟、token与费用统计\n"
+        "- `/ai_budget` - 查看AI每日预算用量与当前降级等级\n"
+        "- `/queue_stats` - 查看消息队列、更新调度、发送调度与更新日志的积压与延迟\n"
     )
     
     await update.message.reply_text(help_text, parse_mode='Markdown')
@@ -124,6 +139,160 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+def _format_ms(value) -> str:
+    if value is None:
+        return "N/A"
+    if value == float("inf"):
+        return f">{LATENCY_BUCKETS_MS[-1]}ms"
+    return f"≤{value}ms"
+
+def _format_ratio(part, total) -> str:
+    return f"{part / total * 100:.0f}%" if total else "N/A"
+
+@admin_only
+async def ai_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lines = [f"AI调用统计（最近 {config.AI_TELEMETRY_WINDOW_MINUTES} 分钟）", "---------------------"]
+    summary = ai_telemetry.summary()
+    if not any(s["calls"] for s in summary.values()):
+        lines.append("暂无调用记录。")
+    for (provider, model, kind), s in sorted(summary.items()):
+        if not s["calls"]:
+            continue
+        lines.append(
+            f"{provider}/{model} [{kind}]\n"
+            f"  调用: {s['calls']}  解析失败: {s['parse_failures']}  缓存命中: {s['cache_hits']}\n"
+            f"  延迟 p50/p95/p99: {_format_ms(s['p50_ms'])} / {_format_ms(s['p95_ms'])} / {_format_ms(s['p99_ms'])}\n"
+            f"  平均延迟: {s['latency_sum'] / s['calls'] * 1000:.0f}ms\n"
+            f"  token 输入/输出: {s['input_tokens']} / {s['output_tokens']}"
+            f"（缓存命中 {s['cached_tokens']}, {_format_ratio(s['cached_tokens'], s['input_tokens'])}）\n"
+            f"  估算费用: ${s['cost']:.4f}"
+        )
+
+    if ai_telemetry.cascade_outcomes:
+        lines.append("\n级联审查分流（自启动以来）")
+        lines.append("---------------------")
+        providers = sorted({provider for provider, _ in ai_telemetry.cascade_outcomes})
+        for provider in providers:
+            counts = {o: n for (p, o), n in ai_telemetry.cascade_outcomes.items() if p == provider}
+            total = sum(counts.values())
+            escalated = total - counts.get("accepted", 0)
+            lines.append(
+                f"{provider}: 共 {total} 条, 第一层直接判定 {counts.get('accepted', 0)}, "
+                f"升级率 {escalated / total * 100:.1f}%"
+                f"（低置信 {counts.get('low_confidence', 0)}, 出错 {counts.get('error', 0)}, "
+                f"含图片 {counts.get('image', 0)}）"
+            )
+
+    if config.TRUST_ENABLED:
+        tiers = trust_manager.summary()
+        skipped = sum(t["skipped"] for t in tiers.values())
+        moderation = [s for (_, _, kind), s in summary.items() if kind.startswith("moderation") and s["calls"]]
+        calls = sum(s["calls"] for s in moderation)
+        avg_cost = sum(s["cost"] for s in moderation) / calls if calls else 0.0
+        lines.append("\n信任分抽样（自启动以来）")
+        lines.append("---------------------")
+        for tier, label in (("high", "高"), ("medium", "中"), ("low", "低")):
+            lines.append(f"{label}信任: 审查 {tiers[tier]['checked']} 条, 跳过 {tiers[tier]['skipped']} 条")
+        lines.append(f"节省AI调用: {skipped} 次, 估算节省费用: ${skipped * avg_cost:.4f}")
+
+    await ai_telemetry.flush()
+    today = time.time() // 86400 * 86400
+    totals = await db.get_ai_call_stats_totals(int(today))
+    if totals:
+        lines.append("\n今日累计（UTC）")
+        lines.append("---------------------")
+        for row in totals:
+            lines.append(
+                f"{row['provider']}/{row['model']} [{row['kind']}]: "
+                f"{row['calls']} 次, 平均 {row['latency_sum'] / row['calls'] * 1000:.0f}ms, "
+                f"最大 {row['latency_max'] * 1000:.0f}ms, "
+                f"token {row['input_tokens']}/{row['output_tokens']}"
+                f"（缓存 {_format_ratio(row['cached_tokens'] or 0, row['input_tokens'])}）, ${row['cost']:.4f}"
+            )
+
+    await update.message.reply_text("\n".join(lines))
+
+@admin_only
+async def ai_budget_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lines = ["AI每日预算（UTC 自然日）", "---------------------"]
+    lines.append(
+        f"token 软/硬上限: {config.AI_DAILY_TOKEN_SOFT_LIMIT or '不限'} / {config.AI_DAILY_TOKEN_HARD_LIMIT or '不限'}"
+    )
+    lines.append(
+        f"请求 软/硬上限: {config.AI_DAILY_REQUEST_SOFT_LIMIT or '不限'} / {config.AI_DAILY_REQUEST_HARD_LIMIT or '不限'}"
+    )
+    summary = ai_budget.summary()
+    if not summary:
+        lines.append("\n今日暂无AI调用，当前等级: 正常")
+    for provider, usage in sorted(summary.items()):
+        lines.append(
+            f"\n{provider}\n"
+            f"  当前等级: {LEVEL_NAMES[usage['level']]}\n"
+            f"  今日用量: {usage['tokens']} token / {usage['requests']} 次请求"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+def _format_seconds(value) -> str:
+    return "N/A" if value is None else f"{value * 1000:.0f}ms"
+
+@admin_only
+async def queue_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shards = message_queue.summary()
+    if not shards:
+        await update.message.reply_text("消息队列未启动。")
+        return
+    lines = [f"消息队列（{len(shards)} 个分片，当前积压 {message_queue.depth()} 条）", "---------------------"]
+    for s in shards:
+        lines.append(
+            f"分片 {s['shard']}: 积压 {s['depth']}/{s['capacity']}, 已处理 {s['processed']}, "
+            f"出错 {s['errors']}, 超时 {s['timeouts']}, 拒绝 {s['rejected']}\n"
+            f"  排队 p50/p95: {_format_seconds(s['wait_p50'])} / {_format_seconds(s['wait_p95'])}  "
+            f"处理 p50/p95: {_format_seconds(s['run_p50'])} / {_format_seconds(s['run_p95'])}"
+        )
+
+    lines.append(f"\n更新调度（同时处理上限 {update_scheduler.limit}，当前 {update_scheduler.active}）")
+    lines.append("---------------------")
+    for cls, s in update_scheduler.summary().items():
+        lines.append(
+            f"{CLASS_NAMES[cls]}: 已放行 {s['admitted']}, 等待中 {s['waiting']}, "
+            f"等待 p50/p95/最大: {_format_seconds(s['wait_p50'])} / {_format_seconds(s['wait_p95'])} / "
+            f"{_format_seconds(s['wait_max'])}"
+        )
+
+    s = outbound_scheduler.summary()
+    lines.append(f"\n发送调度（跟踪 {s['chats']} 个会话，当前排队 {s['depth']} 条）")
+    lines.append("---------------------")
+    lines.append(
+        f"已发送 {s['sent']}, 被平滑 {s['throttled']}, 合并 {s['coalesced']}, "
+        f"RetryAfter {s['retry_after']}, 重试后仍失败 {s['failed']}\n"
+        f"排队 p50/p95/最大: {_format_seconds(s['wait_p50'])} / {_format_seconds(s['wait_p95'])} / "
+        f"{_format_seconds(s['wait_max'])}"
+    )
+    for chat_id, waiting in s['busiest']:
+        lines.append(f"  会话 {chat_id}: 排队 {waiting} 条")
+
+    lines.append(
+        f"消息转发: {relay_stats.messages} 条, API 调用 {relay_stats.calls} 次, "
+        f"回退逐类型发送 {relay_stats.fallbacks} 次"
+    )
+    rejected = ", ".join(
+        f"{TIER_NAMES[name]} {count}" for name, count in rate_limiter.rejected.items()
+    ) or "无"
+    lines.append(
+        f"速率限制（{state_store.name}）: 跟踪用户 {await rate_limiter.tracked_users()} 个, 超限拒绝 {rejected}"
+    )
+
+    if config.UPDATE_JOURNAL_ENABLED:
+        counts = await db.get_update_journal_counts()
+        s = update_journal.summary()
+        lines.append(f"\n更新日志（共 {counts['total']} 条，未完成 {counts['incomplete']} 条）")
+        lines.append("---------------------")
+        lines.append(
+            f"写入 {s['appended']}, 跳过重复投递 {s['duplicates']}, 启动时重放 {s['replayed']}, "
+            f"放弃 {s['abandoned']}, 已压缩 {s['compacted']}"
+        )
+    await update.message.reply_text("\n".join(lines))
+
 async def getid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_type = update.effective_chat.type
     user_id = update.effective_user.id
@@ -1,90 +1,60 @@
 from telegram import Update
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 from database import models as db
 from services.verification import create_verification, is_verification_pending, get_pending_verification_message
-from services.thread_manager import get_or_create_thread
-from services.gemini_service import gemini_service
-from utils.media_converter import sticker_to_image
-from services.rate_limiter import rate_limiter
+from services.thread_manager import speculate_thread
+from services.moderation import ModerationStatus, handle_blocked, moderate_message
+from services.rate_limiter import message_cost, rate_limiter
+from services.trust import trust_manager
+from services.queue_manager import message_queue
+from services.album import AlbumView, album_aggregator
+from services.relay import relay_messages
+from services.update_journal import update_journal
+from services.update_scheduler import is_verified, mark_verified
 from config import config
 
 async def _resend_message(update: Update, context: ContextTypes.DEFAULT_TYPE, thread_id: int):
-    message = update.message
-    
-    if message.text:
-        await context.bot.send_message(
-            chat_id=config.FORUM_GROUP_ID,
-            text=message.text,
-            entities=message.entities,
-            message_thread_id=thread_id,
-            disable_web_page_preview=True
-        )
-    elif message.photo:
-        await context.bot.send_photo(
-            chat_id=config.FORUM_GROUP_ID,
-            photo=message.photo[-1].file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities,
-            message_thread_id=thread_id
-        )
-    elif message.animation:
-        await context.bot.send_animation(
-            chat_id=config.FORUM_GROUP_ID,
-            animation=message.animation.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities,
-            message_thread_id=thread_id
-        )
-    elif message.video:
-        await context.bot.send_video(
-            chat_id=config.FORUM_GROUP_ID,
-            video=message.video.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities,
-            message_thread_id=thread_id
-        )
-    elif message.document:
-        await context.bot.send_document(
-            chat_id=config.FORUM_GROUP_ID,
-            document=message.document.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities,
-            message_thread_id=thread_id
-        )
-    elif message.audio:
-        await context.bot.send_audio(
-            chat_id=config.FORUM_GROUP_ID,
-            audio=message.audio.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities,
-            message_thread_id=thread_id
-        )
-    elif message.voice:
-        await context.bot.send_voice(
-            chat_id=config.FORUM_GROUP_ID,
-            voice=message.voice.file_id,
-            caption=message.caption,
-            caption_entities=message.caption_entities,
-            message_thread_id=thread_id
-        )
-    elif message.video_note:
-        await context.bot.send_video_note(
-            chat_id=config.FORUM_GROUP_ID,
-            video_note=message.video_note.file_id,
-            message_thread_id=thread_id
-        )
-    elif message.sticker:
-        await context.bot.send_sticker(
-            chat_id=config.FORUM_GROUP_ID,
-            sticker=message.sticker.file_id,
-            message_thread_id=thread_id
-        )
+    await relay_messages(
+        context.bot, album_aggregator.messages(update), config.FORUM_GROUP_ID, message_thread_id=thread_id
+    )
+    # 转发成功即打检查点，之后处理超时或出错也不会在重启后重复转发
+    await update_journal.complete(update)
+
+async def enqueue_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 按用户分片排队处理：同一用户的消息保持顺序，不同用户并行
+    if not message_queue.workers:
+        await handle_message(update, context)
+        return
+    # 写日志需要等待数据库，期间同一用户的后续消息排在后面，入队顺序与到达顺序一致
+    async with message_queue.ingress(update.effective_user.id):
+        if not await update_journal.append(update):
+            return
+        # 相册（或开启连发合并时的连发消息）先合并，收齐后只把第一项送入队列，处理时整组审查与转发
+        if album_aggregator.add_burst(update, context, _submit_message):
+            return
+        if album_aggregator.add(update, context, _submit_message):
+            return
+        await _submit_message(update, context)
+
+async def _submit_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await message_queue.submit(update, context):
+        await reject_message(update, context)
+
+async def reject_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """消息未能入队或处理超时：从更新日志中移除，不再在重启时重放，并告知用户。"""
+    await update_journal.complete(update)
+    await update.message.reply_text("系统繁忙，您的消息未能处理，请稍后再试。")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    group = album_aggregator.messages(update)
     
-    is_over_limit, was_warned = await rate_limiter.check_user_rate_limit(user.id)
+    verified = is_verified(user.id)
+    # 按消息类型计费，未验证用户使用单独的限制规则
+    is_over_limit, was_warned = await rate_limiter.check_user_rate_limit(
+        user.id, cost=message_cost(group), verified=verified
+    )
     
     if is_over_limit:
         if was_warned:
@@ -104,7 +74,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await rate_limiter.mark_user_warned(user.id)
             await update.message.reply_text(
                 f"警告：您发送消息过于频繁，已超过速率限制。\n\n"
-                f"当前速率限制规则：每分钟最多 {config.MAX_MESSAGES_PER_MINUTE} 条消息。\n\n"
+                f"当前速率限制规则：{rate_limiter.describe(verified)}。\n\n"
                 f"请稍后再试。如果继续超出限制，您将被永久封禁。"
             )
             return
@@ -152,15 +122,19 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await update.message.reply_text(welcome_message)
         user_data = await db.get_user(user.id)
+    elif user_data.get('is_verified') and not verified:
+        # 可能由共享状态的其他进程完成了验证，同步到本进程的缓存
+        mark_verified(user.id)
 
     if not user_data.get('is_verified'):
         if not config.VERIFICATION_ENABLED:
             await db.update_user_verification(user.id, is_verified=True)
+            mark_verified(user.id)
         else:
-            has_pending, is_expired = is_verification_pending(user.id)
+            has_pending, is_expired = await is_verification_pending(user.id)
             
             if has_pending and not is_expired:
-                verification_data = get_pending_verification_message(user.id)
+                verification_data = await get_pending_verification_message(user.id)
                 if verification_data:
                     question, keyboard = verification_data
                     context.user_data['pending_update'] = update
@@ -178,42 +152,26 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     
     message = update.message
-    image_bytes = None
-
-    if message.photo:
-        photo_file = await message.photo[-1].get_file()
-        image_bytes = await photo_file.download_as_bytearray()
-    elif message.sticker and not message.sticker.is_animated and not message.sticker.is_video:
-        sticker_file = await message.sticker.get_file()
-        sticker_bytes = await sticker_file.download_as_bytearray()
-        image_bytes = await sticker_to_image(sticker_bytes)
+    # 话题查询/预创建与 AI 审查并行，判定为垃圾信息时再撤销
+    speculation = speculate_thread(update, context)
 
-    if message.video or message.animation:
-        pass
-    else:
-        analyzing_message = await context.bot.send_message(
-            chat_id=message.chat_id,
-            text="正在通过AI分析内容是否包含垃圾信息...",
-            reply_to_message_id=message.message_id
-        )
-
-        analysis_result = await gemini_service.analyze_message(message, image_bytes)
+    if trust_manager.should_moderate(user_data):
+        subject = AlbumView(group) if len(group) > 1 else message
+        status = ModerationStatus(context.bot, message).start()
+        try:
+            analysis_result = await moderate_message(subject)
+        except BaseException:
+            speculation.abandon()
+            status.close()
+            raise
         if analysis_result.get("is_spam"):
-            await db.save_filtered_message(
-                user_id=user.id,
-                message_id=message.message_id,
-                content=message.text or message.caption,
-                reason=analysis_result.get("reason"),
-                media_type=message.photo and "photo" or message.sticker and "sticker",
-                media_file_id=message.photo and message.photo[-1].file_id or message.sticker and message.sticker.file_id,
-            )
-            reason = analysis_result.get("reason", "未提供原因")
-            await analyzing_message.edit_text(f"您的消息已被系统拦截，因此未被转发\n\n原因：{reason}")
+            speculation.abandon()
+            handle_blocked(user.id, subject, analysis_result, status)
             return
         else:
-            await analyzing_message.delete()
+            status.close()
 
-    thread_id, is_new = await get_or_create_thread(update, context)
+    thread_id, is_new = await speculation.commit(update)
     if not thread_id:
         await update.message.reply_text("无法创建或找到您的话题，请联系管理员。")
         return
@@ -222,11 +180,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if not is_new:
             await _resend_message(update, context, thread_id)
+        context.application.create_task(trust_manager.record_forwarded(user.id), update=update)
     except BadRequest as e:
         if "Message thread not found" in e.message:
             
             await db.update_user_thread_id(user.id, None)
             await db.update_user_verification(user.id, False)
+            mark_verified(user.id, False)
             
             
             context.user_data['pending_update'] = update
@@ -246,3 +206,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             print(f"发送消息时发生未知错误: {e}")
             await update.message.reply_text("发送消息时发生未知错误，请稍后再试。")
+    except RetryAfter:
+        # 发送调度器重试多次后仍被 Telegram 限流
+        await update.message.reply_text("当前消息较多，转发失败，请稍后再试。")
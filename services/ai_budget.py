@@ -0,0 +1,125 @@
+import logging
+import time
+from config import config
+from services.ai_telemetry import ai_telemetry
+
+# 降级等级：正常 -> 仅廉价模型 -> 仅本地过滤 -> 仅人机验证（不做内容审查）
+NORMAL = 0
+CHEAP_MODELS = 1
+LOCAL_ONLY = 2
+VERIFICATION_ONLY = 3
+
+LEVEL_NAMES = {
+    NORMAL: "正常",
+    CHEAP_MODELS: "仅使用廉价模型",
+    LOCAL_ONLY: "仅本地关键词过滤",
+    VERIFICATION_ONLY: "仅人机验证",
+}
+
+
+def _utc_day() -> int:
+    return int(time.time() // 86400 * 86400)
+
+
+def _level_for(used: int, soft: int, hard: int) -> int:
+    # 达到软上限降到廉价模型，越过软/硬上限中点改用本地过滤，达到硬上限只保留人机验证
+    if hard and used >= hard:
+        return VERIFICATION_ONLY
+    if soft and hard and used >= (soft + hard) / 2:
+        return LOCAL_ONLY
+    if soft and used >= soft:
+        return CHEAP_MODELS
+    return NORMAL
+
+
+class AIBudget:
+    """Per-provider daily token/request accounting that steps AI usage down as limits are reached."""
+
+    def __init__(self):
+        self.day = _utc_day()
+        self.usage = {}
+        self.levels = {}
+        self.bot = None
+        ai_telemetry.listeners.append(self.record)
+
+    def _usage(self, provider: str) -> dict:
+        return self.usage.setdefault(provider, {"tokens": 0, "requests": 0})
+
+    def _roll_over(self):
+        today = _utc_day()
+        if today != self.day:
+            self.day = today
+            self.usage = {}
+            for provider in list(self.levels):
+                self._set_level(provider, NORMAL)
+
+    def record(self, record: dict):
+        self._roll_over()
+        usage = self._usage(record["provider"])
+        usage["requests"] += 1
+        usage["tokens"] += (record["input_tokens"] or 0) + (record["output_tokens"] or 0)
+        self._update_level(record["provider"])
+
+    def _update_level(self, provider: str):
+        usage = self._usage(provider)
+        level = max(
+            _level_for(usage["tokens"], config.AI_DAILY_TOKEN_SOFT_LIMIT, config.AI_DAILY_TOKEN_HARD_LIMIT),
+            _level_for(usage["requests"], config.AI_DAILY_REQUEST_SOFT_LIMIT, config.AI_DAILY_REQUEST_HARD_LIMIT),
+        )
+        self._set_level(provider, level)
+
+    def _set_level(self, provider: str, level: int):
+        previous = self.levels.get(provider, NORMAL)
+        self.levels[provider] = level
+        if level != previous:
+            logging.warning(f"[AI] {provider} 预算等级: {LEVEL_NAMES[previous]} -> {LEVEL_NAMES[level]}")
+            self._notify_admins(provider, previous, level)
+
+    def level(self, provider: str) -> int:
+        self._roll_over()
+        return self.levels.get(provider, NORMAL)
+
+    def _notify_admins(self, provider: str, previous: int, level: int):
+        if not self.bot or not config.ADMIN_IDS:
+            return
+        from services.ai_streaming import run_in_background
+
+        usage = self._usage(provider)
+        text = (
+            f"AI预算{'降级' if level > previous else '恢复'}: {provider}\n"
+            f"{LEVEL_NAMES[previous]} -> {LEVEL_NAMES[level]}\n"
+            f"今日用量: {usage['tokens']} token / {usage['requests']} 次请求"
+        )
+        for admin_id in config.ADMIN_IDS:
+            run_in_background(self._send(admin_id, text))
+
+    async def _send(self, chat_id: int, text: str):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except Exception as e:
+            logging.warning(f"发送AI预算通知给 {chat_id} 失败: {e}")
+
+    async def start(self, bot):
+        """恢复当天已落盘的用量（重启不清零），并开始向管理员发送等级变化通知。"""
+        from database import models as db
+
+        try:
+            for row in await db.get_ai_call_stats_totals(self.day):
+                usage = self._usage(row["provider"])
+                usage["requests"] += row["calls"] or 0
+                usage["tokens"] += (row["input_tokens"] or 0) + (row["output_tokens"] or 0)
+        except Exception as e:
+            logging.error(f"读取今日AI用量失败: {e}")
+        for provider in self.usage:
+            self._update_level(provider)
+        self.bot = bot
+
+    def summary(self) -> dict:
+        self._roll_over()
+        return {
+            provider: dict(usage, level=self.levels.get(provider, NORMAL))
+            for provider, usage in self.usage.items()
+        }
+
+
+ai_budget = AIBudget()
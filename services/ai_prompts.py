@@ -0,0 +1,183 @@
+import json
+
+MODERATION_MAX_TOKENS = 128
+CHALLENGE_MAX_TOKENS = 256
+
+MODERATION_SAFE_REASON = "内容未发现违规。"
+
+MODERATION_PROMPT = (
+    "你是内容审查员。判断用户提供的文本、图片和/或文件信息是否含垃圾广告、恶意软件、钓鱼链接、"
+    "不当言论、辱骂、攻击性词语或其他违反安全政策的内容。\n"
+    '只输出JSON：{"is_spam":布尔值,"reason":"一句话说明依据"}。'
+    f'违规时reason写明违规类型；安全时reason固定为"{MODERATION_SAFE_REASON}"'
+)
+
+# 级联审查第一层：廉价模型额外给出置信度，低于阈值时升级到主模型
+MODERATION_TRIAGE_PROMPT = (
+    "你是内容审查员。判断用户提供的文本、图片和/或文件信息是否含垃圾广告、恶意软件、钓鱼链接、"
+    "不当言论、辱骂、攻击性词语或其他违反安全政策的内容。\n"
+    '只输出JSON：{"is_spam":布尔值,"confidence":0到100的整数,"reason":"一句话说明依据"}。'
+    "confidence表示你对该判定的把握，拿不准时给低分。"
+    f'违规时reason写明违规类型；安全时reason固定为"{MODERATION_SAFE_REASON}"'
+)
+
+CHALLENGE_PROMPT = (
+    "你是人机验证（CAPTCHA）出题器。随机出一道绝大多数中文母语成年人都能立即答对的日常常识题，"
+    "主题随机，答案唯一。随机采用两种题型之一："
+    "a)直接提问，如“中国的首都是哪里？”；"
+    "b)反向排除，如“以下哪个不属于行星？”，此时三个干扰项同类，正确答案是不属于该类的那一项。"
+    "直接提问时所有选项同类。全部使用简体中文。\n"
+    '只输出JSON：{"question":"题目","correct_answer":"正确答案","incorrect_answers":["干扰项1","干扰项2","干扰项3"]}'
+)
+
+# 固定提示词放在系统指令中作为可缓存前缀，出题时的用户消息只需一句触发语
+CHALLENGE_REQUEST = "出一道题。"
+
+MODERATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_spam": {"type": "boolean"},
+        "reason": {"type": "string"},
+    },
+    "required": ["is_spam", "reason"],
+    "additionalProperties": False,
+}
+
+MODERATION_TRIAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_spam": {"type": "boolean"},
+        "confidence": {"type": "integer"},
+        "reason": {"type": "string"},
+    },
+    "required": ["is_spam", "confidence", "reason"],
+    "additionalProperties": False,
+}
+
+CHALLENGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "correct_answer": {"type": "string"},
+        "incorrect_answers": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+    },
+    "required": ["question", "correct_answer", "incorrect_answers"],
+    "additionalProperties": False,
+}
+
+
+def _openai_json_schema_format(name: str, schema: dict) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema},
+    }
+
+
+def _gemini_schema(schema: dict) -> dict:
+    # Gemini 的 response_schema 是 OpenAPI 子集：不支持 additionalProperties，
+    # 并通过 property_ordering 保证 is_spam 等关键字段最先输出
+    converted = {k: v for k, v in schema.items() if k != "additionalProperties"}
+    if "properties" in converted:
+        converted["properties"] = {
+            k: _gemini_schema(v) for k, v in converted["properties"].items()
+        }
+        converted["property_ordering"] = list(converted["properties"])
+    if "items" in converted:
+        converted["items"] = _gemini_schema(converted["items"])
+    return converted
+
+
+OPENAI_MODERATION_FORMAT = _openai_json_schema_format("moderation", MODERATION_SCHEMA)
+OPENAI_MODERATION_TRIAGE_FORMAT = _openai_json_schema_format("moderation_triage", MODERATION_TRIAGE_SCHEMA)
+OPENAI_CHALLENGE_FORMAT = _openai_json_schema_format("challenge", CHALLENGE_SCHEMA)
+OPENAI_JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+GEMINI_MODERATION_SCHEMA = _gemini_schema(MODERATION_SCHEMA)
+GEMINI_MODERATION_TRIAGE_SCHEMA = _gemini_schema(MODERATION_TRIAGE_SCHEMA)
+GEMINI_CHALLENGE_SCHEMA = _gemini_schema(CHALLENGE_SCHEMA)
+
+
+def describe_media(message) -> str:
+    """视频、动图、文件无法直接送审，投票、联系人等没有正文，用元数据作为审查线索。"""
+    document = getattr(message, "document", None)
+    if document:
+        return f"文件: {document.file_name or '未命名'}（{document.mime_type or '未知类型'}）"
+    animation = getattr(message, "animation", None)
+    if animation:
+        return f"动图: {animation.file_name or '未命名'}（图片为其缩略图）"
+    video = getattr(message, "video", None)
+    if video:
+        return f"视频: {video.file_name or '未命名'}，时长 {video.duration or 0} 秒（图片为其封面）"
+    poll = getattr(message, "poll", None)
+    if poll:
+        return f"投票: {poll.question}（选项: {' / '.join(option.text for option in poll.options)}）"
+    contact = getattr(message, "contact", None)
+    if contact:
+        return f"联系人: {contact.first_name} {contact.last_name or ''}".rstrip()
+    venue = getattr(message, "venue", None)
+    if venue:
+        return f"地点: {venue.title}，{venue.address}"
+    return None
+
+
+def build_moderation_text(text: str = None, has_image: bool = False, media_note: str = None) -> str:
+    lines = []
+    if text:
+        lines.append(f"文本: {text}")
+    if media_note:
+        lines.append(media_note)
+    if lines:
+        return "\n".join(lines)
+    if has_image:
+        return "请审查这张图片。"
+    return ""
+
+
+def normalize_moderation_result(data: dict) -> dict:
+    if "is_spam" not in data:
+        raise ValueError(f"Moderation result missing is_spam: {json.dumps(data, ensure_ascii=False)[:200]}")
+    is_spam = data["is_spam"]
+    if isinstance(is_spam, str):
+        is_spam = is_spam.strip().lower() == "true"
+    reason = data.get("reason") or ("未提供原因" if is_spam else MODERATION_SAFE_REASON)
+    result = {"is_spam": bool(is_spam), "reason": reason}
+    if "confidence" in data:
+        result["confidence"] = normalize_confidence(data["confidence"])
+    return result
+
+
+def normalize_confidence(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    # 个别模型会输出 0-1 的小数；整数 1 是 0-100 刻度上的最低置信度，不能放大
+    if 0 < value < 1:
+        value *= 100
+    return int(max(0, min(100, value)))
+
+
+def escalation_reason(result: dict, threshold: int) -> str:
+    """级联第一层的结果是否需要升级到主模型；返回升级原因，无需升级时返回 None。"""
+    if result.get("reason") == "Analysis failed":
+        return "error"
+    confidence = result.get("confidence")
+    if confidence is None or confidence < threshold:
+        return "low_confidence"
+    return None
+
+
+def normalize_challenge(data: dict) -> dict:
+    question = data["question"]
+    correct_answer = str(data["correct_answer"])
+    incorrect_answers = [str(a) for a in data["incorrect_answers"]][:3]
+    if not question or len(incorrect_answers) < 3 or correct_answer in incorrect_answers:
+        raise ValueError(f"Invalid challenge: {json.dumps(data, ensure_ascii=False)[:200]}")
+    return {
+        "question": question,
+        "correct_answer": correct_answer,
+        "incorrect_answers": incorrect_answers,
+    }
@@ -0,0 +1,102 @@
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from config import config
+
+# 提供商名称 -> (模块, 类名)。模块只在首次使用时导入，避免 SDK 拖慢启动
+PROVIDERS = {
+    "gemini": ("services.gemini_service", "GeminiService"),
+    "openai": ("services.openai_service", "OpenAIService"),
+    "custom": ("services.openai_service", "OpenAIService"),
+}
+
+
+class ProviderRegistry:
+    def __init__(self, default_provider: str):
+        self.default_provider = default_provider if default_provider in PROVIDERS else "gemini"
+        self.instances = {}
+        self.lock = threading.Lock()
+        self.service = LazyAIService(self)
+
+    def create(self, name: str):
+        module_name, class_name = PROVIDERS[name]
+        started = time.perf_counter()
+        service_class = getattr(importlib.import_module(module_name), class_name)
+        service = service_class()
+        logging.info(f"AI 提供商 {name} 已加载，用时 {(time.perf_counter() - started) * 1000:.0f}ms")
+        return service
+
+    def get(self, name: str = None):
+        name = name or self.default_provider
+        service = self.instances.get(name)
+        if service is not None:
+            return service
+        with self.lock:
+            service = self.instances.get(name)
+            if service is not None:
+                return service
+            try:
+                service = self.instances[name] = self.create(name)
+                return service
+            except Exception as e:
+                if name == "gemini":
+                    raise
+                error = e
+        # 回退需在释放锁之后进行，否则再次获取同一把锁会死锁
+        print(f"无法初始化OpenAI服务: {error}")
+        print("回退到Gemini服务")
+        fallback = self.get("gemini")
+        with self.lock:
+            return self.instances.setdefault(name, fallback)
+
+    async def aget(self, name: str = None):
+        """在事件循环中使用：尚未加载时在线程中导入与初始化，不阻塞其他协程。"""
+        service = self.instances.get(name or self.default_provider)
+        if service is not None:
+            return service
+        return await asyncio.to_thread(self.get, name)
+
+    def is_loaded(self, name: str = None) -> bool:
+        return (name or self.default_provider) in self.instances
+
+    def loaded(self) -> dict:
+        return dict(self.instances)
+
+    async def warm_up(self, delay: float = 0):
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await asyncio.to_thread(self.get)
+        except Exception as e:
+            logging.error(f"AI 提供商预热失败: {e}")
+
+
+class LazyAIService:
+    """Stand-in for the configured AI service.
+
+    Once the provider is loaded, attributes resolve to the real service. Before that, an
+    attribute is returned as a coroutine function that loads the provider in a worker
+    thread (``aget``) and then calls the method, so the first request never blocks the
+    event loop on an SDK import. Only the service's async methods may be used that way.
+    """
+
+    def __init__(self, registry: ProviderRegistry, name: str = None):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, item):
+        service = self._registry.instances.get(self._name or self._registry.default_provider)
+        if service is not None:
+            return getattr(service, item)
+
+        async def call(*args, **kwargs):
+            service = await self._registry.aget(self._name)
+            return await getattr(service, item)(*args, **kwargs)
+
+        return call
+
+
+ai_registry = ProviderRegistry(config.AI_PROVIDER)
+gemini_service = ai_registry.service
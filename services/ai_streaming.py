@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+from services.ai_prompts import MODERATION_SAFE_REASON, normalize_moderation_result
+from utils.json_stream import JSONStreamParser
+
+_background_tasks = set()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def pending_background_tasks(timeout: float = None) -> int:
+    """等待后台任务结束，返回超时后仍未完成的数量。"""
+    if not _background_tasks:
+        return 0
+    _, pending = await asyncio.wait(list(_background_tasks), timeout=timeout)
+    return len(pending)
+
+
+async def stream_moderation(chunks, on_complete, required: tuple = ("is_spam",)) -> dict:
+    """Consumes ``chunks`` (async iterator of text) and returns as soon as the ``required`` keys are known.
+
+    The returned dict carries the rest of the stream as ``pending``, a task resolving to the
+    complete result. ``on_complete(text, parsed)`` is called once the stream has been drained.
+    """
+    parser = JSONStreamParser()
+    verdict = asyncio.Event()
+    started = time.perf_counter()
+
+    async def consume() -> dict:
+        parsed = False
+        try:
+            async for text in chunks:
+                if text:
+                    parser.feed(text)
+                    if not verdict.is_set() and all(parser.has(key) for key in required):
+                        logging.info(f"[AI] moderation verdict after {(time.perf_counter() - started) * 1000:.0f}ms")
+                        verdict.set()
+            result = normalize_moderation_result(parser.values)
+            parsed = True
+            return result
+        except Exception as e:
+            print(f"AI streaming analysis failed: {e}")
+            if parser.buffer:
+                print(f"AI原始响应: {parser.buffer}")
+            return {"is_spam": False, "reason": "Analysis failed"}
+        finally:
+            verdict.set()
+            on_complete(parser.buffer, parsed)
+
+    task = run_in_background(consume())
+    waiter = asyncio.ensure_future(verdict.wait())
+    try:
+        await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+
+    if task.done() or not all(parser.has(key) for key in required):
+        return await task
+
+    early = normalize_moderation_result(parser.values)
+    is_spam = early["is_spam"]
+    result = {
+        "is_spam": is_spam,
+        "reason": parser.get("reason") or (None if is_spam else MODERATION_SAFE_REASON),
+        "pending": task,
+    }
+    if "confidence" in early:
+        result["confidence"] = early["confidence"]
+    return result
+
+
+async def resolve_moderation_result(result: dict) -> dict:
+    pending = result.get("pending")
+    if pending is None:
+        return result
+    final = await pending
+    # 提前判定已经生效，最终结果只用于补全原因
+    return {"is_spam": result["is_spam"], "reason": final.get("reason") or result.get("reason")}
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+from config import config
+
+# 每百万 token 的美元价格 (输入, 输出[, 缓存命中的输入])，可通过 AI_MODEL_PRICES 覆盖或补充
+DEFAULT_MODEL_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+    "gemini-2.5-pro": (1.25, 10.00, 0.31),
+    "gpt-4": (30.00, 60.00),
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    "gpt-4.1-mini": (0.40, 1.60, 0.10),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# 延迟直方图桶上界（毫秒），最后一个桶收纳所有更慢的调用
+LATENCY_BUCKETS_MS = (50, 100, 200, 400, 800, 1600, 3200, 6400, 12800)
+
+
+def _load_model_prices() -> dict:
+    prices = dict(DEFAULT_MODEL_PRICES)
+    if config.AI_MODEL_PRICES:
+        try:
+            for model, values in json.loads(config.AI_MODEL_PRICES).items():
+                if len(values) not in (2, 3):
+                    raise ValueError(f"{model}: 需要 [输入, 输出] 或 [输入, 输出, 缓存输入] 价格")
+                prices[model] = tuple(float(v) for v in values)
+        except (ValueError, TypeError) as e:
+            logging.warning(f"AI_MODEL_PRICES 格式错误，已忽略: {e}")
+    return prices
+
+
+class _Slot:
+    __slots__ = ("minute", "histogram", "calls", "parse_failures", "cache_hits",
+                 "input_tokens", "cached_tokens", "output_tokens", "cost", "latency_sum")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.calls = 0
+        self.parse_failures = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.latency_sum = 0.0
+
+
+class RollingHistogram:
+    """Per-minute latency histograms and counters over a sliding window."""
+
+    def __init__(self, window_minutes: int):
+        self.window_minutes = window_minutes
+        self.slots = deque()
+
+    def _slot(self, minute: int) -> _Slot:
+        if not self.slots or self.slots[-1].minute != minute:
+            self.slots.append(_Slot(minute))
+        self._expire(minute)
+        return self.slots[-1]
+
+    def _expire(self, minute: int):
+        while self.slots and self.slots[0].minute <= minute - self.window_minutes:
+            self.slots.popleft()
+
+    def add(self, record: dict):
+        slot = self._slot(int(record["time"] // 60))
+        latency_ms = record["latency"] * 1000
+        slot.histogram[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        slot.calls += 1
+        slot.latency_sum += record["latency"]
+        slot.parse_failures += 0 if record["parsed"] else 1
+        slot.cache_hits += 1 if record["cache_hit"] else 0
+        slot.input_tokens += record["input_tokens"] or 0
+        slot.cached_tokens += record["cached_tokens"] or 0
+        slot.output_tokens += record["output_tokens"] or 0
+        slot.cost += record["cost"] or 0.0
+
+    def summary(self) -> dict:
+        self._expire(int(time.time() // 60))
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        totals = {"calls": 0, "parse_failures": 0, "cache_hits": 0, "input_tokens": 0,
+                  "cached_tokens": 0, "output_tokens": 0, "cost": 0.0, "latency_sum": 0.0}
+        for slot in self.slots:
+            for i, count in enumerate(slot.histogram):
+                histogram[i] += count
+            for key in totals:
+                totals[key] += getattr(slot, key)
+        totals["p50_ms"] = self._percentile(histogram, 0.50)
+        totals["p95_ms"] = self._percentile(histogram, 0.95)
+        totals["p99_ms"] = self._percentile(histogram, 0.99)
+        totals["histogram"] = histogram
+        return totals
+
+    @staticmethod
+    def _percentile(histogram: list, q: float):
+        total = sum(histogram)
+        if not total:
+            return None
+        threshold = q * total
+        running = 0
+        for i, count in enumerate(histogram):
+            running += count
+            if running >= threshold:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else float("inf")
+        return float("inf")
+
+
+class AITelemetry:
+    def __init__(self, max_records: int = 500):
+        self.recent_calls = deque(maxlen=max_records)
+        self.histograms = {}
+        self.model_prices = _load_model_prices()
+        self.pending_buckets = {}
+        self.flush_task = None
+        # 级联审查的分流结果：(provider, outcome) -> 次数，outcome 为 accepted / low_confidence / error / image
+        self.cascade_outcomes = {}
+        # 每次调用记录后回调，供预算控制等模块累计用量
+        self.listeners = []
+
+    def estimate_cost(self, model: str, input_tokens: int, output_tokens: int, cached_tokens: int = None):
+        prices = self.model_prices.get(model)
+        if not prices or (input_tokens is None and output_tokens is None):
+            return None
+        input_price, output_price = prices[0], prices[1]
+        # 输入 token 数包含缓存命中的部分，命中部分按缓存价格计费
+        cached = min(cached_tokens or 0, input_tokens or 0)
+        cached_price = prices[2] if len(prices) > 2 else input_price
+        return (
+            ((input_tokens or 0) - cached) * input_price
+            + cached * cached_price
+            + (output_tokens or 0) * output_price
+        ) / 1_000_000
+
+    def record_call(
+        self,
+        provider: str,
+        model: str,
+        kind: str,
+        latency: float,
+        input_tokens: int = None,
+        output_tokens: int = None,
+        parsed: bool = True,
+        cached_tokens: int = None,
+    ):
+        record = {
+            "time": time.time(),
+            "provider": provider,
+            "model": model,
+            "kind": kind,
+            "latency": latency,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens,
+            "cache_hit": bool(cached_tokens),
+            "cost": self.estimate_cost(model, input_tokens, output_tokens, cached_tokens),
+            "parsed": parsed,
+        }
+        self.recent_calls.append(record)
+
+        key = (provider, model, kind)
+        if key not in self.histograms:
+            self.histograms[key] = RollingHistogram(config.AI_TELEMETRY_WINDOW_MINUTES)
+        self.histograms[key].add(record)
+        self._add_to_bucket(record)
+        for listener in self.listeners:
+            listener(record)
+
+        logging.info(
+            f"[AI] {provider}/{model} {kind}: {latency * 1000:.0f}ms, "
+            f"tokens in={input_tokens} out={output_tokens} cached={cached_tokens}, parsed={parsed}"
+        )
+        return record
+
+    def record_cascade(self, provider: str, outcome: str):
+        key = (provider, outcome)
+        self.cascade_outcomes[key] = self.cascade_outcomes.get(key, 0) + 1
+
+    def _add_to_bucket(self, record: dict):
+        bucket_seconds = config.AI_TELEMETRY_BUCKET_MINUTES * 60
+        bucket_start = int(record["time"] // bucket_seconds * bucket_seconds)
+        key = (bucket_start, record["provider"], record["model"], record["kind"])
+        bucket = self.pending_buckets.setdefault(key, {
+            "calls": 0, "parse_failures": 0, "cache_hits": 0, "input_tokens": 0, "cached_tokens": 0,
+            "output_tokens": 0, "cost": 0.0, "latency_sum": 0.0, "latency_max": 0.0,
+        })
+        bucket["calls"] += 1
+        bucket["parse_failures"] += 0 if record["parsed"] else 1
+        bucket["cache_hits"] += 1 if record["cache_hit"] else 0
+        bucket["input_tokens"] += record["input_tokens"] or 0
+        bucket["cached_tokens"] += record["cached_tokens"] or 0
+        bucket["output_tokens"] += record["output_tokens"] or 0
+        bucket["cost"] += record["cost"] or 0.0
+        bucket["latency_sum"] += record["latency"]
+        bucket["latency_max"] = max(bucket["latency_max"], record["latency"])
+
+    def summary(self) -> dict:
+        return {key: histogram.summary() for key, histogram in self.histograms.items()}
+
+    async def flush(self):
+        if not self.pending_buckets:
+            return
+        from database import models as db
+
+        buckets, self.pending_buckets = self.pending_buckets, {}
+        try:
+            await db.upsert_ai_call_stats(buckets)
+        except Exception as e:
+            logging.error(f"写入AI调用统计失败: {e}")
+            for key, values in buckets.items():
+                pending = self.pending_buckets.setdefault(key, dict.fromkeys(values, 0))
+                for field, value in values.items():
+                    pending[field] = max(pending[field], value) if field == "latency_max" else pending[field] + value
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(config.AI_TELEMETRY_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self.flush_task:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+        await self.flush()
+
+
+ai_telemetry = AITelemetry()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message, Update
+from config import config
+from services.ai_prompts import describe_media
+
+# 已收齐的相册保留数量上限；待验证消息在验证通过后仍需按相册重发
+MAX_ALBUMS = 1000
+
+
+class Album:
+    __slots__ = ("updates", "context", "callback", "deadline", "task")
+
+    def __init__(self, update: Update, context, callback):
+        self.updates = [update]
+        self.context = context
+        self.callback = callback
+        self.deadline = 0.0
+        self.task = None
+
+    def messages(self) -> list:
+        return [update.effective_message for update in self.updates]
+
+
+class AlbumView:
+    """Message stand-in that lets an album or a burst go through moderation as a single message.
+
+    The text, captions and media notes of every item are folded into ``caption``; ``first``
+    is the first item, used for replies and for recording filtered messages.
+    """
+
+    def __init__(self, messages: list):
+        self.first = messages[0]
+        self.messages = messages
+        self.chat_id = self.first.chat_id
+        self.message_id = self.first.message_id
+        self.text = None
+        if len({message.media_group_id for message in messages}) == 1 and self.first.media_group_id:
+            lines = [f"相册，共 {len(messages)} 项"]
+        else:
+            lines = [f"连续发送的 {len(messages)} 条消息"]
+        for index, message in enumerate(messages, 1):
+            note = describe_media(message)
+            if message.text or message.caption:
+                lines.append(f"[{index}] {message.text or message.caption}")
+            if note:
+                lines.append(f"[{index}] {note}")
+        self.caption = "\n".join(lines)
+        self.photo = None
+        self.sticker = None
+        self.animation = None
+        self.video = None
+        self.document = None
+
+
+def input_media_for(message: Message):
+    kwargs = {"caption": message.caption, "caption_entities": message.caption_entities}
+    if message.photo:
+        return InputMediaPhoto(media=message.photo[-1].file_id, **kwargs)
+    if message.video:
+        return InputMediaVideo(media=message.video.file_id, **kwargs)
+    if message.document:
+        return InputMediaDocument(media=message.document.file_id, **kwargs)
+    if message.audio:
+        return InputMediaAudio(media=message.audio.file_id, **kwargs)
+    return None
+
+
+async def send_album(bot, chat_id: int, messages: list, message_thread_id: int = None):
+    media = [item for item in map(input_media_for, messages) if item is not None]
+    return await bot.send_media_group(chat_id=chat_id, media=media, message_thread_id=message_thread_id)
+
+
+class AlbumAggregator:
+    """Buffers the updates of a media group until no new item has arrived for ALBUM_WINDOW.
+
+    ``add`` returns immediately; once the album is complete, ``callback(update, context)``
+    runs once with the first update. ``messages``/``updates`` later return every item of
+    the album that a given first update belongs to. ``add_burst`` groups a user's rapid
+    consecutive messages the same way (BURST_WINDOW, at most BURST_MAX_BATCH per group).
+    """
+
+    def __init__(self):
+        self.open = {}
+        self.albums = OrderedDict()
+        self.collected = 0
+        self.absorbed = 0
+
+    def add(self, update: Update, context, callback) -> bool:
+        """不是相册消息时返回 False，调用方照常处理。"""
+        message = update.effective_message
+        if not message or not message.media_group_id or config.ALBUM_WINDOW <= 0:
+            return False
+        key = (message.chat_id, message.media_group_id)
+        self._collect(key, update, context, callback, config.ALBUM_WINDOW)
+        return True
+
+    def add_burst(self, update: Update, context, callback) -> bool:
+        """未启用连发合并时返回 False；相册的各项同样并入所在的连发分组。"""
+        message = update.effective_message
+        if not message or config.BURST_WINDOW <= 0:
+            return False
+        window = max(config.BURST_WINDOW, config.ALBUM_WINDOW if message.media_group_id else 0)
+        self._collect((message.chat_id, None), update, context, callback, window, config.BURST_MAX_BATCH)
+        return True
+
+    def _collect(self, key, update: Update, context, callback, window: float, max_items: int = None):
+        loop = asyncio.get_running_loop()
+        album = self.open.get(key)
+        if album is None:
+            album = self.open[key] = Album(update, context, callback)
+            album.task = asyncio.create_task(self._close_later(key, album))
+        else:
+            album.updates.append(update)
+            self.absorbed += 1
+        album.deadline = loop.time() + window
+        if max_items and len(album.updates) >= max_items:
+            # 已达上限立即发出，后续消息开始新的分组
+            del self.open[key]
+            album.task.cancel()
+            album.task = asyncio.create_task(self._close(key, album))
+
+    async def _close_later(self, key, album: Album):
+        loop = asyncio.get_running_loop()
+        while (remaining := album.deadline - loop.time()) > 0:
+            await asyncio.sleep(remaining)
+        await self._close(key, album)
+
+    async def _close(self, key, album: Album):
+        if self.open.get(key) is album:
+            del self.open[key]
+        album.updates.sort(key=lambda update: update.effective_message.message_id)
+        first = album.updates[0]
+        self.albums[first.update_id] = album
+        while len(self.albums) > MAX_ALBUMS:
+            self.albums.popitem(last=False)
+        self.collected += 1
+        try:
+            await album.callback(first, album.context)
+        except Exception as e:
+            logging.exception(f"处理消息分组 {key} 失败: {e}")
+
+    def restore(self, updates: list, context) -> Update:
+        """登记一个已收齐的相册（如重放日志时），返回应送入队列的第一项。"""
+        album = Album(updates[0], context, None)
+        album.updates = sorted(updates, key=lambda update: update.effective_message.message_id)
+        first = album.updates[0]
+        self.albums[first.update_id] = album
+        while len(self.albums) > MAX_ALBUMS:
+            self.albums.popitem(last=False)
+        return first
+
+    async def flush(self) -> int:
+        """关闭前立即发出所有仍在收集中的分组，返回分组数。"""
+        albums = list(self.open.items())
+        for key, album in albums:
+            album.task.cancel()
+            await self._close(key, album)
+        return len(albums)
+
+    def updates(self, update: Update) -> list:
+        album = self.albums.get(update.update_id)
+        return list(album.updates) if album else [update]
+
+    def messages(self, update: Update) -> list:
+        album = self.albums.get(update.update_id)
+        return album.messages() if album else [update.effective_message]
+
+
+album_aggregator = AlbumAggregator()
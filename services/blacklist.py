@@ -2,11 +2,12 @@ import time
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.helpers import escape_markdown
 from database import models as db
-from services.gemini_service import gemini_service
+from services.ai_registry import gemini_service
+from services.state_store import state_store
 from config import config
 
-
-pending_unblocks = {}
+# 进行中的解封验证保存在 state_store 的这个命名空间，按用户 ID 索引
+NAMESPACE = "unblock"
 
 async def block_user(user_id: int, reason: str, admin_id: int, permanent: bool = False):
     await db.add_to_blacklist(user_id, reason, admin_id, permanent)
@@ -20,27 +21,26 @@ async def unblock_user(user_id: int):
     await db.set_user_blacklist_strikes(user_id, 0)
     return f"用户 {user_id} 已被管理员解封。"
 
-def is_unblock_pending(user_id: int) -> tuple[bool, bool]:
-    if user_id not in pending_unblocks:
+async def is_unblock_pending(user_id: int) -> tuple[bool, bool]:
+    session = await state_store.get(NAMESPACE, user_id)
+    if session is None:
         return False, True
     
-    session = pending_unblocks[user_id]
     is_expired = time.time() - session['created_at'] > config.VERIFICATION_TIMEOUT
     
     if is_expired:
-        del pending_unblocks[user_id]
+        await state_store.delete(NAMESPACE, user_id)
         return False, True
     
     return True, False
 
-def get_pending_unblock_message(user_id: int):
-    if user_id not in pending_unblocks:
+async def get_pending_unblock_message(user_id: int):
+    session = await state_store.get(NAMESPACE, user_id)
+    if session is None:
         return None
     
-    session = pending_unblocks[user_id]
-    
     if time.time() - session['created_at'] > config.VERIFICATION_TIMEOUT:
-        del pending_unblocks[user_id]
+        await state_store.delete(NAMESPACE, user_id)
         return None
     
     question = session['question']
@@ -58,10 +58,10 @@ async def start_unblock_process(user_id: int):
     if is_permanent:
         return "您已被管理员永久封禁，无法通过申诉解封。", None
 
-    has_pending, is_expired = is_unblock_pending(user_id)
+    has_pending, is_expired = await is_unblock_pending(user_id)
     
     if has_pending and not is_expired:
-        unblock_data = get_pending_unblock_message(user_id)
+        unblock_data = await get_pending_unblock_message(user_id)
         if unblock_data:
             question, keyboard = unblock_data
             return (
@@ -75,12 +75,12 @@ async def start_unblock_process(user_id: int):
     correct_answer = challenge['correct_answer']
     options = challenge['options']
     
-    pending_unblocks[user_id] = {
+    await state_store.set(NAMESPACE, user_id, {
         'answer': correct_answer,
         'question': question,
         'options': options,
         'created_at': time.time()
-    }
+    }, config.VERIFICATION_TIMEOUT)
     
     keyboard = [
         [InlineKeyboardButton(option, callback_data=f"unblock_{option}") for option in options]
@@ -92,23 +92,24 @@ async def start_unblock_process(user_id: int):
     ), InlineKeyboardMarkup(keyboard)
 
 async def verify_unblock_answer(user_id: int, user_answer: str):
-    if user_id not in pending_unblocks:
+    session = await state_store.get(NAMESPACE, user_id)
+    if session is None:
         return "解封会话已过期或不存在。", False
-
-    session = pending_unblocks[user_id]
     
     if time.time() - session['created_at'] > config.VERIFICATION_TIMEOUT:
-        del pending_unblocks[user_id]
+        await state_store.delete(NAMESPACE, user_id)
         return "解封超时，请重新发送消息以获取新问题。", False
 
+    # 只有成功删除会话的一方继续处理，避免多个进程重复解封或封禁
+    if not await state_store.delete(NAMESPACE, user_id):
+        return "解封会话已过期或不存在。", False
+
     if user_answer == session['answer']:
-        del pending_unblocks[user_id]
         await db.remove_from_blacklist(user_id)
         
         await db.set_user_blacklist_strikes(user_id, 0)
         return "解封成功！您现在可以正常发送消息了。", True
     else:
-        del pending_unblocks[user_id]
         await db.add_to_blacklist(user_id, reason="解封验证失败", blocked_by=config.BOT_ID, permanent=True)
         # add_to_blacklist 已经会自动增加 blacklist_strikes，不需要再设置为 99
         return "答案错误，解封失败。您已被永久封禁。", False
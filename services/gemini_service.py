@@ -1,18 +1,47 @@
-try:
-    from google.genai import Client as GeminiClient
-
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    GeminiClient = None
-
 from telegram import Message
 from config import config
-import json
+from services.ai_prompts import (
+    CHALLENGE_MAX_TOKENS,
+    CHALLENGE_PROMPT,
+    CHALLENGE_REQUEST,
+    GEMINI_CHALLENGE_SCHEMA,
+    GEMINI_MODERATION_SCHEMA,
+    GEMINI_MODERATION_TRIAGE_SCHEMA,
+    MODERATION_MAX_TOKENS,
+    MODERATION_PROMPT,
+    MODERATION_TRIAGE_PROMPT,
+    build_moderation_text,
+    describe_media,
+    escalation_reason,
+    normalize_challenge,
+    normalize_moderation_result,
+)
+from services.ai_budget import ai_budget, VERIFICATION_ONLY
+from services.ai_streaming import run_in_background, stream_moderation
+from services.ai_telemetry import ai_telemetry
+from services.image_processor import image_processor
+from utils.json_stream import parse_json_response
+import logging
 import random
-import re
-from PIL import Image
-import io
+import time
+
+# google-genai 导入耗时较长，推迟到首次创建 GeminiService 时再加载
+GeminiClient = None
+types = None
+GEMINI_AVAILABLE = None
+
+
+def _load_genai() -> bool:
+    global GeminiClient, types, GEMINI_AVAILABLE
+    if GEMINI_AVAILABLE is None:
+        try:
+            from google.genai import Client
+            from google.genai import types as genai_types
+
+            GeminiClient, types, GEMINI_AVAILABLE = Client, genai_types, True
+        except ImportError:
+            GEMINI_AVAILABLE = False
+    return GEMINI_AVAILABLE
 
 LOCAL_VERIFICATION_QUESTIONS = [
     {
@@ -163,92 +192,247 @@ LOCAL_VERIFICATION_QUESTIONS = [
 ]
 
 
+class GeminiPromptCache:
+    """Gemini explicit context caches holding the fixed system prompts, one per (model, prompt).
+
+    Caches are created in the background on first use; until one exists, or if the model
+    rejects it (e.g. the prompt is below the minimum cacheable size), requests fall back to
+    ``system_instruction`` so the prompt still forms a stable prefix for implicit caching.
+    """
+
+    # 距离过期不足该秒数时提前重建
+    REFRESH_MARGIN = 60
+
+    def __init__(self, client, ttl: int):
+        self.client = client
+        self.ttl = ttl
+        self.entries = {}
+        self.retry_at = {}
+        self.creating = set()
+
+    def lookup(self, model: str, prompt: str):
+        key = (model, prompt)
+        now = time.time()
+        entry = self.entries.get(key)
+        if (entry is None or entry[1] - now < self.REFRESH_MARGIN) and key not in self.creating \
+                and self.retry_at.get(key, 0) <= now:
+            self.creating.add(key)
+            run_in_background(self._create(key))
+        if entry and entry[1] > now:
+            return entry[0]
+        return None
+
+    async def _create(self, key: tuple):
+        model, prompt = key
+        try:
+            cache = await self.client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=prompt, ttl=f"{self.ttl}s"
+                ),
+            )
+            self.entries[key] = (cache.name, time.time() + self.ttl)
+            logging.info(f"[AI] Gemini 提示词缓存已创建: {model} -> {cache.name}")
+        except Exception as e:
+            self.retry_at[key] = time.time() + self.ttl
+            logging.info(f"[AI] Gemini 提示词缓存不可用（{model}），改用 system_instruction: {e}")
+        finally:
+            self.creating.discard(key)
+
+    def invalidate(self, name: str):
+        for key, entry in list(self.entries.items()):
+            if entry[0] == name:
+                del self.entries[key]
+
+    async def close(self):
+        entries, self.entries = self.entries, {}
+        for name, _ in entries.values():
+            try:
+                await self.client.aio.caches.delete(name=name)
+            except Exception as e:
+                logging.warning(f"删除 Gemini 提示词缓存 {name} 失败: {e}")
+
+
 class GeminiService:
+    provider_name = "gemini"
+
     def __init__(self):
-        if config.GEMINI_API_KEY and GEMINI_AVAILABLE:
+        self.moderation_prompt = MODERATION_PROMPT
+        self.triage_prompt = MODERATION_TRIAGE_PROMPT
+        if config.GEMINI_API_KEY and _load_genai():
             self.client = GeminiClient(api_key=config.GEMINI_API_KEY)
-            self.filter_model_name = "gemini-2.5-flash"
+            self.filter_model_name = config.GEMINI_FILTER_MODEL
+            self.cascade_model_name = config.GEMINI_CASCADE_MODEL if config.AI_CASCADE_ENABLED else None
             self.verification_model_name = "gemini-2.5-flash-lite"
+            self.moderation_config = self._build_config(
+                GEMINI_MODERATION_SCHEMA, MODERATION_MAX_TOKENS, temperature=0.3
+            )
+            self.triage_config = self._build_config(
+                GEMINI_MODERATION_TRIAGE_SCHEMA, MODERATION_MAX_TOKENS, temperature=0.3
+            )
+            self.prompt_cache = (
+                GeminiPromptCache(self.client, config.AI_PROMPT_CACHE_TTL) if config.AI_PROMPT_CACHE else None
+            )
+            self.challenge_config = self._build_config(
+                GEMINI_CHALLENGE_SCHEMA, CHALLENGE_MAX_TOKENS, temperature=0.8
+            )
         else:
             self.client = None
             self.filter_model_name = None
+            self.cascade_model_name = None
             self.verification_model_name = None
+            self.prompt_cache = None
+
+    def _build_config(self, schema: dict, max_tokens: int, temperature: float):
+        options = {
+            "temperature": temperature,
+            "max_output_tokens": max_tokens,
+            # 输出极短，关闭思考以免思考 token 挤占输出额度
+            "thinking_config": types.ThinkingConfig(thinking_budget=0),
+        }
+        if config.AI_STRUCTURED_OUTPUT:
+            options["response_mime_type"] = "application/json"
+            options["response_schema"] = schema
+        return types.GenerateContentConfig(**options)
+
+    def _prompt_config(self, base, model: str, prompt: str) -> tuple:
+        """固定提示词作为请求前缀：优先引用显式缓存，否则放入 system_instruction。"""
+        cache_name = self.prompt_cache.lookup(model, prompt) if self.prompt_cache else None
+        if cache_name:
+            return base.model_copy(update={"cached_content": cache_name}), cache_name
+        return base.model_copy(update={"system_instruction": prompt}), None
+
+    def _check_cache_error(self, error: Exception, cache_name: str):
+        if cache_name and "cache" in str(error).lower():
+            self.prompt_cache.invalidate(cache_name)
+
+    @staticmethod
+    def _response_text(response):
+        try:
+            if response.candidates and response.candidates[0].content.parts:
+                return response.candidates[0].content.parts[0].text
+        except (AttributeError, IndexError):
+            pass
+        return None
+
+    def _record(self, model: str, kind: str, started: float, response, parsed: bool):
+        usage = getattr(response, "usage_metadata", None) if response else None
+        ai_telemetry.record_call(
+            provider=self.provider_name,
+            model=model,
+            kind=kind,
+            latency=time.perf_counter() - started,
+            input_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            parsed=parsed,
+            cached_tokens=getattr(usage, "cached_content_token_count", None),
+        )
 
     async def analyze_message(
-        self, message: Message, image_bytes: bytes = None
+        self, message: Message, image_bytes: bytes = None, cheap_only: bool = False
     ) -> dict:
         if not self.client or not self.filter_model_name or not config.ENABLE_AI_FILTER:
             return {"is_spam": False, "reason": "AI filter disabled"}
 
         content = []
-        prompt_parts = [
-            "你是一个内容审查员。你的任务是分析提供给你的文本和/或图片内容，"
-            "并判断其是否包含垃圾信息、恶意软件、钓鱼链接、不当言论、辱骂、攻击性词语或任何违反安全政策的内容。",
-            "请严格按照要求，仅以JSON格式返回你的分析结果，不要包含任何额外的解释或标记。",
-            "**输出格式**: 你必须且只能以严格的JSON格式返回你的分析结果，不得包含任何解释性文字或代码块标记。",
-            '**JSON结构**:\n```json\n{\n  "is_spam": boolean,\n  "reason": "string"\n}\n```\n'
-            "*   `is_spam`: 如果内容违反**任何一条**安全策略，则为 `true`；如果内容完全安全，则为 `false`。\n"
-            "*   `reason`: 用一句话精准概括判断依据。如果违规，请明确指出违规的类型。"
-            '如果安全，此字段固定为 `"内容未发现违规。"`',
-            "\n--- 以下是需要分析的内容 ---",
-        ]
-
-        if message.text:
-            content.append(message.text)
-
-        if image_bytes:
-            try:
-                image = Image.open(io.BytesIO(image_bytes))
-                content.append(image)
-            except Exception as e:
-                print(f"Error processing image for Gemini: {e}")
-                pass
+
+        text = build_moderation_text(message.text or message.caption, media_note=describe_media(message))
+        if text:
+            content.append(text)
+
+        image = await image_processor.ensure_prepared(image_bytes)
+        if image:
+            content.append(types.Part.from_bytes(data=image.data, mime_type=image.mime_type))
 
         if not content:
             return {"is_spam": False, "reason": "No content to analyze"}
 
-        content.append("\n".join(prompt_parts))
+        if cheap_only:
+            # 预算降级：只用廉价模型，不再升级
+            return await self._moderate(content, self.cascade_model_name or self.verification_model_name)
+
+        if self.cascade_model_name:
+            if image and config.AI_CASCADE_ESCALATE_IMAGES:
+                ai_telemetry.record_cascade(self.provider_name, "image")
+            else:
+                result = await self._moderate(content, self.cascade_model_name, triage=True)
+                outcome = escalation_reason(result, config.AI_CONFIDENCE_THRESHOLD)
+                ai_telemetry.record_cascade(self.provider_name, outcome or "accepted")
+                if outcome is None:
+                    return result
 
-        print("--- Sending request to Gemini API ---")
-        print(f"Content: {content}")
+        return await self._moderate(content, self.filter_model_name)
 
+    async def _moderate(self, content: list, model: str, triage: bool = False) -> dict:
+        if triage:
+            prompt, base_config, kind = self.triage_prompt, self.triage_config, "moderation_triage"
+        else:
+            prompt, base_config, kind = self.moderation_prompt, self.moderation_config, "moderation"
+        generation_config, cache_name = self._prompt_config(base_config, model, prompt)
+
+        if config.AI_STREAMING:
+            return await self._analyze_streaming(content, model, generation_config, kind, cache_name)
+
+        response = None
+        started = time.perf_counter()
         try:
             response = await self.client.aio.models.generate_content(
-                model=self.filter_model_name, contents=content
+                model=model,
+                contents=content,
+                config=generation_config,
             )
 
-            print("--- Received response from Gemini API ---")
-
             if not hasattr(response, "candidates") or not response.candidates:
                 print("Gemini analysis was blocked.")
                 if hasattr(response, "prompt_feedback"):
                     print(f"Prompt feedback: {response.prompt_feedback}")
+                self._record(model, kind, started, response, False)
                 return {"is_spam": True, "reason": "内容审查失败，可能包含不当内容。"}
 
-            if response.candidates and response.candidates[0].content.parts:
-                response_text = response.candidates[0].content.parts[0].text
-            else:
-                response_text = None
-
-            print(f"Raw response: {response_text}")
-
-            if not response_text:
-                raise ValueError("Gemini API returned an empty response.")
+            response_text = self._response_text(response)
+            result = normalize_moderation_result(parse_json_response(response_text))
+            self._record(model, kind, started, response, True)
+            return result
+        except Exception as e:
+            print(f"Gemini analysis failed: {e}")
+            self._check_cache_error(e, cache_name)
+            response_text = self._response_text(response)
+            if response_text:
+                print(f"Original Gemini response: {response_text}")
+            self._record(model, kind, started, response, False)
+            return {"is_spam": False, "reason": "Analysis failed"}
 
-            clean_text = re.sub(r"```json\s*|\s*```", "", response_text).strip()
-            result = json.loads(clean_text)
+    async def _analyze_streaming(
+        self, content: list, model: str, generation_config, kind: str, cache_name: str = None
+    ) -> dict:
+        started = time.perf_counter()
+        last_chunk = [None]
 
-            print(f"Parsed result: {result}")
-            return result
+        async def chunks():
+            try:
+                stream = await self.client.aio.models.generate_content_stream(
+                    model=model, contents=content, config=generation_config
+                )
+            except Exception as e:
+                self._check_cache_error(e, cache_name)
+                raise
+            async for chunk in stream:
+                last_chunk[0] = chunk
+                feedback = getattr(chunk, "prompt_feedback", None)
+                if not chunk.candidates and feedback and feedback.block_reason:
+                    print(f"Gemini analysis was blocked. Prompt feedback: {feedback}")
+                    yield '{"is_spam": true, "reason": "内容审查失败，可能包含不当内容。"}'
+                    return
+                yield self._response_text(chunk)
+
+        def on_complete(text: str, parsed: bool):
+            self._record(model, kind, started, last_chunk[0], parsed)
+
+        required = ("is_spam", "confidence") if kind == "moderation_triage" else ("is_spam",)
+        try:
+            return await stream_moderation(chunks(), on_complete, required)
         except Exception as e:
             print(f"Gemini analysis failed: {e}")
-            if "response" in locals():
-                try:
-                    if response.candidates and response.candidates[0].content.parts:
-                        response_text = response.candidates[0].content.parts[0].text
-                        print(f"Original Gemini response: {response_text}")
-                except (AttributeError, IndexError):
-                    print("Could not retrieve response text.")
             return {"is_spam": False, "reason": "Analysis failed"}
 
     def _get_local_question(self) -> dict:
@@ -263,120 +447,30 @@ class GeminiService:
             "options": options,
         }
 
-    async def generate_unblock_question(self) -> dict:
+    async def generate_verification_question(self, is_unblock: bool = False) -> dict:
         if not self.client or not self.verification_model_name:
             return self._get_local_question()
-
-        prompt = """
-        # 角色
-        你是一个人机验证（CAPTCHA）问题生成器。
-        # 任务
-        生成一个随机的、适合成年人的中文常识性问题，用于区分人类和机器人。问题的格式应该是多样的。
-        # 要求
-        1.  **问题格式多样性**: 你需要随机选择以下两种问题格式之一进行提问：
-            *   **a) 标准直接提问**: 例如，"中国的首都是哪里？"
-            *   **b) 反向排除提问**: 使用"以下哪个不属于...？"或类似的句式。例如，"以下哪个不属于行星？"
-        2.  **主题**: 问题主题应为完全随机的日常通用常识，无需限定在特定领域。
-        3.  **难度**: 问题和选项的难度应设定为"绝大多数18岁以上母语为中文的成年人都能立即回答正确"的水平，避免专业或冷门知识。
-        4.  **明确性**: 问题必须只有一个明确无误的正确答案。
-        5.  **答案逻辑**:
-            *   提供一个`correct_answer`（正确答案）。
-            *   提供一个包含三个字符串的列表`incorrect_answers`（干扰项）。
-            *   **对于标准问题**，所有选项应属于同一类别。
-            *   **对于反向排除问题**，三个`incorrect_answers`应属于同一类别，而`correct_answer`则是那个不属于该类别的 outlier（局外者）。
-        6.  **语言**: 所有内容必须为简体中文。
-        7.  **输出格式**: 严格按照以下JSON格式返回，不要包含任何额外的解释或文字。
-        # JSON格式示例
-        {
-          "question": "问题文本",
-          "correct_answer": "正确答案",
-          "incorrect_answers": ["干扰项1", "干扰项2", "干扰项3"]
-        }
-        """
-        try:
-            response = await self.client.aio.models.generate_content(
-                model=self.verification_model_name, contents=prompt
-            )
-
-            if response.candidates and response.candidates[0].content.parts:
-                response_text = response.candidates[0].content.parts[0].text
-            else:
-                response_text = None
-
-            if not response_text:
-                raise ValueError("Gemini API返回空响应")
-
-            clean_text = re.sub(r"```json\s*|\s*```", "", response_text).strip()
-            data = json.loads(clean_text)
-
-            correct_answer = data["correct_answer"]
-            options = data["incorrect_answers"] + [correct_answer]
-            random.shuffle(options)
-
-            return {
-                "question": data["question"],
-                "correct_answer": correct_answer,
-                "options": options,
-            }
-        except Exception as e:
-            print(f"生成解封验证问题失败: {e}")
-
-            if "response" in locals():
-                try:
-                    if response.candidates and response.candidates[0].content.parts:
-                        response_text = response.candidates[0].content.parts[0].text
-                        if response_text:
-                            print(f"Gemini原始响应: {response_text}")
-                except (AttributeError, IndexError):
-                    pass
-
+        if ai_budget.level(self.provider_name) >= VERIFICATION_ONLY:
             return self._get_local_question()
 
-    async def generate_verification_challenge(self) -> dict:
-        if not self.client or not self.verification_model_name:
-            return self._get_local_question()
-
-        prompt = """
-        # 角色
-        你是一个人机验证（CAPTCHA）问题生成器。
-        # 任务
-        生成一个随机的、适合成年人的中文常识性问题，用于区分人类和机器人。问题的格式应该是多样的。
-        # 要求
-        1.  **问题格式多样性**: 你需要随机选择以下两种问题格式之一进行提问：
-            *   **a) 标准直接提问**: 例如，"中国的首都是哪里？"
-            *   **b) 反向排除提问**: 使用"以下哪个不属于...？"或类似的句式。例如，"以下哪个不属于行星？"
-        2.  **主题**: 问题主题应为完全随机的日常通用常识，无需限定在特定领域。
-        3.  **难度**: 问题和选项的难度应设定为"绝大多数18岁以上母语为中文的成年人都能立即回答正确"的水平，避免专业或冷门知识。
-        4.  **明确性**: 问题必须只有一个明确无误的正确答案。
-        5.  **答案逻辑**:
-            *   提供一个`correct_answer`（正确答案）。
-            *   提供一个包含三个字符串的列表`incorrect_answers`（干扰项）。
-            *   **对于标准问题**，所有选项应属于同一类别。
-            *   **对于反向排除问题**，三个`incorrect_answers`应属于同一类别，而`correct_answer`则是那个不属于该类别的 outlier（局外者）。
-        6.  **语言**: 所有内容必须为简体中文。
-        7.  **输出格式**: 严格按照以下JSON格式返回，不要包含任何额外的解释或文字。
-        # JSON格式示例
-        {
-          "question": "问题文本",
-          "correct_answer": "正确答案",
-          "incorrect_answers": ["干扰项1", "干扰项2", "干扰项3"]
-        }
-        """
+        response = None
+        started = time.perf_counter()
+        challenge_config, cache_name = self._prompt_config(
+            self.challenge_config, self.verification_model_name, CHALLENGE_PROMPT
+        )
         try:
             response = await self.client.aio.models.generate_content(
-                model=self.verification_model_name, contents=prompt
+                model=self.verification_model_name,
+                contents=CHALLENGE_REQUEST,
+                config=challenge_config,
             )
 
-            if response.candidates and response.candidates[0].content.parts:
-                response_text = response.candidates[0].content.parts[0].text
-            else:
-                response_text = None
-
+            response_text = self._response_text(response)
             if not response_text:
                 raise ValueError("Gemini API返回空响应")
 
-            clean_text = re.sub(r"```json\s*|\s*```", "", response_text).strip()
-            data = json.loads(clean_text)
+            data = normalize_challenge(parse_json_response(response_text))
+            self._record(self.verification_model_name, "challenge", started, response, True)
 
             correct_answer = data["correct_answer"]
             options = data["incorrect_answers"] + [correct_answer]
@@ -388,32 +482,23 @@ class GeminiService:
                 "options": options,
             }
         except Exception as e:
-            print(f"生成验证问题失败: {e}")
-
-            if "response" in locals():
-                try:
-                    if response.candidates and response.candidates[0].content.parts:
-                        response_text = response.candidates[0].content.parts[0].text
-                        if response_text:
-                            print(f"Gemini原始响应: {response_text}")
-                except (AttributeError, IndexError):
-                    pass
-
+            print(f"生成{'解封' if is_unblock else ''}验证问题失败: {e}")
+            self._check_cache_error(e, cache_name)
+            response_text = self._response_text(response)
+            if response_text:
+                print(f"Gemini原始响应: {response_text}")
+            self._record(self.verification_model_name, "challenge", started, response, False)
             return self._get_local_question()
 
+    async def generate_unblock_question(self) -> dict:
+        return await self.generate_verification_question(is_unblock=True)
 
-def _create_ai_service():
-    if config.AI_PROVIDER == "openai" or config.AI_PROVIDER == "custom":
-        try:
-            from services.openai_service import OpenAIService
-
-            return OpenAIService()
-        except Exception as e:
-            print(f"无法初始化OpenAI服务: {e}")
-            print("回退到Gemini服务")
-            return GeminiService()
-    else:
-        return GeminiService()
+    async def generate_verification_challenge(self) -> dict:
+        return await self.generate_verification_question(is_unblock=False)
 
+    async def close(self):
+        if self.prompt_cache:
+            await self.prompt_cache.close()
+        if self.client:
+            await self.client.aio.aclose()
 
-gemini_service = _create_ai_service()
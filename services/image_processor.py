@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+from config import config
+
+
+class PreparedImage:
+    __slots__ = ("data", "mime_type", "width", "height", "_data_url")
+
+    def __init__(self, data: bytes, mime_type: str, width: int, height: int):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self._data_url = None
+
+    def data_url(self) -> str:
+        if self._data_url is None:
+            encoded = base64.b64encode(self.data).decode()
+            self._data_url = f"data:{self.mime_type};base64,{encoded}"
+        return self._data_url
+
+    def __repr__(self):
+        return f"<PreparedImage {self.mime_type} {self.width}x{self.height} {len(self.data)}B>"
+
+
+def _load_pillow():
+    # 在工作线程中导入 Pillow，启动时无需加载
+    from PIL import Image
+
+    return Image
+
+
+def _save_image(img, image_format: str, quality: int) -> PreparedImage:
+    output = io.BytesIO()
+    if image_format == "WEBP":
+        img.save(output, format="WEBP", quality=quality, method=4)
+        mime_type = "image/webp"
+    else:
+        img.save(output, format="JPEG", quality=quality, optimize=True)
+        mime_type = "image/jpeg"
+    return PreparedImage(output.getvalue(), mime_type, img.width, img.height)
+
+
+def _encode_image(data, max_edge: int, image_format: str, quality: int) -> PreparedImage:
+    Image = _load_pillow()
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG 可在解码阶段直接按 1/2、1/4、1/8 缩小，省去大部分解码开销
+        img.draft("RGB", (max_edge, max_edge))
+
+        if img.mode in ("RGBA", "LA", "P"):
+            if img.mode == "P":
+                img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+        return _save_image(img, image_format, quality)
+
+
+def _encode_collage(images: list, max_edge: int, image_format: str, quality: int) -> PreparedImage:
+    """把相册的多张审查图拼成一张网格图，整个相册只需一次AI调用。"""
+    Image = _load_pillow()
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    cell = max_edge // columns
+    sheet = Image.new("RGB", (cell * columns, cell * rows), (255, 255, 255))
+    for index, image in enumerate(images):
+        with Image.open(io.BytesIO(image.data)) as img:
+            img = img.convert("RGB")
+            img.thumbnail((cell, cell), Image.Resampling.BILINEAR)
+            x = (index % columns) * cell + (cell - img.width) // 2
+            y = (index // columns) * cell + (cell - img.height) // 2
+            sheet.paste(img, (x, y))
+    return _save_image(sheet, image_format, quality)
+
+
+class ImageProcessor:
+    def __init__(self):
+        self.max_edge = config.AI_IMAGE_MAX_EDGE
+        self.image_format = config.AI_IMAGE_FORMAT
+        self.quality = config.AI_IMAGE_QUALITY
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.IMAGE_WORKERS, thread_name_prefix="image"
+        )
+        # 限制同时排队的任务数，图片洪泛时在事件循环侧等待而不是堆积在线程池里
+        self.semaphore = asyncio.Semaphore(config.IMAGE_WORKERS * 2)
+
+    async def prepare_image(self, data) -> PreparedImage:
+        if not data:
+            return None
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self.executor, _encode_image, data, self.max_edge, self.image_format, self.quality
+                )
+            except Exception as e:
+                print(f"Error preparing image: {e}")
+                return None
+
+    async def prepare_collage(self, images: list) -> PreparedImage:
+        images = [image for image in images if image is not None]
+        if len(images) <= 1:
+            return images[0] if images else None
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self.executor, _encode_collage, images, self.max_edge, self.image_format, self.quality
+                )
+            except Exception as e:
+                print(f"Error preparing collage: {e}")
+                return images[0]
+
+    async def ensure_prepared(self, image) -> PreparedImage:
+        if image is None or isinstance(image, PreparedImage):
+            return image
+        return await self.prepare_image(image)
+
+    async def warm_up(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, _load_pillow)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_processor = ImageProcessor()
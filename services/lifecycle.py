@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from config import config
+from database import models as db
+from services.ai_registry import ai_registry
+from services.ai_streaming import pending_background_tasks
+from services.ai_telemetry import ai_telemetry
+from services.album import album_aggregator
+from services.image_processor import image_processor
+from services.queue_manager import message_queue
+from services.state_store import state_store
+from services.update_journal import update_journal
+from services.verification import persist_pending_verifications
+
+
+class LifecycleManager:
+    """Coordinates a graceful stop after SIGTERM/SIGINT.
+
+    ``run_polling`` stops fetching updates and waits for running handlers before
+    ``post_stop``; ``drain`` then flushes buffered albums/bursts, drains the message queue
+    and background work within SHUTDOWN_TIMEOUT and saves pending verifications while the
+    bot can still send. ``close`` runs in ``post_shutdown`` to flush telemetry and close the
+    AI clients, the image worker pool and the state store. Anything not finished stays in the update
+    journal and is replayed on the next start.
+    """
+
+    def __init__(self):
+        self.report = {}
+        self.deadline = None
+
+    def _remaining(self) -> float:
+        return max(0.0, self.deadline - asyncio.get_running_loop().time())
+
+    async def drain(self):
+        self.deadline = asyncio.get_running_loop().time() + config.SHUTDOWN_TIMEOUT
+        logging.info(f"开始关闭：最多等待 {config.SHUTDOWN_TIMEOUT}s 处理完进行中的消息")
+
+        self.report["groups_flushed"] = await album_aggregator.flush()
+        self.report.update(await message_queue.stop(timeout=self._remaining()))
+        self.report["background_abandoned"] = await pending_background_tasks(timeout=self._remaining())
+        await update_journal.stop()
+
+        try:
+            self.report["verifications_saved"] = await persist_pending_verifications()
+        except Exception as e:
+            logging.error(f"保存人机验证会话失败: {e}")
+        if config.UPDATE_JOURNAL_ENABLED:
+            try:
+                self.report["journal_incomplete"] = (await db.get_update_journal_counts())["incomplete"]
+            except Exception as e:
+                logging.error(f"读取更新日志失败: {e}")
+
+    async def close(self):
+        await ai_telemetry.stop()
+        closed = set()
+        for service in ai_registry.loaded().values():
+            if id(service) in closed:
+                continue
+            closed.add(id(service))
+            try:
+                await service.close()
+            except Exception as e:
+                logging.warning(f"关闭AI客户端失败: {e}")
+        image_processor.shutdown()
+        await state_store.close()
+        self.log_report()
+
+    def log_report(self):
+        r = self.report
+        logging.info(
+            "关闭完成："
+            f"提前发出合并分组 {r.get('groups_flushed', 0)} 个，"
+            f"排空消息 {r.get('drained', 0)} 条，未处理完 {r.get('abandoned', 0)} 条，"
+            f"未完成的后台任务 {r.get('background_abandoned', 0)} 个，"
+            f"保存人机验证 {r.get('verifications_saved', 0)} 个，"
+            f"待下次启动重放 {r.get('journal_incomplete', 0)} 条"
+        )
+
+
+lifecycle = LifecycleManager()
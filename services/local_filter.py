@@ -0,0 +1,22 @@
+import re
+from telegram import Message
+from config import config
+from services.ai_prompts import MODERATION_SAFE_REASON
+
+_LINK_PATTERN = re.compile(r"(https?://|www\.|t\.me/|telegram\.me/)", re.IGNORECASE)
+
+
+def local_moderate(message: Message) -> dict:
+    """AI 预算耗尽时使用的本地关键词/链接过滤，结果格式与 analyze_message 一致。"""
+    text = message.text or message.caption or ""
+    document = getattr(message, "document", None)
+    if document and document.file_name:
+        text = f"{text}\n{document.file_name}"
+
+    lowered = text.lower()
+    for keyword in config.LOCAL_FILTER_KEYWORDS:
+        if keyword.lower() in lowered:
+            return {"is_spam": True, "reason": f"本地过滤：包含敏感词「{keyword}」"}
+    if config.LOCAL_FILTER_BLOCK_LINKS and _LINK_PATTERN.search(text):
+        return {"is_spam": True, "reason": "本地过滤：AI审查暂不可用期间不允许发送链接"}
+    return {"is_spam": False, "reason": MODERATION_SAFE_REASON}
@@ -0,0 +1,101 @@
+from telegram import Message
+from config import config
+from services.image_processor import image_processor
+
+
+def _long_edge(media) -> int:
+    return max(media.width or 0, media.height or 0)
+
+
+def select_photo_size(photo_sizes, target_edge: int, max_bytes: int):
+    candidates = [
+        p for p in sorted(photo_sizes, key=_long_edge)
+        if not p.file_size or p.file_size <= max_bytes
+    ]
+    if not candidates:
+        return None
+    for size in candidates:
+        if _long_edge(size) >= target_edge:
+            return size
+    return candidates[-1]
+
+
+def select_sticker_source(sticker, target_edge: int, max_bytes: int):
+    thumbnail = sticker.thumbnail
+    is_static = not sticker.is_animated and not sticker.is_video
+    if thumbnail and (not thumbnail.file_size or thumbnail.file_size <= max_bytes):
+        if _long_edge(thumbnail) >= target_edge or not is_static:
+            return thumbnail
+    if is_static and (not sticker.file_size or sticker.file_size <= max_bytes):
+        return sticker
+    # 动态贴纸只能依靠缩略图审查
+    return thumbnail if thumbnail and not is_static else None
+
+
+def select_thumbnail(media, max_bytes: int):
+    thumbnail = getattr(media, "thumbnail", None)
+    if thumbnail and (not thumbnail.file_size or thumbnail.file_size <= max_bytes):
+        return thumbnail
+    return None
+
+
+def is_decodable_image(media) -> bool:
+    # 仅 Pillow 可直接解码的位图文件值得完整下载；视频需要额外解码器，只能依靠缩略图
+    mime_type = (getattr(media, "mime_type", None) or "").lower()
+    return mime_type.startswith("image/") and mime_type != "image/svg+xml"
+
+
+class MediaFetcher:
+    def __init__(self):
+        self.target_edge = config.AI_IMAGE_TARGET_EDGE
+        self.max_bytes = config.MEDIA_DOWNLOAD_MAX_BYTES
+
+    def select_moderation_source(self, message: Message):
+        if message.photo:
+            return select_photo_size(message.photo, self.target_edge, self.max_bytes)
+        if message.sticker:
+            return select_sticker_source(message.sticker, self.target_edge, self.max_bytes)
+        media = message.video or message.animation or message.document
+        if media:
+            return select_thumbnail(media, self.max_bytes)
+        return None
+
+    def select_full_download(self, message: Message):
+        """缩略图缺失、廉价审查无法定论时，可完整下载的原文件（受 MEDIA_DOWNLOAD_MAX_BYTES 限制）。"""
+        media = message.animation or message.document
+        if not media or not is_decodable_image(media):
+            return None
+        if media.file_size and media.file_size > self.max_bytes:
+            return None
+        return media
+
+    async def fetch_image(self, media, max_bytes: int = None):
+        """下载审查用媒体并编码，超过 ``max_bytes`` 的文件不下载。
+
+        PTB 会先把整个响应体读入内存，无法在下载过程中截断，因此上限依据消息和 getFile
+        给出的 file_size 在下载前判断；两者都未给出大小时才在下载后检查。"""
+        limit = max_bytes or self.max_bytes
+        if media.file_size and media.file_size > limit:
+            return None
+        try:
+            file = await media.get_file()
+            if file.file_size and file.file_size > limit:
+                print(f"媒体文件超出下载上限，已跳过: {file.file_size} > {limit}")
+                return None
+            data = await file.download_as_bytearray()
+            if len(data) > limit:
+                print(f"媒体文件超出下载上限，已跳过: {len(data)} > {limit}")
+                return None
+            return await image_processor.prepare_image(data)
+        except Exception as e:
+            print(f"下载审查用媒体失败: {e}")
+            return None
+
+    async def fetch_moderation_image(self, message: Message):
+        source = self.select_moderation_source(message)
+        if not source:
+            return None
+        return await self.fetch_image(source)
+
+
+media_fetcher = MediaFetcher()
@@ -0,0 +1,151 @@
+import asyncio
+from telegram import Message
+from telegram.constants import ChatAction
+from database import models as db
+from config import config
+from services.ai_budget import ai_budget, CHEAP_MODELS, LOCAL_ONLY, VERIFICATION_ONLY
+from services.ai_registry import ai_registry, gemini_service
+from services.ai_streaming import resolve_moderation_result, run_in_background
+from services.album import AlbumView
+from services.image_processor import image_processor
+from services.local_filter import local_moderate
+from services.media_fetcher import media_fetcher
+from services.trust import trust_manager
+
+
+def get_media_info(message: Message) -> tuple:
+    if message.photo:
+        return "photo", message.photo[-1].file_id
+    if message.sticker:
+        return "sticker", message.sticker.file_id
+    if message.animation:
+        return "animation", message.animation.file_id
+    if message.video:
+        return "video", message.video.file_id
+    if message.document:
+        return "document", message.document.file_id
+    return None, None
+
+
+async def _budget_gate(message) -> tuple:
+    """按AI预算等级返回 (直接可用的审查结果或 None, 是否只用廉价模型)。"""
+    service = await ai_registry.aget()
+    level = ai_budget.level(service.provider_name)
+    if level >= VERIFICATION_ONLY:
+        return {"is_spam": False, "reason": "AI budget exhausted"}, False
+    if level >= LOCAL_ONLY:
+        return local_moderate(message), False
+    return None, level >= CHEAP_MODELS
+
+
+async def moderate_message(message: Message) -> dict:
+    """先用缩略图、说明文字与文件信息做廉价审查；无图可审且原文件可解码时才完整下载后复审。"""
+    result, cheap_only = await _budget_gate(message)
+    if result is not None:
+        return result
+    if isinstance(message, AlbumView):
+        return await _moderate_album(message, cheap_only)
+
+    image = await media_fetcher.fetch_moderation_image(message)
+    result = await gemini_service.analyze_message(message, image, cheap_only=cheap_only)
+    if image is not None or result.get("is_spam"):
+        return result
+
+    source = media_fetcher.select_full_download(message)
+    if source is None:
+        return result
+    image = await media_fetcher.fetch_image(source)
+    if image is None:
+        return result
+    return await gemini_service.analyze_message(message, image, cheap_only=cheap_only)
+
+
+async def _moderate_album(album: AlbumView, cheap_only: bool) -> dict:
+    # 整个相册一次审查：各项说明文字已合并，审查图拼成一张网格图
+    images = await asyncio.gather(*(media_fetcher.fetch_moderation_image(message) for message in album.messages))
+    image = await image_processor.prepare_collage(images)
+    return await gemini_service.analyze_message(album, image, cheap_only=cheap_only)
+
+
+class ModerationStatus:
+    """Typing indicator first; a visible status message only if analysis outlasts ``delay``."""
+
+    def __init__(self, bot, message: Message, delay: float = None):
+        self.bot = bot
+        self.message = message
+        self.delay = config.AI_STATUS_DELAY if delay is None else delay
+        self.notice = None
+        self.posting = False
+        self.task = None
+
+    def start(self):
+        run_in_background(self._send_typing())
+        self.task = asyncio.create_task(self._post_later())
+        return self
+
+    async def _send_typing(self):
+        try:
+            await self.bot.send_chat_action(chat_id=self.message.chat_id, action=ChatAction.TYPING)
+        except Exception as e:
+            print(f"发送输入状态失败: {e}")
+
+    async def _post_later(self):
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        self.posting = True
+        self.notice = await self.bot.send_message(
+            chat_id=self.message.chat_id,
+            text="正在通过AI分析内容是否包含垃圾信息...",
+            reply_to_message_id=self.message.message_id
+        )
+
+    async def finish(self, text: str = None):
+        """Removes the status message, or replaces it with ``text``; posts ``text`` if none was shown."""
+        if self.task is not None and not self.task.done() and not self.posting:
+            self.task.cancel()
+        if self.task is not None:
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"发送审查状态消息失败: {e}")
+
+        try:
+            if self.notice is not None:
+                if text:
+                    await self.notice.edit_text(text)
+                else:
+                    await self.notice.delete()
+            elif text:
+                await self.bot.send_message(
+                    chat_id=self.message.chat_id,
+                    text=text,
+                    reply_to_message_id=self.message.message_id
+                )
+        except Exception as e:
+            print(f"更新审查状态消息失败: {e}")
+
+    def close(self):
+        return run_in_background(self.finish())
+
+
+async def _finish_blocked(user_id: int, message: Message, analysis_result: dict, status: ModerationStatus):
+    result = await resolve_moderation_result(analysis_result)
+    media_type, media_file_id = get_media_info(getattr(message, "first", message))
+    await db.save_filtered_message(
+        user_id=user_id,
+        message_id=message.message_id,
+        content=message.text or message.caption,
+        reason=result.get("reason"),
+        media_type=media_type,
+        media_file_id=media_file_id,
+    )
+    await trust_manager.refresh(user_id)
+    reason = result.get("reason") or "未提供原因"
+    await status.finish(f"您的消息已被系统拦截，因此未被转发\n\n原因：{reason}")
+
+
+def handle_blocked(user_id: int, message: Message, analysis_result: dict, status: ModerationStatus):
+    # 判定已出，原因可能仍在流式生成中；在后台补全后再记录与通知，处理器可立即返回
+    return run_in_background(_finish_blocked(user_id, message, analysis_result, status))
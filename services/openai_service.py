@@ -1,11 +1,30 @@
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, BadRequestError
 from telegram import Message
 from config import config
-import json
+from services.ai_prompts import (
+    CHALLENGE_MAX_TOKENS,
+    CHALLENGE_PROMPT,
+    CHALLENGE_REQUEST,
+    MODERATION_MAX_TOKENS,
+    MODERATION_PROMPT,
+    MODERATION_TRIAGE_PROMPT,
+    OPENAI_CHALLENGE_FORMAT,
+    OPENAI_JSON_OBJECT_FORMAT,
+    OPENAI_MODERATION_FORMAT,
+    OPENAI_MODERATION_TRIAGE_FORMAT,
+    build_moderation_text,
+    describe_media,
+    escalation_reason,
+    normalize_challenge,
+    normalize_moderation_result,
+)
+from services.ai_budget import ai_budget, VERIFICATION_ONLY
+from services.ai_streaming import stream_moderation
+from services.ai_telemetry import ai_telemetry
+from services.image_processor import image_processor
+from utils.json_stream import parse_json_response
 import random
-import base64
-import io
-from PIL import Image
+import time
 
 LOCAL_VERIFICATION_QUESTIONS = [
     {
@@ -157,116 +176,214 @@ LOCAL_VERIFICATION_QUESTIONS = [
 
 
 class OpenAIService:
+    provider_name = "openai"
+
     def __init__(self):
+        self.moderation_prompt = MODERATION_PROMPT
+        self.triage_prompt = MODERATION_TRIAGE_PROMPT
         if config.CUSTOM_AI_API_KEY and config.CUSTOM_AI_API_URL:
             self.client = AsyncOpenAI(
                 api_key=config.CUSTOM_AI_API_KEY, base_url=config.CUSTOM_AI_API_URL
             )
             self.filter_model_name = config.CUSTOM_AI_MODEL
+            self.cascade_model_name = config.CUSTOM_AI_CASCADE_MODEL if config.AI_CASCADE_ENABLED else None
             self.verification_model_name = (
                 config.CUSTOM_AI_VERIFICATION_MODEL or config.CUSTOM_AI_MODEL
             )
         else:
             self.client = None
             self.filter_model_name = None
+            self.cascade_model_name = None
             self.verification_model_name = None
 
-    def _image_to_base64(self, image_bytes: bytes) -> str:
-        try:
-            image = Image.open(io.BytesIO(image_bytes))
-            if image.mode in ("RGBA", "LA", "P"):
-                background = Image.new("RGB", image.size, (255, 255, 255))
-                if image.mode == "P":
-                    image = image.convert("RGBA")
-                background.paste(
-                    image,
-                    mask=image.split()[-1] if image.mode in ("RGBA", "LA") else None,
-                )
-                image = background
-            elif image.mode != "RGB":
-                image = image.convert("RGB")
-
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG", quality=85)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            return f"data:image/jpeg;base64,{img_str}"
-        except Exception as e:
-            print(f"Error converting image to base64: {e}")
-            return None
+        # 结构化输出能力逐级降级：json_schema -> json_object -> 仅提示词。
+        # 降级结果会被记住，避免每次调用都先失败一次再重试
+        self.response_format_mode = "json_schema" if config.AI_STRUCTURED_OUTPUT else None
+        self.stream_usage_supported = True
+        # OpenAI 对长度达标的相同前缀自动缓存；prompt_cache_key 让同类请求路由到同一缓存，
+        # 部分兼容接口不认识该参数，被拒绝后不再发送
+        self.prompt_cache_key_supported = config.AI_PROMPT_CACHE
+
+    def _response_format(self, schema_format: dict):
+        if self.response_format_mode == "json_schema":
+            return schema_format
+        if self.response_format_mode == "json_object":
+            return OPENAI_JSON_OBJECT_FORMAT
+        return None
+
+    def _downgrade_response_format(self, error: Exception) -> bool:
+        if not self.response_format_mode:
+            return False
+        message = str(error).lower()
+        if "response_format" not in message and "json_schema" not in message and "json_object" not in message:
+            return False
+        previous = self.response_format_mode
+        self.response_format_mode = "json_object" if previous == "json_schema" else None
+        print(f"AI API 不支持 {previous} 输出格式，已降级为 {self.response_format_mode or 'prompt-only'}")
+        return True
+
+    def _downgrade_stream_options(self, error: Exception) -> bool:
+        if not self.stream_usage_supported or "stream_options" not in str(error).lower():
+            return False
+        self.stream_usage_supported = False
+        print("AI API 不支持 stream_options，流式调用将不再统计 token 用量")
+        return True
+
+    def _downgrade_prompt_cache_key(self, error: Exception) -> bool:
+        if not self.prompt_cache_key_supported or "prompt_cache_key" not in str(error).lower():
+            return False
+        self.prompt_cache_key_supported = False
+        print("AI API 不支持 prompt_cache_key，将仅依赖自动前缀缓存")
+        return True
+
+    async def _create_completion(self, schema_format: dict, cache_key: str = None, **kwargs):
+        while True:
+            # 较新的参数经 extra_body 传递：旧版 SDK 不认识这些关键字参数，会直接抛出 TypeError，
+            # 走不到下面按 BadRequestError 降级的逻辑
+            extra_body = {}
+            if cache_key and self.prompt_cache_key_supported:
+                extra_body["prompt_cache_key"] = cache_key
+            if kwargs.get("stream") and self.stream_usage_supported:
+                extra_body["stream_options"] = {"include_usage": True}
+            if extra_body:
+                kwargs["extra_body"] = extra_body
+            else:
+                kwargs.pop("extra_body", None)
+            response_format = self._response_format(schema_format)
+            if response_format:
+                kwargs["response_format"] = response_format
+            else:
+                kwargs.pop("response_format", None)
+            try:
+                return await self.client.chat.completions.create(**kwargs)
+            except BadRequestError as e:
+                if (
+                    not self._downgrade_stream_options(e)
+                    and not self._downgrade_prompt_cache_key(e)
+                    and not self._downgrade_response_format(e)
+                ):
+                    raise
+
+    def _record(self, model: str, kind: str, started: float, response, parsed: bool):
+        usage = getattr(response, "usage", None) if response else None
+        details = getattr(usage, "prompt_tokens_details", None)
+        ai_telemetry.record_call(
+            provider=self.provider_name,
+            model=model,
+            kind=kind,
+            latency=time.perf_counter() - started,
+            input_tokens=getattr(usage, "prompt_tokens", None),
+            output_tokens=getattr(usage, "completion_tokens", None),
+            parsed=parsed,
+            cached_tokens=getattr(details, "cached_tokens", None),
+        )
 
     async def analyze_message(
-        self, message: Message, image_bytes: bytes = None
+        self, message: Message, image_bytes: bytes = None, cheap_only: bool = False
     ) -> dict:
         if not self.client or not self.filter_model_name or not config.ENABLE_AI_FILTER:
             return {"is_spam": False, "reason": "AI filter disabled"}
 
-        messages = []
-
-        prompt_text = (
-            "你是一个内容审查员。你的任务是分析提供给你的文本和/或图片内容，并判断其是否包含垃圾信息、恶意软件、钓鱼链接、不当言论、辱骂、攻击性词语或任何违反安全政策的内容。\n"
-            "请严格按照要求，仅以JSON格式返回你的分析结果，不要包含任何额外的解释或标记。\n"
-            "**输出格式**: 你必须且只能以严格的JSON格式返回你的分析结果，不得包含任何解释性文字或代码块标记。\n"
-            '**JSON结构**:\n```json\n{\n  "is_spam": boolean,\n  "reason": "string"\n}\n```\n'
-            "*   `is_spam`: 如果内容违反**任何一条**安全策略，则为 `true`；如果内容完全安全，则为 `false`。\n"
-            '*   `reason`: 用一句话精准概括判断依据。如果违规，请明确指出违规的类型。如果安全，此字段固定为 `"内容未发现违规。"`\n'
-            "\n--- 以下是需要分析的内容 ---\n"
+        image = await image_processor.ensure_prepared(image_bytes)
+        user_text = build_moderation_text(
+            message.text or message.caption, has_image=bool(image), media_note=describe_media(message)
         )
 
-        if message.text:
-            prompt_text += f"\n文本内容: {message.text}"
-
         content_parts = []
+        if image:
+            content_parts.append({"type": "text", "text": user_text})
+            content_parts.append(
+                {"type": "image_url", "image_url": {"url": image.data_url()}}
+            )
 
-        if image_bytes:
-            base64_image = self._image_to_base64(image_bytes)
-            if base64_image:
-                content_parts.append({"type": "text", "text": prompt_text})
-                content_parts.append(
-                    {"type": "image_url", "image_url": {"url": base64_image}}
-                )
+        if not content_parts and not user_text:
+            return {"is_spam": False, "reason": "No content to analyze"}
+
+        user_content = content_parts or user_text
+
+        if cheap_only:
+            # 预算降级：只用廉价模型，不再升级
+            return await self._moderate(user_content, self.cascade_model_name or self.verification_model_name)
+
+        if self.cascade_model_name:
+            if image and config.AI_CASCADE_ESCALATE_IMAGES:
+                ai_telemetry.record_cascade(self.provider_name, "image")
             else:
-                content_parts.append({"type": "text", "text": prompt_text})
-        else:
-            content_parts.append({"type": "text", "text": prompt_text})
+                result = await self._moderate(user_content, self.cascade_model_name, triage=True)
+                outcome = escalation_reason(result, config.AI_CONFIDENCE_THRESHOLD)
+                ai_telemetry.record_cascade(self.provider_name, outcome or "accepted")
+                if outcome is None:
+                    return result
 
-        messages.append(
-            {
-                "role": "user",
-                "content": content_parts if len(content_parts) > 1 else prompt_text,
-            }
-        )
+        return await self._moderate(user_content, self.filter_model_name)
+
+    async def _moderate(self, user_content, model: str, triage: bool = False) -> dict:
+        if triage:
+            prompt, schema_format, kind = self.triage_prompt, OPENAI_MODERATION_TRIAGE_FORMAT, "moderation_triage"
+        else:
+            prompt, schema_format, kind = self.moderation_prompt, OPENAI_MODERATION_FORMAT, "moderation"
+        messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": user_content},
+        ]
 
-        print("--- Sending request to Custom AI API ---")
-        print(f"Model: {self.filter_model_name}")
+        if config.AI_STREAMING:
+            return await self._analyze_streaming(messages, model, schema_format, kind)
 
+        response = None
+        started = time.perf_counter()
         try:
-            response = await self.client.chat.completions.create(
-                model=self.filter_model_name,
+            response = await self._create_completion(
+                schema_format,
+                cache_key=kind,
+                model=model,
                 messages=messages,
                 temperature=0.3,
-                max_tokens=500,
+                max_tokens=MODERATION_MAX_TOKENS,
             )
 
-            print("--- Received response from Custom AI API ---")
-
             if not response.choices:
                 print("AI analysis was blocked or returned no choices.")
+                self._record(model, kind, started, response, False)
                 return {"is_spam": True, "reason": "内容审查失败，可能包含不当内容。"}
 
             response_text = response.choices[0].message.content
+            result = normalize_moderation_result(parse_json_response(response_text))
+            self._record(model, kind, started, response, True)
+            return result
+        except Exception as e:
+            print(f"AI analysis failed: {e}")
+            if response is not None and getattr(response, "choices", None):
+                print(f"AI原始响应: {response.choices[0].message.content}")
+            self._record(model, kind, started, response, False)
+            return {"is_spam": False, "reason": "Analysis failed"}
 
-            print(f"Raw response: {response_text}")
-
-            if not response_text:
-                raise ValueError("AI API returned an empty response.")
+    async def _analyze_streaming(self, messages: list, model: str, schema_format: dict, kind: str) -> dict:
+        started = time.perf_counter()
+        last_chunk = [None]
 
-            import re
+        async def chunks():
+            stream = await self._create_completion(
+                schema_format,
+                cache_key=kind,
+                model=model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=MODERATION_MAX_TOKENS,
+                stream=True,
+            )
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    last_chunk[0] = chunk
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content
 
-            clean_text = re.sub(r"```json\s*|\s*```", "", response_text).strip()
-            result = json.loads(clean_text)
+        def on_complete(text: str, parsed: bool):
+            self._record(model, kind, started, last_chunk[0], parsed)
 
-            print(f"Parsed result: {result}")
-            return result
+        required = ("is_spam", "confidence") if kind == "moderation_triage" else ("is_spam",)
+        try:
+            return await stream_moderation(chunks(), on_complete, required)
         except Exception as e:
             print(f"AI analysis failed: {e}")
             return {"is_spam": False, "reason": "Analysis failed"}
@@ -286,39 +403,22 @@ class OpenAIService:
     async def generate_verification_question(self, is_unblock: bool = False) -> dict:
         if not self.client or not self.verification_model_name:
             return self._get_local_question()
+        if ai_budget.level(self.provider_name) >= VERIFICATION_ONLY:
+            return self._get_local_question()
 
-        prompt = """
-        # 角色
-        你是一个人机验证（CAPTCHA）问题生成器。
-        # 任务
-        生成一个随机的、适合成年人的中文常识性问题，用于区分人类和机器人。问题的格式应该是多样的。
-        # 要求
-        1.  **问题格式多样性**: 你需要随机选择以下两种问题格式之一进行提问：
-            *   **a) 标准直接提问**: 例如，"中国的首都是哪里？"
-            *   **b) 反向排除提问**: 使用"以下哪个不属于...？"或类似的句式。例如，"以下哪个不属于行星？"
-        2.  **主题**: 问题主题应为完全随机的日常通用常识，无需限定在特定领域。
-        3.  **难度**: 问题和选项的难度应设定为"绝大多数18岁以上母语为中文的成年人都能立即回答正确"的水平，避免专业或冷门知识。
-        4.  **明确性**: 问题必须只有一个明确无误的正确答案。
-        5.  **答案逻辑**:
-            *   提供一个`correct_answer`（正确答案）。
-            *   提供一个包含三个字符串的列表`incorrect_answers`（干扰项）。
-            *   **对于标准问题**，所有选项应属于同一类别。
-            *   **对于反向排除问题**，三个`incorrect_answers`应属于同一类别，而`correct_answer`则是那个不属于该类别的 outlier（局外者）。
-        6.  **语言**: 所有内容必须为简体中文。
-        7.  **输出格式**: 严格按照以下JSON格式返回，不要包含任何额外的解释或文字。
-        # JSON格式示例
-        {
-          "question": "问题文本",
-          "correct_answer": "正确答案",
-          "incorrect_answers": ["干扰项1", "干扰项2", "干扰项3"]
-        }
-        """
+        response = None
+        started = time.perf_counter()
         try:
-            response = await self.client.chat.completions.create(
+            response = await self._create_completion(
+                OPENAI_CHALLENGE_FORMAT,
+                cache_key="challenge",
                 model=self.verification_model_name,
-                messages=[{"role": "user", "content": prompt}],
+                messages=[
+                    {"role": "system", "content": CHALLENGE_PROMPT},
+                    {"role": "user", "content": CHALLENGE_REQUEST},
+                ],
                 temperature=0.8,
-                max_tokens=500,
+                max_tokens=CHALLENGE_MAX_TOKENS,
             )
 
             if not response.choices:
@@ -329,10 +429,8 @@ class OpenAIService:
             if not response_text:
                 raise ValueError("AI API返回空响应")
 
-            import re
-
-            clean_text = re.sub(r"```json\s*|\s*```", "", response_text).strip()
-            data = json.loads(clean_text)
+            data = normalize_challenge(parse_json_response(response_text))
+            self._record(self.verification_model_name, "challenge", started, response, True)
 
             correct_answer = data["correct_answer"]
             options = data["incorrect_answers"] + [correct_answer]
@@ -347,7 +445,7 @@ class OpenAIService:
             print(f"生成{'解封' if is_unblock else ''}验证问题失败: {e}")
 
             if (
-                "response" in locals()
+                response is not None
                 and hasattr(response, "choices")
                 and response.choices
             ):
@@ -358,6 +456,7 @@ class OpenAIService:
                 except (AttributeError, IndexError):
                     pass
 
+            self._record(self.verification_model_name, "challenge", started, response, False)
             return self._get_local_question()
 
     async def generate_unblock_question(self) -> dict:
@@ -365,3 +464,7 @@ class OpenAIService:
 
     async def generate_verification_challenge(self) -> dict:
         return await self.generate_verification_question(is_unblock=False)
+
+    async def close(self):
+        if self.client:
+            await self.client.close()
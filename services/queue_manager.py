@@ -1,62 +1,194 @@
 import asyncio
+import contextlib
+import itertools
+import logging
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import ContextTypes
 from config import config
+from services.update_scheduler import classify_update, release_admission
+
+
+class ShardStats:
+    __slots__ = ("processed", "errors", "timeouts", "rejected", "wait_times", "run_times")
+
+    def __init__(self, samples: int = 200):
+        self.processed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=samples)
+        self.run_times = deque(maxlen=samples)
+
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
 
 class MessageQueue:
-    def __init__(self):
-        self.queue = asyncio.Queue()
-    
-    async def add_message(self, message_data):
-        await self.queue.put(message_data)
-    
-    async def worker(self, name):
+    """Sharded ingress pipeline for private messages.
+
+    Each user_id maps to exactly one shard and every shard has a single worker, so one
+    user's messages are processed strictly in order while different users run in parallel.
+    Within a shard, items are served by the update scheduler's class (verified users before
+    unverified ones), FIFO within a class; a user's later message never gets a better class
+    than their earlier ones still queued, so per-user order holds. Shard queues are bounded;
+    when a shard is full, ``submit`` gives back its admission slot and waits up to
+    QUEUE_TIMEOUT before rejecting the message.
+    """
+
+    def __init__(self, shards: int = None):
+        self.shard_count = max(1, shards or config.MAX_WORKERS)
+        self.queues = []
+        self.stats = []
+        self.workers = []
+        self.handler = None
+        self.on_timeout = None
+        self.in_flight = 0
+        self.ingress_locks = {}
+        self.sequence = itertools.count()
+        # user_id -> [排队中最低的优先级, 排队条数]
+        self.queued_users = {}
+
+    @contextlib.asynccontextmanager
+    async def ingress(self, user_id: int):
+        """按到达顺序串行化同一用户在入队前的异步步骤（如写更新日志），保证入队顺序不变。"""
+        entry = self.ingress_locks.get(user_id)
+        if entry is None:
+            entry = self.ingress_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[0].locked():
+            # 等待自己的前一条消息时不占用更新调度名额
+            release_admission()
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.ingress_locks[user_id]
+
+    def shard_for(self, user_id: int) -> int:
+        return user_id % self.shard_count
+
+    async def start(self, handler, max_size: int, on_timeout=None):
+        """``handler(update, context)`` 为实际处理函数；``max_size`` 为所有分片的总容量；
+        处理超过 QUEUE_TIMEOUT 被取消时调用 ``on_timeout(update, context)``。"""
+        if self.workers:
+            return
+        self.handler = handler
+        self.on_timeout = on_timeout
+        per_shard = max(1, max_size // self.shard_count)
+        self.queues = [asyncio.PriorityQueue(maxsize=per_shard) for _ in range(self.shard_count)]
+        self.stats = [ShardStats() for _ in range(self.shard_count)]
+        self.workers = [
+            asyncio.create_task(self.worker(i), name=f"message-shard-{i}")
+            for i in range(self.shard_count)
+        ]
+        logging.info(f"消息队列已启动: {self.shard_count} 个分片，每个分片容量 {per_shard}")
+
+    async def submit(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        user_id = update.effective_user.id
+        shard = self.shard_for(user_id)
+        queue = self.queues[shard]
+        priority = classify_update(update)
+        queued = self.queued_users.get(user_id)
+        if queued is None:
+            queued = self.queued_users[user_id] = [priority, 0]
+        else:
+            priority = queued[0] = max(queued[0], priority)
+        queued[1] += 1
+        item = (priority, next(self.sequence), update, context, time.perf_counter())
+        if queue.full():
+            # 分片已满时先交还调度名额，避免阻塞的入队占满名额、拖慢回调与管理员操作
+            release_admission()
+        try:
+            await asyncio.wait_for(queue.put(item), timeout=config.QUEUE_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            self._dequeued(user_id)
+            self.stats[shard].rejected += 1
+            logging.warning(f"消息队列分片 {shard} 已满，丢弃用户 {user_id} 的消息")
+            return False
+
+    def _dequeued(self, user_id: int):
+        queued = self.queued_users.get(user_id)
+        if queued is None:
+            return
+        queued[1] -= 1
+        if not queued[1]:
+            del self.queued_users[user_id]
+
+    async def worker(self, shard: int):
+        queue = self.queues[shard]
+        stats = self.stats[shard]
         while True:
+            _, _, update, context, enqueued_at = await queue.get()
+            self._dequeued(update.effective_user.id)
+            started = time.perf_counter()
+            stats.wait_times.append(started - enqueued_at)
+            self.in_flight += 1
             try:
-                message_data = await self.queue.get()
-                
-                update = message_data['update']
-                context = message_data['context']
-                user = update.effective_user
-                
-                
-                from services.gemini_service import gemini_service
-                if update.message.text:
-                    analysis = await gemini_service.analyze_message(update.message.text)
-                    if analysis['is_spam']:
-                        await context.bot.send_message(
-                            chat_id=user.id,
-                            text=f"您的消息被拦截，原因：{analysis['reason']}"
-                        )
-                        self.queue.task_done()
-                        continue
-                
-                
-                from services.thread_manager import get_or_create_thread
-                thread_id = await get_or_create_thread(update, context)
-                
-                if thread_id:
-                    await context.bot.forward_message(
-                        chat_id=config.FORUM_GROUP_ID,
-                        from_chat_id=user.id,
-                        message_id=update.message.message_id,
-                        message_thread_id=thread_id
-                    )
-                
-                self.queue.task_done()
+                await asyncio.wait_for(self.handler(update, context), timeout=config.QUEUE_TIMEOUT)
+                stats.processed += 1
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                logging.warning(f"消息队列分片 {shard} 处理超时（{config.QUEUE_TIMEOUT}s），用户 {update.effective_user.id}")
+                if self.on_timeout:
+                    try:
+                        await self.on_timeout(update, context)
+                    except Exception as e:
+                        logging.exception(f"处理超时消息失败: {e}")
             except Exception as e:
-                print(f"Worker {name} 错误: {e}")
-    
-    async def start(self):
-        tasks = []
-        for i in range(config.MAX_WORKERS):
-            task = asyncio.create_task(self.worker(f"Worker-{i+1}"))
-            tasks.append(task)
-        
-        await self.queue.join()
-        
-        for task in tasks:
+                stats.errors += 1
+                logging.exception(f"消息队列分片 {shard} 处理失败: {e}")
+            finally:
+                self.in_flight -= 1
+                stats.run_times.append(time.perf_counter() - started)
+                queue.task_done()
+
+    async def stop(self, timeout: float = None) -> dict:
+        """排空队列（最多等待 ``timeout`` 秒）后停止 worker，返回排空与放弃的消息数。"""
+        if not self.workers:
+            return {"drained": 0, "abandoned": 0}
+        backlog = self.depth() + self.in_flight
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self.queues)), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logging.warning(f"消息队列未能在 {timeout}s 内排空，剩余 {self.depth()} 条")
+        abandoned = self.depth() + self.in_flight
+        for task in self.workers:
             task.cancel()
-        
-        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        return {"drained": max(0, backlog - abandoned), "abandoned": abandoned}
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def summary(self) -> list:
+        return [
+            {
+                "shard": i,
+                "depth": self.queues[i].qsize(),
+                "capacity": self.queues[i].maxsize,
+                "processed": stats.processed,
+                "errors": stats.errors,
+                "timeouts": stats.timeouts,
+                "rejected": stats.rejected,
+                "wait_p50": _percentile(stats.wait_times, 0.50),
+                "wait_p95": _percentile(stats.wait_times, 0.95),
+                "run_p50": _percentile(stats.run_times, 0.50),
+                "run_p95": _percentile(stats.run_times, 0.95),
+            }
+            for i, stats in enumerate(self.stats)
+        ]
 
 
-message_queue = MessageQueue()
\ No newline at end of file
+message_queue = MessageQueue()
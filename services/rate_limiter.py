@@ -1,47 +1,226 @@
-import asyncio
 import time
-from collections import defaultdict, deque
 from config import config
+from services.state_store import state_store
+
+# 限制层级名称与窗口（秒）
+TIER_WINDOWS = {"second": 1.0, "minute": 60.0, "hour": 3600.0, "day": 86400.0}
+TIER_NAMES = {"second": "每秒", "minute": "每分钟", "hour": "每小时", "day": "每天"}
+
+WARNING_NAMESPACE = "rate_warning"
+
+COST_NAMES = {
+    "text": "文字", "sticker": "贴纸", "photo": "图片", "animation": "动图", "video": "视频",
+    "document": "文件", "voice": "语音", "audio": "音频", "album": "相册", "other": "其他",
+}
+
+
+def parse_pairs(value: str) -> dict:
+    """解析 ``name:number,name:number`` 形式的配置。"""
+    result = {}
+    for item in value.split(","):
+        if ":" not in item:
+            continue
+        name, number = item.split(":", 1)
+        result[name.strip().lower()] = float(number)
+    return result
+
+
+def _message_type(message) -> str:
+    if message.photo:
+        return "photo"
+    if message.sticker:
+        return "sticker"
+    # 动图同时带有 document 字段，需在 document 之前判断
+    if message.animation:
+        return "animation"
+    if message.video or message.video_note:
+        return "video"
+    if message.document:
+        return "document"
+    if message.voice:
+        return "voice"
+    if message.audio:
+        return "audio"
+    if message.text:
+        return "text"
+    return "other"
+
+
+def message_cost(messages: list, costs: dict = None) -> float:
+    """按消息类型计算一组消息的额度消耗；配置了 album 时同一相册的各项只按一次相册计费。"""
+    costs = rate_limiter.costs if costs is None else costs
+    total = 0.0
+    albums = set()
+    for message in messages:
+        if message.media_group_id and "album" in costs:
+            if message.media_group_id not in albums:
+                albums.add(message.media_group_id)
+                total += costs.get("album", costs.get("other", 1))
+            continue
+        total += costs.get(_message_type(message), costs.get("other", 1))
+    return total
+
+
+class Tier:
+    """GCRA (generic cell rate algorithm) state for one limit: one float per active user.
+
+    Each user's state is the theoretical arrival time (TAT) of their next unit of cost. A
+    charge succeeds while the new TAT stays within one window of now, which allows up to
+    ``limit`` units in any window-long span. A TAT in the past means the user is idle; such
+    users are dropped by rotating two generations of state every window, so memory tracks
+    recently active users only.
+    """
+
+    __slots__ = ("name", "limit", "window", "interval", "current", "previous", "rotated_at")
+
+    def __init__(self, name: str, limit: float, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.interval = window / limit
+        self.current = {}
+        self.previous = {}
+        self.rotated_at = time.monotonic()
+
+    def rotate(self, now: float) -> bool:
+        # 上一代里的用户已超过一个窗口没有消息，TAT 必然已过期，可整体丢弃
+        if now - self.rotated_at < self.window:
+            return False
+        if now - self.rotated_at >= 2 * self.window:
+            self.previous = {}
+        else:
+            self.previous = self.current
+        self.current = {}
+        self.rotated_at = now
+        return True
+
+    def charge(self, user_id: int, cost: float, now: float):
+        """返回计入 ``cost`` 后的 TAT；超出限制时返回 None。"""
+        tat = self.current.get(user_id)
+        if tat is None:
+            tat = self.previous.get(user_id, now)
+        # 单条消息的消耗超过整个层级时按满额计，额度空闲时仍可发送
+        tat = max(tat, now) + min(cost, self.limit) * self.interval
+        # 留出浮点误差，恰好用满额度时不应被拒绝
+        if tat - now > self.window + 1e-9:
+            return None
+        return tat
+
+    def forget(self, user_id: int):
+        self.current.pop(user_id, None)
+        self.previous.pop(user_id, None)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.current or user_id in self.previous
+
+
+def _build_tiers(limits: dict) -> list:
+    return [
+        Tier(name, limits[name], window)
+        for name, window in TIER_WINDOWS.items()
+        if limits.get(name, 0) > 0
+    ]
 
 
 class RateLimiter:
-    def __init__(self):
-        self.user_message_timestamps = defaultdict(lambda: deque())
-        self.max_messages_per_minute = config.MAX_MESSAGES_PER_MINUTE
-        
-        self.user_warnings = {}
-        
-        self.lock = asyncio.Lock()
-    
-    async def check_user_rate_limit(self, user_id: int) -> tuple[bool, bool]:
-        async with self.lock:
-            now = time.time()
-            timestamps = self.user_message_timestamps[user_id]
-            
-            while timestamps and timestamps[0] < now - 60.0:
-                timestamps.popleft()
-            
-            is_over_limit = len(timestamps) >= self.max_messages_per_minute
-            
-            if is_over_limit:
-                was_warned = self.user_warnings.get(user_id, False)
-                return True, was_warned
-            else:
-                timestamps.append(now)
-                if user_id in self.user_warnings:
-                    del self.user_warnings[user_id]
-                return False, False
-    
+    """Multi-tier, cost-weighted rate limiter with separate policies for verified and
+    unverified users.
+
+    A policy is a set of GCRA tiers (per second, minute, hour, day); a message is accepted
+    only if every tier of the user's policy has room for its cost, and is then charged to
+    all of them. Costs come from RATE_LIMIT_COSTS by message type, so media that goes
+    through download, conversion and a vision-model call uses more of the budget than a
+    short text. With a shared ``state_store`` the check-and-charge and the warning flags go
+    through it, so every bot process enforces the same limits; with the default in-process
+    store both stay synchronous and in this object.
+    """
+
+    def __init__(self, verified: dict = None, unverified: dict = None, costs: dict = None, store=None):
+        # 未配置时与原先一致：每分钟 MAX_MESSAGES_PER_MINUTE 条
+        if verified is None:
+            verified = {"minute": config.MAX_MESSAGES_PER_MINUTE}
+            verified.update(parse_pairs(config.RATE_LIMITS_VERIFIED))
+        if unverified is None:
+            unverified = {"minute": config.MAX_MESSAGES_PER_MINUTE}
+            unverified.update(parse_pairs(config.RATE_LIMITS_UNVERIFIED))
+        self.policies = {True: _build_tiers(verified), False: _build_tiers(unverified)}
+        self.costs = costs if costs is not None else parse_pairs(config.RATE_LIMIT_COSTS)
+        self.store = store or state_store
+        self.rejected = {}
+        # 进程内存储时警告标记直接保存在这里，与层级状态一起定期清理
+        self.user_warnings = set()
+        self.pruned_at = time.monotonic()
+
+    def _rejected(self, tier):
+        if tier is not None:
+            self.rejected[tier.name] = self.rejected.get(tier.name, 0) + 1
+        return tier
+
+    def _prune_warnings(self):
+        now = time.monotonic()
+        if not self.user_warnings or now - self.pruned_at < 60:
+            return
+        self.pruned_at = now
+        tiers = [tier for tiers in self.policies.values() for tier in tiers]
+        self.user_warnings = {
+            user_id for user_id in self.user_warnings if any(user_id in tier for tier in tiers)
+        }
+
+    async def check(self, user_id: int, cost: float = 1, verified: bool = True):
+        """计入 ``cost``；全部层级都有余量时返回 None，否则返回首个超限的层级且不计入。"""
+        tiers = self.policies[verified]
+        if not self.store.shared:
+            return self._rejected(self.store.charge_now(user_id, tiers, cost))
+        policy = "verified" if verified else "unverified"
+        return self._rejected(await self.store.charge(policy, user_id, tiers, cost))
+
+    async def check_user_rate_limit(self, user_id: int, cost: float = 1, verified: bool = True) -> tuple[bool, bool]:
+        if not self.store.shared:
+            # 默认的进程内存储走同步路径，不经过任何额外的 await
+            tier = self.store.charge_now(user_id, self.policies[verified], cost)
+            if tier is not None:
+                self._rejected(tier)
+                return True, user_id in self.user_warnings
+            if self.user_warnings:
+                self.user_warnings.discard(user_id)
+                self._prune_warnings()
+            return False, False
+        if await self.check(user_id, cost, verified) is not None:
+            return True, await self.store.get(WARNING_NAMESPACE, user_id) is not None
+        # 绝大多数请求没有警告记录，先查再删可省去写操作
+        if await self.store.get(WARNING_NAMESPACE, user_id) is not None:
+            await self.store.delete(WARNING_NAMESPACE, user_id)
+        return False, False
+
     async def mark_user_warned(self, user_id: int):
-        async with self.lock:
-            self.user_warnings[user_id] = True
-    
+        if not self.store.shared:
+            self.user_warnings.add(user_id)
+            return
+        # 警告保留到最长的层级窗口结束
+        await self.store.set(WARNING_NAMESPACE, user_id, {"warned_at": time.time()}, max(TIER_WINDOWS.values()))
+
     async def clear_user_warning(self, user_id: int):
-        async with self.lock:
-            if user_id in self.user_warnings:
-                del self.user_warnings[user_id]
-            if user_id in self.user_message_timestamps:
-                del self.user_message_timestamps[user_id]
+        self.user_warnings.discard(user_id)
+        if self.store.shared:
+            await self.store.delete(WARNING_NAMESPACE, user_id)
+        await self.store.reset(user_id, [tier for tiers in self.policies.values() for tier in tiers])
+
+    def describe(self, verified: bool = True) -> str:
+        """速率限制规则的文字说明，用于提示用户。"""
+        if not self.costs:
+            return "，".join(
+                f"{TIER_NAMES[tier.name]}最多 {tier.limit:g} 条消息" for tier in self.policies[verified]
+            )
+        limits = "，".join(
+            f"{TIER_NAMES[tier.name]}最多 {tier.limit:g} 点" for tier in self.policies[verified]
+        )
+        costs = "，".join(
+            f"{COST_NAMES.get(name, name)} {cost:g} 点" for name, cost in self.costs.items()
+        )
+        return f"{limits}（按消息类型计费：{costs}）"
+
+    async def tracked_users(self) -> int:
+        return await self.store.tracked_users([tier for tiers in self.policies.values() for tier in tiers])
 
 
 rate_limiter = RateLimiter()
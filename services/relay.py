@@ -0,0 +1,140 @@
+import logging
+from telegram import Message
+from telegram.error import BadRequest
+from services.album import send_album
+
+# copy_messages 单次最多 100 条
+COPY_BATCH_SIZE = 100
+
+# 这些错误换用逐类型发送也无法解决，直接交给调用方处理
+_FATAL_ERRORS = ("thread not found", "chat not found", "bot was blocked")
+
+
+class RelayStats:
+    __slots__ = ("messages", "calls", "fallbacks")
+
+    def __init__(self):
+        self.messages = 0
+        self.calls = 0
+        self.fallbacks = 0
+
+
+stats = RelayStats()
+
+
+async def _send_by_type(bot, message: Message, chat_id: int, message_thread_id: int = None):
+    if message.text:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=message.text,
+            entities=message.entities,
+            message_thread_id=message_thread_id,
+            disable_web_page_preview=True
+        )
+    elif message.photo:
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=message.photo[-1].file_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            message_thread_id=message_thread_id
+        )
+    elif message.animation:
+        await bot.send_animation(
+            chat_id=chat_id,
+            animation=message.animation.file_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            message_thread_id=message_thread_id
+        )
+    elif message.video:
+        await bot.send_video(
+            chat_id=chat_id,
+            video=message.video.file_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            message_thread_id=message_thread_id
+        )
+    elif message.document:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=message.document.file_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            message_thread_id=message_thread_id
+        )
+    elif message.audio:
+        await bot.send_audio(
+            chat_id=chat_id,
+            audio=message.audio.file_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            message_thread_id=message_thread_id
+        )
+    elif message.voice:
+        await bot.send_voice(
+            chat_id=chat_id,
+            voice=message.voice.file_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            message_thread_id=message_thread_id
+        )
+    elif message.video_note:
+        await bot.send_video_note(
+            chat_id=chat_id,
+            video_note=message.video_note.file_id,
+            message_thread_id=message_thread_id
+        )
+    elif message.sticker:
+        await bot.send_sticker(
+            chat_id=chat_id,
+            sticker=message.sticker.file_id,
+            message_thread_id=message_thread_id
+        )
+    else:
+        return False
+    return True
+
+
+async def _fallback(bot, messages: list, chat_id: int, message_thread_id: int = None):
+    stats.fallbacks += 1
+    if len(messages) > 1 and all(message.media_group_id for message in messages):
+        await send_album(bot, chat_id, messages, message_thread_id=message_thread_id)
+        return
+    for message in messages:
+        if not await _send_by_type(bot, message, chat_id, message_thread_id):
+            logging.warning(f"消息 {message.message_id} 的类型无法逐类型重发，已跳过")
+
+
+async def relay_messages(bot, messages: list, chat_id: int, message_thread_id: int = None):
+    """把同一会话中的若干条消息复制到 ``chat_id``。
+
+    单条用 copy_message，多条（相册、连发）用 copy_messages 按 100 条一批发送，保留相册分组；
+    复制失败（如原消息已被删除）时退回到按类型重新发送。
+    """
+    messages = sorted(messages, key=lambda message: message.message_id)
+    stats.messages += len(messages)
+    for start in range(0, len(messages), COPY_BATCH_SIZE):
+        batch = messages[start:start + COPY_BATCH_SIZE]
+        from_chat_id = batch[0].chat_id
+        stats.calls += 1
+        try:
+            if len(batch) == 1:
+                await bot.copy_message(
+                    chat_id=chat_id,
+                    from_chat_id=from_chat_id,
+                    message_id=batch[0].message_id,
+                    message_thread_id=message_thread_id
+                )
+            else:
+                await bot.copy_messages(
+                    chat_id=chat_id,
+                    from_chat_id=from_chat_id,
+                    message_ids=[message.message_id for message in batch],
+                    message_thread_id=message_thread_id
+                )
+        except BadRequest as e:
+            if any(error in e.message.lower() for error in _FATAL_ERRORS):
+                raise
+            logging.warning(f"复制消息失败，改为逐类型发送: {e}")
+            await _fallback(bot, batch, chat_id, message_thread_id)
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import config
+
+# 同一会话内的“正在输入”状态可持续约 5 秒，期间重复发送没有意义
+CHAT_ACTION_TTL = 4.5
+# 会话状态超过该数量时清理空闲会话
+MAX_TRACKED_CHATS = 1024
+
+
+class TokenBucket:
+    """令牌桶；``reserve`` 立即扣除一个令牌并返回需要等待的秒数（允许透支，按预约顺序排队）。"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Lane:
+    __slots__ = ("lock", "waiting")
+
+    def __init__(self):
+        # asyncio.Lock 按到达顺序唤醒，等价于一条 FIFO 发送队列
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+
+    def idle(self) -> bool:
+        return not self.waiting and not self.lock.locked()
+
+
+class _ChatState:
+    __slots__ = ("lanes", "bucket", "paused_until", "last_action")
+
+    def __init__(self, bucket: TokenBucket):
+        # 每个话题（message_thread_id）一条 FIFO，同一会话的令牌桶与限流暂停由各话题共享
+        self.lanes = {}
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.last_action = {}
+
+    def lane(self, thread_id) -> _Lane:
+        lane = self.lanes.get(thread_id)
+        if lane is None:
+            lane = self.lanes[thread_id] = _Lane()
+        return lane
+
+    @property
+    def waiting(self) -> int:
+        return sum(lane.waiting for lane in self.lanes.values())
+
+
+class OutboundStats:
+    __slots__ = ("sent", "throttled", "retry_after", "coalesced", "failed", "wait_times")
+
+    def __init__(self, samples: int = 500):
+        self.sent = 0
+        self.throttled = 0
+        self.retry_after = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=samples)
+
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Smooths outgoing Bot API calls to stay within Telegram's flood limits.
+
+    Every request that targets a chat passes through a FIFO queue for its (chat, topic), the
+    per-chat token bucket (groups and private chats have separate rates) and the bot-wide
+    bucket. Because each user's relays go to their own topic in the admin group, one user's
+    backlog only delays that topic; tokens of the shared chat bucket are handed out in
+    request order across topics. ``RetryAfter`` pauses the affected chat (or, for private
+    chats, the whole bot), since Telegram enforces it for the chat as a whole, and the
+    request is retried up to SEND_MAX_RETRIES times. Repeated chat actions are coalesced.
+    Requests without a chat (getUpdates, answerCallbackQuery, ...) are not throttled.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(config.SEND_GLOBAL_RATE, config.SEND_GLOBAL_RATE)
+        self.global_paused_until = 0.0
+        self.chats = {}
+        self.stats = OutboundStats()
+        self.endpoints = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_state(self, chat_id: int) -> _ChatState:
+        state = self.chats.get(chat_id)
+        if state is None:
+            if len(self.chats) >= MAX_TRACKED_CHATS:
+                self._evict_idle()
+            if chat_id < 0:
+                bucket = TokenBucket(config.SEND_GROUP_RATE / 60, config.SEND_GROUP_BURST)
+            else:
+                bucket = TokenBucket(config.SEND_CHAT_RATE, config.SEND_CHAT_BURST)
+            state = self.chats[chat_id] = _ChatState(bucket)
+        return state
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for chat_id, state in list(self.chats.items()):
+            if not state.lanes and state.paused_until <= now and state.bucket.idle():
+                del self.chats[chat_id]
+
+    def _coalesce(self, state: _ChatState, endpoint: str, data: dict) -> bool:
+        if endpoint != "sendChatAction":
+            return False
+        key = (data.get("action"), data.get("message_thread_id"))
+        now = time.monotonic()
+        if now - state.last_action.get(key, -CHAT_ACTION_TTL) < CHAT_ACTION_TTL:
+            return True
+        state.last_action[key] = now
+        return False
+
+    async def _wait_for_slot(self, state: _ChatState):
+        while True:
+            pause = max(state.paused_until, self.global_paused_until) - time.monotonic()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+        delay = state.bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        delay = self.global_bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            # 没有会话或使用 @username 的请求不做节流
+            return await callback(*args, **kwargs)
+
+        state = self._chat_state(chat_id)
+        if self._coalesce(state, endpoint, data):
+            self.stats.coalesced += 1
+            return True
+
+        max_retries = config.SEND_MAX_RETRIES if rate_limit_args is None else rate_limit_args
+        thread_id = data.get("message_thread_id")
+        lane = state.lane(thread_id)
+        enqueued_at = time.perf_counter()
+        lane.waiting += 1
+        queued = True
+        try:
+            async with lane.lock:
+                lane.waiting -= 1
+                queued = False
+                for attempt in range(max_retries + 1):
+                    await self._wait_for_slot(state)
+                    if attempt == 0:
+                        waited = time.perf_counter() - enqueued_at
+                        self.stats.wait_times.append(waited)
+                        if waited > 0.05:
+                            self.stats.throttled += 1
+                    try:
+                        result = await callback(*args, **kwargs)
+                    except RetryAfter as e:
+                        self.stats.retry_after += 1
+                        delay = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                        until = time.monotonic() + delay + 0.1
+                        # 群组的限流只影响该群；私聊触发的一般是全局限流
+                        if chat_id < 0:
+                            state.paused_until = until
+                        else:
+                            self.global_paused_until = until
+                        if attempt == max_retries:
+                            self.stats.failed += 1
+                            logging.warning(f"发送到 {chat_id} 的 {endpoint} 在重试 {max_retries} 次后仍被限流")
+                            raise
+                        logging.info(f"发送到 {chat_id} 的 {endpoint} 被限流，{delay}s 后重试")
+                        continue
+                    self.stats.sent += 1
+                    self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+                    return result
+        finally:
+            if queued:
+                # 在轮到发送之前被取消
+                lane.waiting -= 1
+            if lane.idle() and state.lanes.get(thread_id) is lane:
+                del state.lanes[thread_id]
+
+    def depth(self) -> int:
+        return sum(state.waiting for state in self.chats.values())
+
+    def summary(self) -> dict:
+        busiest = sorted(
+            ((chat_id, state.waiting) for chat_id, state in self.chats.items() if state.waiting),
+            key=lambda item: item[1],
+            reverse=True,
+        )[:5]
+        return {
+            "sent": self.stats.sent,
+            "throttled": self.stats.throttled,
+            "retry_after": self.stats.retry_after,
+            "coalesced": self.stats.coalesced,
+            "failed": self.stats.failed,
+            "depth": self.depth(),
+            "chats": len(self.chats),
+            "busiest": busiest,
+            "wait_p50": _percentile(self.stats.wait_times, 0.50),
+            "wait_p95": _percentile(self.stats.wait_times, 0.95),
+            "wait_max": max(self.stats.wait_times) if self.stats.wait_times else None,
+            "endpoints": dict(self.endpoints),
+        }
+
+
+outbound_scheduler = OutboundScheduler()
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import config
+
+# 清理过期记录的间隔（秒）
+PURGE_INTERVAL = 60.0
+
+
+class MemoryStateStore:
+    """In-process state: rate-limit TATs live in the limiter's generational tier dicts and
+    sessions in a plain dict. Fast, but limits and sessions are per process and reset on
+    restart (pending verifications are saved separately at shutdown).
+    """
+
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        self.sessions = {}
+        self.purged_at = time.monotonic()
+
+    async def charge(self, policy: str, user_id: int, tiers: list, cost: float):
+        return self.charge_now(user_id, tiers, cost)
+
+    def charge_now(self, user_id: int, tiers: list, cost: float):
+        """对全部层级检查并计入 ``cost``；返回首个超限的层级，均有余量时返回 None。同步执行，天然原子。"""
+        now = time.monotonic()
+        if len(tiers) == 1:
+            # 默认配置只有一个层级，省去两阶段提交
+            tier = tiers[0]
+            if now - tier.rotated_at >= tier.window:
+                tier.rotate(now)
+            tat = tier.charge(user_id, cost, now)
+            if tat is None:
+                return tier
+            tier.current[user_id] = tat
+            return None
+        tats = []
+        for tier in tiers:
+            if now - tier.rotated_at >= tier.window:
+                tier.rotate(now)
+            tat = tier.charge(user_id, cost, now)
+            if tat is None:
+                return tier
+            tats.append(tat)
+        for tier, tat in zip(tiers, tats):
+            tier.current[user_id] = tat
+        return None
+
+    async def reset(self, user_id: int, tiers: list):
+        for tier in tiers:
+            tier.forget(user_id)
+
+    async def tracked_users(self, tiers: list) -> int:
+        users = set()
+        for tier in tiers:
+            users.update(tier.current.keys(), tier.previous.keys())
+        return len(users)
+
+    def _purge(self, now: float):
+        if time.monotonic() - self.purged_at < PURGE_INTERVAL:
+            return
+        self.purged_at = time.monotonic()
+        self.sessions = {key: item for key, item in self.sessions.items() if item[1] > now}
+
+    async def get(self, namespace: str, key: int):
+        item = self.sessions.get((namespace, key))
+        if item is None:
+            return None
+        if item[1] <= time.time():
+            del self.sessions[(namespace, key)]
+            return None
+        return dict(item[0])
+
+    async def set(self, namespace: str, key: int, value: dict, ttl: float):
+        now = time.time()
+        self._purge(now)
+        self.sessions[(namespace, key)] = (dict(value), now + ttl)
+
+    async def delete(self, namespace: str, key: int) -> bool:
+        """删除并返回记录是否存在；多个调用方竞争同一记录时只有一个得到 True。"""
+        item = self.sessions.pop((namespace, key), None)
+        return item is not None and item[1] > time.time()
+
+    async def incr(self, namespace: str, key: int, field: str, amount: int = 1):
+        item = self.sessions.get((namespace, key))
+        if item is None or item[1] <= time.time():
+            return None
+        item[0][field] = item[0].get(field, 0) + amount
+        return item[0][field]
+
+    async def items(self, namespace: str) -> list:
+        now = time.time()
+        return [
+            (key, dict(value)) for (ns, key), (value, expires_at) in self.sessions.items()
+            if ns == namespace and expires_at > now
+        ]
+
+    async def close(self):
+        pass
+
+
+class SQLiteStateStore:
+    """State shared by every bot process on the host through one SQLite file in WAL mode.
+
+    Each rate-limit check runs as a single ``BEGIN IMMEDIATE`` transaction that reads the
+    user's TATs for all tiers, and writes them back only if every tier has room, so
+    concurrent processes cannot both spend the same budget. Timestamps use wall-clock time
+    so that processes agree on them. Calls run in a worker thread on one connection per
+    process.
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+        self.purged_at = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_state (
+                    policy TEXT NOT NULL,
+                    tier TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    tat REAL NOT NULL,
+                    PRIMARY KEY (policy, tier, user_id)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_state_tat ON rate_state(tat)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    namespace TEXT NOT NULL,
+                    key INTEGER NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)')
+            self.conn = conn
+            logging.info(f"共享状态存储已打开: {self.path}")
+        return self.conn
+
+    def _run(self, func, *args):
+        with self.lock:
+            return func(self._connect(), *args)
+
+    async def _call(self, func, *args):
+        return await asyncio.to_thread(self._run, func, *args)
+
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        # TAT 早于现在的用户已空闲，与内存实现的分代轮换效果相同
+        if now - self.purged_at < PURGE_INTERVAL:
+            return
+        self.purged_at = now
+        conn.execute('DELETE FROM rate_state WHERE tat < ?', (now,))
+        conn.execute('DELETE FROM sessions WHERE expires_at < ?', (now,))
+
+    @staticmethod
+    def _charge(conn: sqlite3.Connection, policy: str, user_id: int, tiers: list, cost: float):
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = dict(conn.execute(
+                'SELECT tier, tat FROM rate_state WHERE policy = ? AND user_id = ?',
+                (policy, user_id)
+            ).fetchall())
+            updates = []
+            for tier in tiers:
+                tat = max(rows.get(tier.name, now), now) + min(cost, tier.limit) * tier.interval
+                if tat - now > tier.window + 1e-9:
+                    conn.execute('ROLLBACK')
+                    return tier.name
+                updates.append((policy, tier.name, user_id, tat))
+            conn.executemany(
+                'INSERT OR REPLACE INTO rate_state (policy, tier, user_id, tat) VALUES (?, ?, ?, ?)',
+                updates
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return None
+
+    async def charge(self, policy: str, user_id: int, tiers: list, cost: float):
+        def run(conn):
+            self._purge(conn, time.time())
+            return self._charge(conn, policy, user_id, tiers, cost)
+
+        rejected = await self._call(run)
+        return next((tier for tier in tiers if tier.name == rejected), None)
+
+    async def reset(self, user_id: int, tiers: list):
+        await self._call(lambda conn: conn.execute('DELETE FROM rate_state WHERE user_id = ?', (user_id,)))
+
+    async def tracked_users(self, tiers: list) -> int:
+        def run(conn):
+            return conn.execute(
+                'SELECT COUNT(DISTINCT user_id) FROM rate_state WHERE tat >= ?', (time.time(),)
+            ).fetchone()[0]
+
+        return await self._call(run)
+
+    async def get(self, namespace: str, key: int):
+        def run(conn):
+            return conn.execute(
+                'SELECT value FROM sessions WHERE namespace = ? AND key = ? AND expires_at > ?',
+                (namespace, key, time.time())
+            ).fetchone()
+
+        row = await self._call(run)
+        return json.loads(row[0]) if row else None
+
+    async def set(self, namespace: str, key: int, value: dict, ttl: float):
+        def run(conn):
+            now = time.time()
+            self._purge(conn, now)
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value, ensure_ascii=False), now + ttl)
+            )
+
+        await self._call(run)
+
+    async def delete(self, namespace: str, key: int) -> bool:
+        def run(conn):
+            return conn.execute(
+                'DELETE FROM sessions WHERE namespace = ? AND key = ? AND expires_at > ? RETURNING key',
+                (namespace, key, time.time())
+            ).fetchall()
+
+        return bool(await self._call(run))
+
+    async def incr(self, namespace: str, key: int, field: str, amount: int = 1):
+        def run(conn):
+            path = f'$.{field}'
+            return conn.execute(
+                '''
+                UPDATE sessions SET value = json_set(value, ?, COALESCE(json_extract(value, ?), 0) + ?)
+                WHERE namespace = ? AND key = ? AND expires_at > ?
+                RETURNING json_extract(value, ?)
+                ''',
+                (path, path, amount, namespace, key, time.time(), path)
+            ).fetchone()
+
+        row = await self._call(run)
+        return row[0] if row else None
+
+    async def items(self, namespace: str) -> list:
+        def run(conn):
+            return conn.execute(
+                'SELECT key, value FROM sessions WHERE namespace = ? AND expires_at > ?',
+                (namespace, time.time())
+            ).fetchall()
+
+        return [(key, json.loads(value)) for key, value in await self._call(run)]
+
+    async def close(self):
+        def run():
+            with self.lock:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+
+        await asyncio.to_thread(run)
+
+
+def create_state_store(backend: str):
+    if backend == "sqlite":
+        return SQLiteStateStore(config.STATE_DATABASE_PATH)
+    if backend != "memory":
+        logging.warning(f"未知的 STATE_BACKEND: {backend}，使用进程内存储")
+    return MemoryStateStore()
+
+
+state_store = create_state_store(config.STATE_BACKEND)
@@ -6,41 +6,111 @@ from database import models as db
 from config import config
 from datetime import datetime
 
-async def get_or_create_thread(update: Update, context: ContextTypes.DEFAULT_TYPE) -> tuple[int, bool]:
+# 每个用户至多一个进行中的话题预创建，同一用户的并发消息共享它
+_speculations = {}
 
-    user = update.effective_user
-    user_data = await db.get_user(user.id)
-    
-    if user_data and user_data.get('thread_id'):
-        return user_data['thread_id'], False
-    
-    
-    topic_name = f"{user.first_name} (ID: {user.id})"
-    try:
-        topic = await context.bot.create_forum_topic(
-            chat_id=config.FORUM_GROUP_ID,
-            name=topic_name
+
+class ThreadSpeculation:
+    """Resolves or speculatively creates a user's topic while moderation is still running.
+
+    ``commit()`` persists a newly created topic and posts the info card; ``abandon()``
+    deletes it again if the message turned out to be spam.
+    """
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self.user_id = update.effective_user.id
+        self.update = update
+        self.context = context
+        self.refs = 0
+        self.committed = False
+        self.cleaned_up = False
+        self.commit_lock = asyncio.Lock()
+        self.task = asyncio.create_task(self._prepare())
+
+    async def _prepare(self):
+        user = self.update.effective_user
+        user_data = await db.get_user(user.id)
+        if user_data and user_data.get('thread_id'):
+            return user_data['thread_id'], False, None
+
+        topic_name = f"{user.first_name} (ID: {user.id})"
+        topic, photos = await asyncio.gather(
+            self.context.bot.create_forum_topic(chat_id=config.FORUM_GROUP_ID, name=topic_name),
+            self.context.bot.get_user_profile_photos(user.id, limit=1),
+            return_exceptions=True,
         )
-        thread_id = topic.message_thread_id
-        
-        
-        await db.update_user_thread_id(user.id, thread_id)
-        
-        
-        await send_user_info_card(update, context, thread_id)
-        
-        return thread_id, True
-    except Exception as e:
-        print(f"创建话题失败: {e}")
-        return None, False
-
-async def send_user_info_card(update: Update, context: ContextTypes.DEFAULT_TYPE, thread_id: int):
-    from handlers.user_handler import _resend_message 
+        if isinstance(topic, Exception):
+            raise topic
+        if isinstance(photos, Exception):
+            print(f"获取用户头像失败: {photos}")
+            photos = None
+        return topic.message_thread_id, True, photos
+
+    def _release(self):
+        self.refs -= 1
+        if self.refs <= 0 and _speculations.get(self.user_id) is self:
+            del _speculations[self.user_id]
+
+    async def commit(self, update: Update) -> tuple[int, bool]:
+        try:
+            thread_id, is_new, photos = await self.task
+        except Exception as e:
+            print(f"创建话题失败: {e}")
+            self._release()
+            return None, False
+
+        try:
+            async with self.commit_lock:
+                if not is_new or self.committed:
+                    return thread_id, False
+                self.committed = True
+                await db.update_user_thread_id(self.user_id, thread_id)
+                await send_user_info_card(update, self.context, thread_id, photos=photos)
+                return thread_id, True
+        finally:
+            self._release()
+
+    async def _abandon(self):
+        try:
+            thread_id, is_new, _ = await self.task
+        except Exception:
+            return
+        # 多条并发消息各自放弃时都会等待同一个预创建任务，只由第一个删除话题
+        if is_new and not self.committed and not self.cleaned_up and self.refs <= 0:
+            self.cleaned_up = True
+            try:
+                await self.context.bot.delete_forum_topic(
+                    chat_id=config.FORUM_GROUP_ID, message_thread_id=thread_id
+                )
+            except Exception as e:
+                print(f"删除预创建话题失败: {e}")
+
+    def abandon(self):
+        self._release()
+        return asyncio.create_task(self._abandon())
+
+
+def speculate_thread(update: Update, context: ContextTypes.DEFAULT_TYPE) -> ThreadSpeculation:
+    user_id = update.effective_user.id
+    speculation = _speculations.get(user_id)
+    if speculation is None or speculation.committed:
+        speculation = ThreadSpeculation(update, context)
+        _speculations[user_id] = speculation
+    speculation.refs += 1
+    return speculation
+
+
+async def get_or_create_thread(update: Update, context: ContextTypes.DEFAULT_TYPE) -> tuple[int, bool]:
+    return await speculate_thread(update, context).commit(update)
+
+async def send_user_info_card(update: Update, context: ContextTypes.DEFAULT_TYPE, thread_id: int, photos=None):
+    from handlers.user_handler import _resend_message
     user = update.effective_user
-    
-    photos = await context.bot.get_user_profile_photos(user.id, limit=1)
-    
-    
+
+    if photos is None:
+        photos = await context.bot.get_user_profile_photos(user.id, limit=1)
+
+
     first_name = escape_markdown(user.first_name or '', version=2)
     last_name = escape_markdown(user.last_name or '', version=2)
     username = f"@{escape_markdown(user.username, version=2)}" if user.username else "无"
@@ -52,8 +122,8 @@ async def send_user_info_card(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"**用户名:** {username}\n"
         f"**首次联系:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
     )
-    
-    
+
+
     if photos and photos.total_count > 0:
         await context.bot.send_photo(
             chat_id=config.FORUM_GROUP_ID,
@@ -69,6 +139,6 @@ async def send_user_info_card(update: Update, context: ContextTypes.DEFAULT_TYPE
             message_thread_id=thread_id,
             parse_mode='Markdown'
         )
-    
-    
+
+
     await _resend_message(update, context, thread_id)
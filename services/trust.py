@@ -0,0 +1,84 @@
+import logging
+import random
+from datetime import datetime, timezone
+from database import models as db
+from config import config
+
+TIERS = ("high", "medium", "low")
+
+
+def compute_trust_score(inputs: dict, now: datetime = None) -> float:
+    """0-100 分：在本机器人中的时长与已转发消息数加分，拦截记录与拉黑次数扣分。"""
+    # created_at 由 SQLite 的 CURRENT_TIMESTAMP 写入，为 UTC
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        created_at = datetime.fromisoformat(str(inputs.get("created_at")))
+        age_days = max(0.0, (now - created_at).total_seconds() / 86400)
+    except ValueError:
+        age_days = 0.0
+
+    score = 0.0
+    score += 40 * min(1.0, age_days / max(config.TRUST_FULL_AGE_DAYS, 1))
+    score += 40 * min(1.0, (inputs.get("message_count") or 0) / max(config.TRUST_FULL_MESSAGE_COUNT, 1))
+    if inputs.get("is_verified"):
+        score += 20
+    score -= 25 * (inputs.get("spam_count") or 0)
+    score -= 40 * (inputs.get("blacklist_strikes") or 0)
+    return round(max(0.0, min(100.0, score)), 1)
+
+
+class TrustManager:
+    def __init__(self):
+        self.checked = dict.fromkeys(TIERS, 0)
+        self.skipped = dict.fromkeys(TIERS, 0)
+
+    @staticmethod
+    def tier_for(score: float) -> str:
+        if score >= config.TRUST_HIGH_THRESHOLD:
+            return "high"
+        if score >= config.TRUST_MEDIUM_THRESHOLD:
+            return "medium"
+        return "low"
+
+    @staticmethod
+    def sample_rate(tier: str) -> float:
+        if tier == "high":
+            return config.TRUST_HIGH_SAMPLE_RATE
+        if tier == "medium":
+            return config.TRUST_MEDIUM_SAMPLE_RATE
+        return 1.0
+
+    def should_moderate(self, user_data: dict) -> bool:
+        """按用户信任分抽样决定本条消息是否送 AI 审查；低信任用户始终审查。"""
+        if not config.TRUST_ENABLED:
+            return True
+        tier = self.tier_for((user_data or {}).get("trust_score") or 0)
+        if random.random() < self.sample_rate(tier):
+            self.checked[tier] += 1
+            return True
+        self.skipped[tier] += 1
+        return False
+
+    async def refresh(self, user_id: int):
+        try:
+            inputs = await db.get_user_trust_inputs(user_id)
+            if inputs:
+                await db.update_user_trust_score(user_id, compute_trust_score(inputs))
+        except Exception as e:
+            logging.error(f"更新用户 {user_id} 信任分失败: {e}")
+
+    async def record_forwarded(self, user_id: int):
+        try:
+            await db.increment_user_message_count(user_id)
+        except Exception as e:
+            logging.error(f"更新用户 {user_id} 消息计数失败: {e}")
+        await self.refresh(user_id)
+
+    def summary(self) -> dict:
+        return {
+            tier: {"checked": self.checked[tier], "skipped": self.skipped[tier]}
+            for tier in TIERS
+        }
+
+
+trust_manager = TrustManager()
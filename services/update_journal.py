@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import time
+from telegram import Update
+from config import config
+from database import models as db
+from services.album import album_aggregator
+
+
+class UpdateJournal:
+    """Durable journal of private-message updates between receipt and forwarding.
+
+    Each update is written before it is queued and checkpointed as soon as it has been
+    forwarded (or once ``handle_message`` has finished with it otherwise). Work that was cancelled (shutdown, crash, handler timeout) stays
+    incomplete and is replayed on the next start. The update_id primary key makes replay
+    idempotent: an update that Telegram redelivers after a restart is recognised and skipped.
+    Completed entries are compacted after UPDATE_JOURNAL_RETENTION seconds.
+    """
+
+    def __init__(self):
+        self.compact_task = None
+        self.appended = 0
+        self.duplicates = 0
+        self.replayed = 0
+        self.abandoned = 0
+        self.compacted = 0
+
+    async def append(self, update: Update) -> bool:
+        """返回 False 表示该更新已在日志中（重复投递），调用方应跳过处理。"""
+        if not config.UPDATE_JOURNAL_ENABLED:
+            return True
+        try:
+            user_id = update.effective_user.id if update.effective_user else None
+            inserted = await db.append_update_journal(
+                update.update_id, user_id, json.dumps(update.to_dict()), int(time.time())
+            )
+        except Exception as e:
+            # 日志写入失败时不阻塞消息处理
+            logging.error(f"写入更新日志失败: {e}")
+            return True
+        if inserted:
+            self.appended += 1
+        else:
+            self.duplicates += 1
+            logging.info(f"更新 {update.update_id} 已在日志中，跳过重复投递")
+        return inserted
+
+    async def complete(self, update: Update):
+        if not config.UPDATE_JOURNAL_ENABLED:
+            return
+        try:
+            # 相册只有第一项进入队列，完成时连同其余各项一起打检查点
+            update_ids = [member.update_id for member in album_aggregator.updates(update)]
+            await db.complete_update_journal(update_ids, int(time.time()))
+        except Exception as e:
+            logging.error(f"更新日志检查点写入失败: {e}")
+
+    def wrap(self, handler):
+        """包装队列处理函数：正常结束或出错都记为完成，被取消则保留给下次启动重放。"""
+        async def journaled(update: Update, context):
+            try:
+                await handler(update, context)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await self.complete(update)
+                raise
+            await self.complete(update)
+
+        return journaled
+
+    async def replay(self, application, submit):
+        """把上次未处理完的更新重新交给 ``submit(update, context)``；同一相册的各项重新合并为一组。"""
+        try:
+            entries = await db.claim_incomplete_update_journal()
+        except Exception as e:
+            logging.error(f"读取更新日志失败: {e}")
+            return
+        groups = {}
+        for entry in entries:
+            update = Update.de_json(json.loads(entry["payload"]), application.bot)
+            message = update.effective_message
+            if message and message.media_group_id:
+                key = (message.chat_id, message.media_group_id)
+            else:
+                key = update.update_id
+            groups.setdefault(key, []).append((entry, update))
+        for members in groups.values():
+            updates = [update for _, update in members]
+            attempts = max(entry["attempts"] for entry, _ in members)
+            context = application.context_types.context.from_update(updates[0], application)
+            update = album_aggregator.restore(updates, context) if len(updates) > 1 else updates[0]
+            if attempts >= config.UPDATE_JOURNAL_MAX_REPLAYS:
+                self.abandoned += len(updates)
+                logging.warning(f"更新 {update.update_id} 已重放 {attempts} 次仍未完成，放弃")
+                await self.complete(update)
+                continue
+            if await submit(update, context):
+                self.replayed += len(updates)
+            else:
+                await self.complete(update)
+        if entries:
+            logging.info(f"更新日志：重放 {self.replayed} 条，放弃 {self.abandoned} 条")
+
+    async def compact(self):
+        try:
+            self.compacted += await db.compact_update_journal(int(time.time()) - config.UPDATE_JOURNAL_RETENTION)
+        except Exception as e:
+            logging.error(f"压缩更新日志失败: {e}")
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(config.UPDATE_JOURNAL_COMPACT_INTERVAL)
+            await self.compact()
+
+    async def start(self, application, submit):
+        if not config.UPDATE_JOURNAL_ENABLED or self.compact_task:
+            return
+        await self.replay(application, submit)
+        await self.compact()
+        self.compact_task = asyncio.create_task(self._compact_loop())
+
+    async def stop(self):
+        if self.compact_task:
+            self.compact_task.cancel()
+            await asyncio.gather(self.compact_task, return_exceptions=True)
+            self.compact_task = None
+
+    def summary(self) -> dict:
+        return {
+            "appended": self.appended,
+            "duplicates": self.duplicates,
+            "replayed": self.replayed,
+            "abandoned": self.abandoned,
+            "compacted": self.compacted,
+        }
+
+
+update_journal = UpdateJournal()
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import config
+
+# 调度类别，数值越小优先级越高
+ADMIN = 0
+CALLBACK = 1
+VERIFIED = 2
+UNVERIFIED = 3
+
+CLASS_NAMES = {
+    ADMIN: "管理员操作",
+    CALLBACK: "按钮回调",
+    VERIFIED: "已验证用户",
+    UNVERIFIED: "未验证用户",
+}
+
+# 当前更新是否仍占用调度名额；处理函数可通过 release_admission 提前交还
+_admission = contextvars.ContextVar("update_admission", default=None)
+
+# 已通过验证的用户，启动时从数据库加载，验证状态变化时同步更新
+_verified_users = set()
+
+
+def mark_verified(user_id: int, verified: bool = True):
+    if verified:
+        _verified_users.add(user_id)
+    else:
+        _verified_users.discard(user_id)
+
+
+def is_verified(user_id: int) -> bool:
+    return user_id in _verified_users
+
+
+async def load_verified_users():
+    from database import models as db
+
+    try:
+        _verified_users.update(await db.get_verified_user_ids())
+    except Exception as e:
+        logging.error(f"加载已验证用户列表失败: {e}")
+
+
+def release_admission():
+    """在即将长时间等待（如队列已满）前交还当前更新占用的并发名额，重复调用无效。"""
+    slot = _admission.get()
+    if slot and slot[0]:
+        slot[0] = False
+        slot[1]._release()
+
+
+def classify_update(update: object) -> int:
+    if not isinstance(update, Update):
+        return ADMIN
+    user = update.effective_user
+    chat = update.effective_chat
+    if (user and user.id in config.ADMIN_IDS) or (chat and chat.id == config.FORUM_GROUP_ID):
+        return ADMIN
+    if update.callback_query:
+        return CALLBACK
+    if user and user.id in _verified_users:
+        return VERIFIED
+    return UNVERIFIED
+
+
+class _ClassStats:
+    __slots__ = ("admitted", "waiting", "wait_times")
+
+    def __init__(self, samples: int = 500):
+        self.admitted = 0
+        self.waiting = 0
+        self.wait_times = deque(maxlen=samples)
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Strict-priority admission for concurrent update handling.
+
+    PTB's own semaphore is sized to ``max_pending`` so that updates reach ``do_process_update``
+    immediately; the real concurrency limit (``max_concurrent``) is enforced here, always
+    admitting the highest-priority waiting update first. Admin updates bypass the limit.
+    A handler about to block (a full shard queue, waiting behind the same user's previous
+    message) gives its slot back early with ``release_admission``; the same classes then
+    order the expensive work inside the MessageQueue shards.
+    """
+
+    def __init__(self, max_concurrent: int, max_pending: int):
+        super().__init__(max_pending)
+        self.limit = max_concurrent
+        self.active = 0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.stats = {cls: _ClassStats() for cls in CLASS_NAMES}
+
+    async def _acquire(self, priority: int):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到名额但在恢复前被取消，把名额交给下一个
+                self._release()
+            raise
+
+    def _release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        cls = classify_update(update)
+        stats = self.stats[cls]
+        started = time.perf_counter()
+        if cls == ADMIN:
+            stats.admitted += 1
+            stats.wait_times.append(0.0)
+            await coroutine
+            return
+
+        stats.waiting += 1
+        try:
+            await self._acquire(cls)
+        except BaseException:
+            coroutine.close()
+            raise
+        finally:
+            stats.waiting -= 1
+        stats.admitted += 1
+        stats.wait_times.append(time.perf_counter() - started)
+        slot = [True, self]
+        _admission.set(slot)
+        try:
+            await coroutine
+        finally:
+            # 处理函数中创建的任务会继承同一个上下文，先作废名额，避免之后再次交还
+            if slot[0]:
+                slot[0] = False
+                self._release()
+
+    async def initialize(self) -> None:
+        await load_verified_users()
+
+    async def shutdown(self) -> None:
+        pass
+
+    def summary(self) -> dict:
+        result = {}
+        for cls, stats in self.stats.items():
+            ordered = sorted(stats.wait_times)
+            result[cls] = {
+                "admitted": stats.admitted,
+                "waiting": stats.waiting,
+                "wait_p50": ordered[len(ordered) // 2] if ordered else None,
+                "wait_p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None,
+                "wait_max": ordered[-1] if ordered else None,
+            }
+        return result
+
+
+update_scheduler = PriorityUpdateProcessor(config.MAX_CONCURRENT_UPDATES, config.MAX_PENDING_UPDATES)
@@ -1,11 +1,15 @@
+import json
+import logging
 import time
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from database import models as db
 from config import config
-from services.gemini_service import gemini_service
+from services.ai_registry import gemini_service
+from services.state_store import state_store
+from services.update_scheduler import mark_verified
 
-
-pending_verifications = {}
+# 进行中的人机验证保存在 state_store 的这个命名空间，按用户 ID 索引
+NAMESPACE = "verification"
 
 async def create_verification(user_id: int):
     challenge = await gemini_service.generate_verification_challenge()
@@ -14,15 +18,16 @@ async def create_verification(user_id: int):
     options = challenge['options']
     
     
-    existing_attempts = pending_verifications.get(user_id, {}).get('attempts', 0)
+    existing = await state_store.get(NAMESPACE, user_id)
+    existing_attempts = existing.get('attempts', 0) if existing else 0
     
-    pending_verifications[user_id] = {
+    await state_store.set(NAMESPACE, user_id, {
         'answer': correct_answer,
         'question': question,
         'options': options,
         'attempts': existing_attempts,
         'created_at': time.time()
-    }
+    }, config.VERIFICATION_TIMEOUT)
     
     keyboard = [
         [InlineKeyboardButton(option, callback_data=f"verify_{option}") for option in options]
@@ -31,24 +36,29 @@ async def create_verification(user_id: int):
     return f"请完成人机验证: \n\n{question}", InlineKeyboardMarkup(keyboard)
 
 async def verify_answer(user_id: int, answer: str):
-    if user_id not in pending_verifications:
+    verification = await state_store.get(NAMESPACE, user_id)
+    if verification is None:
         return False, "验证已过期或不存在。", False, None
     
-    verification = pending_verifications[user_id]
-    
     if time.time() - verification['created_at'] > config.VERIFICATION_TIMEOUT:
-        del pending_verifications[user_id]
+        await state_store.delete(NAMESPACE, user_id)
         return False, "验证超时，请重新发送消息。", False, None
     
-    verification['attempts'] += 1
+    # 计数与删除都是原子操作，多个进程同时处理同一用户的回答时只有一个生效
+    attempts = await state_store.incr(NAMESPACE, user_id, 'attempts')
+    if attempts is None:
+        return False, "验证已过期或不存在。", False, None
     
     if answer == verification['answer']:
-        del pending_verifications[user_id]
+        if not await state_store.delete(NAMESPACE, user_id):
+            return False, "验证已过期或不存在。", False, None
         await db.update_user_verification(user_id, is_verified=True)
+        mark_verified(user_id)
         return True, "验证成功！", False, None
     
-    if verification['attempts'] >= config.MAX_VERIFICATION_ATTEMPTS:
-        del pending_verifications[user_id]
+    if attempts >= config.MAX_VERIFICATION_ATTEMPTS:
+        if not await state_store.delete(NAMESPACE, user_id):
+            return False, "验证已过期或不存在。", False, None
         
         await db.add_to_blacklist(user_id, reason="人机验证失败次数过多", blocked_by=config.BOT_ID)
         message = (
@@ -62,42 +72,41 @@ async def verify_answer(user_id: int, answer: str):
     new_correct_answer = challenge['correct_answer']
     new_options = challenge['options']
     
-    pending_verifications[user_id] = {
+    await state_store.set(NAMESPACE, user_id, {
         'answer': new_correct_answer,
         'question': new_question,
         'options': new_options,
-        'attempts': verification['attempts'],
+        'attempts': attempts,
         'created_at': time.time()
-    }
+    }, config.VERIFICATION_TIMEOUT)
     
     keyboard = [
         [InlineKeyboardButton(option, callback_data=f"verify_{option}") for option in new_options]
     ]
     
     new_question_text = f"请完成人机验证: \n\n{new_question}"
-    return False, f"答案错误，还有 {config.MAX_VERIFICATION_ATTEMPTS - verification['attempts']} 次机会。", False, (new_question_text, InlineKeyboardMarkup(keyboard))
+    return False, f"答案错误，还有 {config.MAX_VERIFICATION_ATTEMPTS - attempts} 次机会。", False, (new_question_text, InlineKeyboardMarkup(keyboard))
 
-def is_verification_pending(user_id: int) -> tuple[bool, bool]:
-    if user_id not in pending_verifications:
+async def is_verification_pending(user_id: int) -> tuple[bool, bool]:
+    verification = await state_store.get(NAMESPACE, user_id)
+    if verification is None:
         return False, True
     
-    verification = pending_verifications[user_id]
     is_expired = time.time() - verification['created_at'] > config.VERIFICATION_TIMEOUT
     
     if is_expired:
-        del pending_verifications[user_id]
+        await state_store.delete(NAMESPACE, user_id)
         return False, True
     
     return True, False
 
-def get_pending_verification_message(user_id: int):
-    if user_id not in pending_verifications:
+async def get_pending_verification_message(user_id: int):
+    verification = await state_store.get(NAMESPACE, user_id)
+    if verification is None:
         return None
     
-    verification = pending_verifications[user_id]
-    
     if time.time() - verification['created_at'] > config.VERIFICATION_TIMEOUT:
-        del pending_verifications[user_id]
+        await state_store.delete(NAMESPACE, user_id)
         return None
     
     question = verification['question']
@@ -108,3 +117,43 @@ def get_pending_verification_message(user_id: int):
     ]
     
     return question, InlineKeyboardMarkup(keyboard)
+
+async def persist_pending_verifications() -> int:
+    """关闭前把未过期的人机验证写入 verification_sessions，重启后可继续作答。
+
+    共享存储中的会话本身跨进程、跨重启保留，无需另存。
+    """
+    if state_store.shared:
+        return 0
+    now = time.time()
+    sessions = [
+        (
+            user_id, v['question'], v['answer'], json.dumps(v['options'], ensure_ascii=False),
+            v['attempts'], v['created_at'], v['created_at'] + config.VERIFICATION_TIMEOUT,
+        )
+        for user_id, v in await state_store.items(NAMESPACE)
+        if now - v['created_at'] <= config.VERIFICATION_TIMEOUT
+    ]
+    await db.save_verification_sessions(sessions)
+    return len(sessions)
+
+async def restore_pending_verifications() -> int:
+    try:
+        sessions = await db.take_verification_sessions(time.time())
+    except Exception as e:
+        logging.error(f"恢复人机验证会话失败: {e}")
+        return 0
+    for session in sessions:
+        if await state_store.get(NAMESPACE, session['user_id']) is not None:
+            continue
+        created_at = float(session['created_at'])
+        await state_store.set(NAMESPACE, session['user_id'], {
+            'answer': session['answer'],
+            'question': session['question'],
+            'options': json.loads(session['options'] or '[]'),
+            'attempts': session['attempts'] or 0,
+            'created_at': created_at,
+        }, created_at + config.VERIFICATION_TIMEOUT - time.time())
+    if sessions:
+        logging.info(f"已恢复 {len(sessions)} 个进行中的人机验证")
+    return len(sessions)
@@ -27,7 +27,7 @@ async def test_ai_service():
         print(f"Gemini API Key: {'已设置' if config.GEMINI_API_KEY else '未设置'}")
 
     print("\n正在导入 AI 服务...")
-    from services.gemini_service import gemini_service
+    from services.ai_registry import gemini_service
 
     print(f"服务类型: {type(gemini_service).__name__}")
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+速率限制器基准测试
+用大量不同用户调用 check_user_rate_limit，报告吞吐、每次检查耗时与内存占用，
+并与旧版“每用户一个时间戳 deque + 全局锁”的实现对比。
+
+用法: python tools/benchmark_rate_limiter.py [--users 1000000] [--messages 3]
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+
+
+class DequeRateLimiter:
+    """旧实现，仅用于对比。"""
+
+    def __init__(self, max_messages_per_minute: int):
+        self.user_message_timestamps = defaultdict(deque)
+        self.max_messages_per_minute = max_messages_per_minute
+        self.user_warnings = {}
+        self.lock = asyncio.Lock()
+
+    async def check_user_rate_limit(self, user_id: int, count: int = 1):
+        async with self.lock:
+            now = time.time()
+            timestamps = self.user_message_timestamps[user_id]
+            while timestamps and timestamps[0] < now - 60.0:
+                timestamps.popleft()
+            if len(timestamps) >= self.max_messages_per_minute:
+                return True, self.user_warnings.get(user_id, False)
+            timestamps.append(now)
+            self.user_warnings.pop(user_id, None)
+            return False, False
+
+
+async def run(limiter, users: int, messages: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(messages):
+        for user_id in range(users):
+            await limiter.check_user_rate_limit(user_id)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    checks = users * messages
+    return {
+        "checks": checks,
+        "seconds": elapsed,
+        "per_check_us": elapsed / checks * 1e6,
+        "memory_mb": current / 1024 / 1024,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--messages", type=int, default=3, help="每个用户发送的消息数")
+    parser.add_argument("--skip-legacy", action="store_true", help="不运行旧实现的对比")
+    parser.add_argument("--state-backend", choices=["memory", "sqlite"], default="memory", help="状态存储")
+    parser.add_argument("--state-db", default="./data/benchmark_state.db", help="sqlite 状态存储的路径")
+    args = parser.parse_args()
+
+    from config import config
+    from services.rate_limiter import RateLimiter
+    from services.state_store import MemoryStateStore, SQLiteStateStore
+
+    store = SQLiteStateStore(args.state_db) if args.state_backend == "sqlite" else MemoryStateStore()
+
+    # 只保留每分钟一个层级，与旧实现的规则一致
+    limiters = [(f"GCRA/{store.name}", RateLimiter(verified={"minute": config.MAX_MESSAGES_PER_MINUTE}, store=store))]
+    if not args.skip_legacy:
+        limiters.append(("deque+lock", DequeRateLimiter(config.MAX_MESSAGES_PER_MINUTE)))
+
+    print(f"{args.users} 个用户 × {args.messages} 条消息")
+    print(f"{'实现':<14}{'总耗时(s)':>12}{'每次(us)':>12}{'常驻内存(MB)':>16}{'峰值(MB)':>12}")
+    for name, limiter in limiters:
+        r = asyncio.run(run(limiter, args.users, args.messages))
+        print(f"{name:<14}{r['seconds']:>12.2f}{r['per_check_us']:>12.2f}{r['memory_mb']:>16.1f}{r['peak_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准测试
+在全新的解释器中分别导入各模块并初始化 AI 服务，报告每个模块的导入与初始化耗时（毫秒）。
+
+用法: python tools/benchmark_startup.py [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "telegram",
+    "telegram.ext",
+    "aiosqlite",
+    "PIL.Image",
+    "openai",
+    "google.genai",
+    "config",
+    "database.models",
+    "services.ai_registry",
+    "services.gemini_service",
+    "services.image_processor",
+    "handlers",
+    "bot",
+]
+
+# 模块导入后额外测量的初始化步骤
+INIT_STEPS = {
+    "gemini": "from services.ai_registry import ai_registry; ai_registry.get('gemini')",
+    "openai": "from services.ai_registry import ai_registry; ai_registry.get('openai')",
+}
+
+_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+{statement}
+print(json.dumps(time.perf_counter() - started))
+"""
+
+
+def _measure(statement: str, env: dict):
+    code = _SNIPPET.format(root=ROOT, statement=statement)
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, env=env
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr else "failed"
+    return json.loads(result.stdout.strip().splitlines()[-1]) * 1000, None
+
+
+def _run(name: str, statement: str, repeat: int, env: dict):
+    samples = []
+    for _ in range(repeat):
+        elapsed, error = _measure(statement, env)
+        if error:
+            print(f"{name:<28} 失败: {error}")
+            return
+        samples.append(elapsed)
+    print(
+        f"{name:<28} 中位数 {statistics.median(samples):8.1f}ms   "
+        f"最小 {min(samples):8.1f}ms   最大 {max(samples):8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="每项测量的重复次数")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "benchmark")
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    env.setdefault("CUSTOM_AI_API_KEY", "benchmark")
+    env.setdefault("CUSTOM_AI_API_URL", "http://127.0.0.1:1/v1")
+
+    print("=" * 50)
+    print("模块导入耗时（独立进程，包含其依赖）")
+    print("=" * 50)
+    for module in MODULES:
+        _run(module, f"import {module}", args.repeat, env)
+
+    print("\n" + "=" * 50)
+    print("AI 服务初始化耗时（含 SDK 导入）")
+    print("=" * 50)
+    for name, statement in INIT_STEPS.items():
+        _run(name, statement, args.repeat, env)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+离线审查评测工具
+
+导出语料（filtered_messages 中被拦截的消息标记为 spam，--allowed 文件中的正常消息标记为 ham）:
+    python tools/eval_moderation.py export --out corpus.jsonl --allowed allowed.txt
+
+回放语料并统计精确率、召回率、p50/p95 延迟与 token 用量:
+    python tools/eval_moderation.py run corpus.jsonl --provider openai --model gpt-4o-mini \\
+        --variant-file strict=prompts/strict.txt --concurrency 8
+
+默认关闭级联审查，只评测 --model 指定的模型；用 --cascade-model 指定初筛模型时按线上的级联流程评测。
+
+配合 tools/stub_ai_server.py 可在离线环境下测试吞吐与错误处理。
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "evaluation")
+
+
+class CorpusMessage:
+    def __init__(self, text: str):
+        self.text = text
+        self.caption = None
+        self.photo = None
+        self.sticker = None
+
+
+def export_corpus(args):
+    from config import config
+
+    db_path = args.db or config.DATABASE_PATH
+    samples = []
+    with sqlite3.connect(db_path) as conn:
+        for content, reason in conn.execute(
+            "SELECT content, reason FROM filtered_messages WHERE content IS NOT NULL AND content != ''"
+        ):
+            samples.append({"text": content, "label": "spam", "source": "filtered_messages", "reason": reason})
+
+    # 转发的用户消息不落库，正常样本只能由 --allowed 文件提供
+
+    if args.allowed:
+        with open(args.allowed, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    samples.append({"text": line.strip(), "label": "ham", "source": os.path.basename(args.allowed)})
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        for sample in samples:
+            f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+
+    spam = sum(1 for s in samples if s["label"] == "spam")
+    if spam == len(samples):
+        print("警告：语料中没有正常样本，无法评估误判率，请用 --allowed 提供")
+    print(f"已导出 {len(samples)} 条样本（spam {spam}，ham {len(samples) - spam}）到 {args.out}")
+
+
+def _load_corpus(path: str, limit: int = None) -> list:
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                samples.append(json.loads(line))
+    return samples[:limit] if limit else samples
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def _evaluate(service, samples: list, concurrency: int) -> dict:
+    from services.ai_streaming import pending_background_tasks
+    from services.ai_telemetry import ai_telemetry
+
+    ai_telemetry.recent_calls.clear()
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes = []
+
+    async def run_one(sample):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await service.analyze_message(CorpusMessage(sample["text"]))
+            outcomes.append((sample, result, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(s) for s in samples))
+    wall_time = time.perf_counter() - started
+    await pending_background_tasks(timeout=30)
+
+    tp = fp = fn = tn = errors = 0
+    latencies = []
+    for sample, result, latency in outcomes:
+        if result.get("reason") == "Analysis failed":
+            errors += 1
+            continue
+        latencies.append(latency)
+        predicted = bool(result.get("is_spam"))
+        actual = sample["label"] == "spam"
+        if predicted and actual:
+            tp += 1
+        elif predicted:
+            fp += 1
+        elif actual:
+            fn += 1
+        else:
+            tn += 1
+
+    calls = list(ai_telemetry.recent_calls)
+    return {
+        "samples": len(samples),
+        "errors": errors,
+        "precision": tp / (tp + fp) if tp + fp else None,
+        "recall": tp / (tp + fn) if tp + fn else None,
+        "accuracy": (tp + tn) / (tp + tn + fp + fn) if tp + tn + fp + fn else None,
+        "p50_ms": _percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": _percentile(latencies, 0.95) * 1000 if latencies else None,
+        "throughput": len(samples) / wall_time if wall_time else None,
+        "input_tokens": sum(c["input_tokens"] or 0 for c in calls),
+        "output_tokens": sum(c["output_tokens"] or 0 for c in calls),
+        "cost": sum(c["cost"] or 0 for c in calls),
+    }
+
+
+def _fmt(value, pattern="{:.3f}"):
+    return "N/A" if value is None else pattern.format(value)
+
+
+async def run_evaluation(args):
+    from services.ai_prompts import MODERATION_PROMPT
+    from services.ai_registry import ai_registry
+
+    samples = _load_corpus(args.corpus, args.limit)
+    variants = {"default": MODERATION_PROMPT}
+    for item in args.variant_file or []:
+        name, path = item.split("=", 1)
+        with open(path, encoding="utf-8") as f:
+            variants[name] = f.read().strip()
+
+    results = []
+    for provider in args.provider:
+        for model, cascade_model, (variant_name, prompt) in itertools.product(
+            args.model or [None], args.cascade_model or [None], variants.items()
+        ):
+            service = ai_registry.create(provider)
+            if not service.client:
+                print(f"{provider} 未配置 API 密钥，跳过")
+                break
+            if model:
+                service.filter_model_name = model
+            # 线上默认开启级联，不关闭时测到的主要是初筛模型的判断
+            service.cascade_model_name = cascade_model
+            service.moderation_prompt = prompt
+            metrics = await _evaluate(service, samples, args.concurrency)
+            metrics.update(
+                provider=provider, model=service.filter_model_name, cascade_model=cascade_model, variant=variant_name
+            )
+            results.append(metrics)
+            label = f"{cascade_model}->{service.filter_model_name}" if cascade_model else service.filter_model_name
+            print(
+                f"{provider}/{label} [{variant_name}] "
+                f"precision={_fmt(metrics['precision'])} recall={_fmt(metrics['recall'])} "
+                f"accuracy={_fmt(metrics['accuracy'])} errors={metrics['errors']} "
+                f"p50={_fmt(metrics['p50_ms'], '{:.0f}ms')} p95={_fmt(metrics['p95_ms'], '{:.0f}ms')} "
+                f"throughput={_fmt(metrics['throughput'], '{:.1f}/s')} "
+                f"tokens={metrics['input_tokens']}/{metrics['output_tokens']} cost=${metrics['cost']:.4f}"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="从数据库导出带标签的语料")
+    export_parser.add_argument("--db", help="数据库路径，默认使用 DATABASE_PATH")
+    export_parser.add_argument("--out", default="corpus.jsonl")
+    export_parser.add_argument("--allowed", help="正常消息样本文件，每行一条")
+
+    run_parser = subparsers.add_parser("run", help="回放语料并统计指标")
+    run_parser.add_argument("corpus")
+    run_parser.add_argument("--provider", action="append", choices=["gemini", "openai"], help="可重复指定")
+    run_parser.add_argument("--model", action="append", help="可重复指定，默认使用配置中的模型")
+    run_parser.add_argument("--cascade-model", action="append", help="级联初筛模型，可重复指定；默认不启用级联")
+    run_parser.add_argument("--variant-file", action="append", help="提示词变体，格式为 名称=文件路径")
+    run_parser.add_argument("--concurrency", type=int, default=4)
+    run_parser.add_argument("--limit", type=int)
+    run_parser.add_argument("--json", help="将结果写入 JSON 文件")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_corpus(args)
+    else:
+        if not args.provider:
+            from config import config
+
+            args.provider = ["openai" if config.AI_PROVIDER in ("openai", "custom") else "gemini"]
+        asyncio.run(run_evaluation(args))
+
+
+if __name__ == "__main__":
+    main()
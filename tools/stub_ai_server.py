@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 兼容桩服务器
+实现 /v1/chat/completions（含流式 SSE）与 /v1/models，用于离线评测审查效果、吞吐与故障切换。
+审查结果按关键词判定，可配置延迟、抖动与错误注入。
+
+用法: python tools/stub_ai_server.py --port 8089 --latency 0.3 --jitter 0.1 --error-rate 0.05
+然后设置 CUSTOM_AI_API_URL=http://127.0.0.1:8089/v1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from aiohttp import web
+
+DEFAULT_SPAM_KEYWORDS = [
+    "http://", "https://", "t.me/", "加群", "兼职", "刷单", "代理", "博彩", "USDT", "返利", "免费领取",
+]
+
+CHALLENGE = {
+    "question": "一周有多少天？",
+    "correct_answer": "7",
+    "incorrect_answers": ["5", "6", "8"],
+}
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+def _message_text(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if p.get("type") == "text")
+    return "\n".join(parts)
+
+
+def _user_text(messages: list) -> str:
+    return _message_text([m for m in messages if m.get("role") == "user"])
+
+
+class StubServer:
+    def __init__(self, args):
+        self.args = args
+        self.keywords = args.spam_keywords or DEFAULT_SPAM_KEYWORDS
+        self.requests = 0
+        self.errors = 0
+
+    def _is_challenge(self, body: dict) -> bool:
+        schema_name = (body.get("response_format") or {}).get("json_schema", {}).get("name")
+        return schema_name == "challenge" or "CAPTCHA" in _message_text(body.get("messages", []))
+
+    def _answer(self, body: dict) -> str:
+        if self._is_challenge(body):
+            return json.dumps(CHALLENGE, ensure_ascii=False)
+        text = _user_text(body.get("messages", []))
+        hits = [k for k in self.keywords if k.lower() in text.lower()]
+        result = {"is_spam": bool(hits)}
+        # 与 schema 的字段顺序一致，confidence 位于 reason 之前
+        if "confidence" in json.dumps(body.get("response_format") or {}):
+            result["confidence"] = 90 if hits else 85
+        result["reason"] = f"包含可疑推广内容：{hits[0]}" if hits else "内容未发现违规。"
+        return json.dumps(result, ensure_ascii=False)
+
+    async def _delay(self):
+        latency = max(0.0, random.gauss(self.args.latency, self.args.jitter))
+        await asyncio.sleep(latency)
+
+    def _inject_error(self):
+        roll = random.random()
+        if roll < self.args.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {"error": {"message": "injected server error", "type": "server_error"}}, status=500
+            )
+        if roll < self.args.error_rate + self.args.rate_limit_rate:
+            self.errors += 1
+            return web.json_response(
+                {"error": {"message": "injected rate limit", "type": "rate_limit_error"}},
+                status=429,
+                headers={"retry-after": "1"},
+            )
+        return None
+
+    async def models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+
+    async def chat_completions(self, request):
+        self.requests += 1
+        body = await request.json()
+        error = self._inject_error()
+        if error is not None:
+            await self._delay()
+            return error
+        if random.random() < self.args.hang_rate:
+            await asyncio.sleep(3600)
+
+        model = body.get("model", "stub-model")
+        content = self._answer(body)
+        prompt_tokens = _estimate_tokens(_message_text(body.get("messages", [])))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _estimate_tokens(content),
+            "total_tokens": prompt_tokens + _estimate_tokens(content),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            await self._delay()
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(max(0.0, random.gauss(self.args.ttft, self.args.jitter / 2)))
+        step = self.args.chunk_chars
+        for i in range(0, len(content), step):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(self.args.chunk_interval)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": usage,
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def stats(self, request):
+        return web.json_response({"requests": self.requests, "errors": self.errors})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3, help="非流式响应的平均延迟（秒）")
+    parser.add_argument("--ttft", type=float, default=0.15, help="流式响应首个 token 的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="延迟的标准差（秒）")
+    parser.add_argument("--chunk-chars", type=int, default=6, help="流式响应每个分片的字符数")
+    parser.add_argument("--chunk-interval", type=float, default=0.03, help="流式分片间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="请求挂起不响应的概率")
+    parser.add_argument("--spam-keywords", nargs="*", help="判定为垃圾信息的关键词")
+    args = parser.parse_args()
+
+    server = StubServer(args)
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", server.chat_completions)
+    app.router.add_get("/v1/models", server.models)
+    app.router.add_get("/stats", server.stats)
+    print(f"Stub AI server listening on http://{args.host}:{args.port}/v1")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
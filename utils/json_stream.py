@@ -0,0 +1,101 @@
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+class JSONStreamParser:
+    """Incrementally parses a flat JSON object, tolerating code fences and surrounding prose."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.values = {}
+        self.complete = False
+        self._pos = None
+        self._pending_key = None
+
+    def feed(self, chunk: str) -> dict:
+        if chunk and not self.complete:
+            self.buffer += chunk
+            self._scan()
+        return self.values
+
+    def has(self, key: str) -> bool:
+        return key in self.values
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def _skip(self, chars: str):
+        while self._pos < len(self.buffer) and self.buffer[self._pos] in chars:
+            self._pos += 1
+
+    def _scan(self):
+        if self._pos is None:
+            start = self.buffer.find("{")
+            if start == -1:
+                return
+            self._pos = start + 1
+
+        while self._pos < len(self.buffer):
+            if self._pending_key is None:
+                self._skip(_WHITESPACE + ",")
+                if self._pos >= len(self.buffer):
+                    return
+                if self.buffer[self._pos] == "}":
+                    self.complete = True
+                    return
+                if self.buffer[self._pos] != '"':
+                    # 非法字符（例如模型在对象内部夹带了说明文字），跳过
+                    self._pos += 1
+                    continue
+                try:
+                    key, end = _decoder.raw_decode(self.buffer, self._pos)
+                except json.JSONDecodeError:
+                    return
+                self._pos = end
+                self._pending_key = key
+
+            self._skip(_WHITESPACE)
+            if self._pos >= len(self.buffer):
+                return
+            if self.buffer[self._pos] == ":":
+                self._pos += 1
+                self._skip(_WHITESPACE)
+                if self._pos >= len(self.buffer):
+                    return
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self._pos)
+            except json.JSONDecodeError:
+                return
+            if end >= len(self.buffer) and isinstance(value, (int, float)) and not isinstance(value, bool):
+                # 数字可能尚未接收完整，等待下一个分隔符
+                return
+            self.values[self._pending_key] = value
+            self._pending_key = None
+            self._pos = end
+
+
+def parse_json_response(text: str) -> dict:
+    if not text:
+        raise ValueError("Empty response")
+
+    parser = JSONStreamParser()
+    parser.feed(text)
+    if parser.complete:
+        return parser.values
+
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            result = json.loads(text[start:end + 1])
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+
+    # 对象被截断（例如达到 max_tokens）时，返回已完整解析出的字段
+    if parser.values:
+        return parser.values
+    raise ValueError(f"Could not parse JSON from response: {text[:200]}")